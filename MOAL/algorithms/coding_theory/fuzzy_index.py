@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+__author__ = """Chris Tabor (dxdstudio@gmail.com)"""
+
+if __name__ == '__main__':
+    from os import getcwd
+    from os import sys
+    sys.path.append(getcwd())
+
+from collections import Counter
+from collections import defaultdict
+from random import choice
+from random import randrange as rr
+from random import sample
+from statistics import median
+from time import perf_counter
+from MOAL.algorithms.coding_theory.levenshtein_distance import lev_banded
+from MOAL.algorithms.coding_theory.levenshtein_distance import lev_bitparallel
+from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
+from MOAL.helpers.text import words_unix_dict
+
+DEBUG = True if __name__ == '__main__' else False
+
+# Two ways to answer "which words are within edit distance k of this one"
+# without computing the distance to every word in the dictionary.
+
+
+class _BKNode(object):
+
+    __slots__ = ('word', 'children')
+
+    def __init__(self, word):
+        self.word = word
+        # Distance from this word -> subtree of words at that distance.
+        self.children = {}
+
+
+class BKTree(object):
+    """Burkhard-Keller tree: https://en.wikipedia.org/wiki/BK-tree
+
+    Each child hangs off its parent by its distance to the parent word.
+    Because edit distance is a metric, the triangle inequality says a word
+    within k of the query must be in a child whose edge d' satisfies
+    |d - d'| <= k, where d is the query's distance to the parent, so every
+    other subtree can be skipped."""
+
+    def __init__(self, words=None, distance=lev_bitparallel):
+        self.distance = distance
+        self.root = None
+        self.size = 0
+        if words is not None:
+            self.build(words)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, word):
+        if self.root is None:
+            self.root = _BKNode(word)
+            self.size = 1
+            return True
+        node = self.root
+        while True:
+            dist = self.distance(word, node.word)
+            if dist == 0:
+                return False
+            child = node.children.get(dist)
+            if child is None:
+                node.children[dist] = _BKNode(word)
+                self.size += 1
+                return True
+            node = child
+
+    def build(self, words):
+        for word in words:
+            self.add(word)
+        return self
+
+    def query(self, word, max_distance):
+        """All (distance, word) pairs within `max_distance`, closest first.
+        Also returns how many distances had to be computed."""
+        if self.root is None:
+            return [], 0
+        results, computed = [], 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            dist = self.distance(word, node.word)
+            computed += 1
+            if dist <= max_distance:
+                results.append((dist, node.word))
+            for edge, child in node.children.items():
+                if dist - max_distance <= edge <= dist + max_distance:
+                    stack.append(child)
+        return sorted(results), computed
+
+
+class NGramIndex(object):
+    """An inverted index from character n-grams to the words containing
+    them, used as a filter before running the exact (banded) DP.
+
+    With the word padded by n - 1 markers on either side, a word of length
+    L has L + n - 1 n-grams, and a single edit can only destroy n of them.
+    So a word within distance k of the query shares at least
+    L + n - 1 - k * n of the query's n-grams (counting repeats), which
+    rules out most of the dictionary before any DP is done. Words must also
+    be within k of the query's length. When k is big relative to the query
+    the bound drops to zero and only the length filter is left."""
+
+    PAD = u'\x00'
+
+    def __init__(self, words=None, n=3):
+        self.n = n
+        self.words = []
+        self._ids = {}
+        # n-gram -> list of (word id, occurrences in that word).
+        self.postings = defaultdict(list)
+        # length -> word ids, for the length filter.
+        self.by_length = defaultdict(list)
+        if words is not None:
+            self.build(words)
+
+    def __len__(self):
+        return len(self.words)
+
+    def grams(self, word):
+        padded = self.PAD * (self.n - 1) + word + self.PAD * (self.n - 1)
+        return Counter(padded[k:k + self.n]
+                       for k in range(len(padded) - self.n + 1))
+
+    def add(self, word):
+        if word in self._ids:
+            return False
+        word_id = self._ids[word] = len(self.words)
+        self.words.append(word)
+        for gram, count in self.grams(word).items():
+            self.postings[gram].append((word_id, count))
+        self.by_length[len(word)].append(word_id)
+        return True
+
+    def build(self, words):
+        for word in words:
+            self.add(word)
+        return self
+
+    def candidates(self, word, max_distance):
+        """Ids of the words that pass the count and length filters."""
+        length = len(word)
+        needed = length + self.n - 1 - max_distance * self.n
+        lengths = range(max(0, length - max_distance),
+                        length + max_distance + 1)
+        if needed <= 0:
+            return [word_id for size in lengths
+                    for word_id in self.by_length.get(size, ())]
+        shared = defaultdict(int)
+        for gram, count in self.grams(word).items():
+            for word_id, occurrences in self.postings.get(gram, ()):
+                shared[word_id] += min(count, occurrences)
+        words = self.words
+        return [word_id for word_id, total in shared.items()
+                if total >= needed and
+                abs(len(words[word_id]) - length) <= max_distance]
+
+    def query(self, word, max_distance):
+        """All (distance, word) pairs within `max_distance`, closest first.
+        Also returns how many candidates were verified with the DP."""
+        candidates = self.candidates(word, max_distance)
+        results = []
+        for word_id in candidates:
+            found = self.words[word_id]
+            dist = lev_banded(word, found, max_distance)
+            if dist <= max_distance:
+                results.append((dist, found))
+        return sorted(results), len(candidates)
+
+
+def linear_scan(words, word, max_distance):
+    """The baseline: check every word."""
+    return sorted((dist, found) for dist, found in (
+        (lev_banded(word, found, max_distance), found) for found in words)
+        if dist <= max_distance), len(words)
+
+
+def load_dictionary(limit=None, min_length=1):
+    """Words from the system dictionary (see `words_unix_dict`), deduped."""
+    words = []
+    seen = set()
+    for word in words_unix_dict(min_length=min_length):
+        if word and word not in seen:
+            seen.add(word)
+            words.append(word)
+            if limit is not None and len(words) >= limit:
+                break
+    return words
+
+
+def _misspell(word, edits):
+    for _ in range(edits):
+        pos = rr(0, len(word) + 1)
+        letter = choice('abcdefghijklmnopqrstuvwxyz')
+        op = rr(0, 3) if word else 0
+        if op == 0:
+            word = word[:pos] + letter + word[pos:]
+        elif op == 1:
+            word = word[:pos] + word[pos + 1:]
+        else:
+            word = word[:pos] + letter + word[pos + 1:]
+    return word
+
+
+def benchmark_queries(words, distances=(1, 2, 3), queries=50):
+    """Median latency (in ms) and work done per query for each index,
+    looking up misspellings of random dictionary words."""
+    indexes = {
+        'linear scan': lambda word, k: linear_scan(words, word, k),
+        'bk-tree': BKTree(words).query,
+        'trigram index': NGramIndex(words).query,
+    }
+    results = {}
+    for k in distances:
+        lookups = [_misspell(word, rr(0, k + 1))
+                   for word in sample(words, min(queries, len(words)))]
+        expected = {}
+        for name, query in indexes.items():
+            times, work = [], []
+            for pos, lookup in enumerate(lookups):
+                start = perf_counter()
+                found, checked = query(lookup, k)
+                times.append((perf_counter() - start) * 1000)
+                work.append(checked)
+                # Every index has to agree with the linear scan.
+                assert expected.setdefault(pos, found) == found
+            results[(k, name)] = {
+                'median_ms': median(times), 'median_checked': median(work)}
+    return results
+
+
+if DEBUG:
+    with Section('Fuzzy lookup - BK-tree'):
+        words = ['book', 'books', 'cake', 'boo', 'boon', 'cook', 'cape',
+                 'cart', 'bake', 'boat']
+        bktree = BKTree(words)
+        found, computed = bktree.query('bok', 1)
+        print_simple('Within 1 of "bok"', found)
+        assert found == [(1, 'boo'), (1, 'book')]
+        print_simple('Distances computed', '{} of {} words'.format(
+            computed, len(words)))
+
+        print_h2('Trigram index')
+        index = NGramIndex(words)
+        assert index.query('bok', 1)[0] == found
+        assert index.query('caek', 2)[0] == linear_scan(words, 'caek', 2)[0]
+        print_simple('Within 2 of "caek"', index.query('caek', 2)[0])
+
+    with Section('Fuzzy lookup - query latency'):
+        try:
+            dictionary = load_dictionary(limit=50000)
+        except (IOError, OSError):
+            dictionary = []
+        if not dictionary:
+            print('No /usr/share/dict/words, using random words instead.')
+            dictionary = list(set(
+                ''.join(choice('abcdefghijklmnopqrstuvwxyz')
+                        for _ in range(rr(3, 12))) for _ in range(20000)))
+        print_simple('Dictionary size', len(dictionary))
+        results = benchmark_queries(dictionary)
+        for (k, name), res in sorted(results.items()):
+            print_simple('k={} {}'.format(k, name),
+                         '{:.3f}ms, {} words checked'.format(
+                             res['median_ms'], int(res['median_checked'])),
+                         newline=False)
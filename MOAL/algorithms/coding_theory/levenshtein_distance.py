@@ -7,9 +7,13 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+from random import choice
+from random import randrange as rr
 from MOAL.helpers.display import Section
 from MOAL.helpers.display import print_h2
-from MOAL.helpers.adts import list_fill
+from MOAL.helpers.display import print_simple
 import time
 
 DEBUG = True if __name__ == '__main__' else False
@@ -62,8 +66,8 @@ def lev_recursive(s1, s2, l1=None, l2=None, ct=0):
         return l2
     if l2 == 0:
         return l1
-    # Compare last characters of both cost increases if they're not equal.
-    cost = 0 if s1[::-1] == s2[::-1] else 1
+    # Compare last characters of both; cost increases if they're not equal.
+    cost = 0 if s1[l1 - 1] == s2[l2 - 1] else 1
     # Perform the distance function by returning three calls recursively
     # per operation, to determine the offset of the three scenarios:
     # short s1, short s2
@@ -94,29 +98,231 @@ def lev_iterative(s1, s2):
     Code is ported from (pseudo-code? c?) example on Wikipedia:
     wikipedia.org/wiki/Levenshtein_distance#Iterative_with_two_matrix_rows
 
-    One important thing to note: the Levenshtein function is NOT transitive,
-    so order matters! That is, lev(s1, s2) != lev(s2, s1).
+    Only the previous and current rows of the matrix are kept; rather than
+    copying one into the other after each row, the two lists just swap
+    roles. O(len(s1) * len(s2)) time, O(len(s2)) space.
     """
     basic = _check_degenerates(s1, s2)
     if basic is not None:
         return basic
-    v1, v2 = list_fill(len(s2) + 1, fill=0), list_fill(len(s2) + 1, fill=0)
-    len1, len2, lenv1 = len(s1), len(s2), len(v1)
-
-    for i in range(0, len2):
-        v1[i] = i
-
-    for i in range(0, len1):
-        v2[0] = i + 1
-        for j in range(0, len2):
-            cost = 0 if s1[i] == s2[j] else 1
-            v2[j + 1] = min(v1[j] + 1, v1[j + 1] + 1, v1[j] + cost)
-        for _j in range(0, lenv1):
-            v1[_j] = v2[_j]
-
-    dist = v2[len2]
-    print('Levenshtein distance of "{}" and "{}" is {}'.format(s1, s2, dist))
-    return dist
+    len2 = len(s2)
+    # Distance from the empty prefix of s1 to each prefix of s2.
+    prev = list(range(len2 + 1))
+    cur = [0] * (len2 + 1)
+    for i, char1 in enumerate(s1):
+        cur[0] = i + 1
+        for j, char2 in enumerate(s2):
+            cur[j + 1] = min(
+                prev[j + 1] + 1,  # Deletion
+                cur[j] + 1,  # Insertion
+                prev[j] + (char1 != char2))  # Substitution
+        prev, cur = cur, prev
+    return prev[len2]
+
+
+def lev_banded(s1, s2, max_distance):
+    """Levenshtein distance, but only if it's at most `max_distance`;
+    otherwise returns `max_distance + 1`.
+
+    Any cell more than k = `max_distance` off the diagonal is already
+    over the threshold, so only a band 2k + 1 wide is filled in (Ukkonen),
+    which is O(k * n). It stops as soon as a whole row is over the limit.
+    """
+    len1, len2 = len(s1), len(s2)
+    over = max_distance + 1
+    if abs(len1 - len2) > max_distance:
+        return over
+    if s1 == s2:
+        return 0
+    prev = [j if j <= max_distance else over for j in range(len2 + 1)]
+    cur = [over] * (len2 + 1)
+    for i in range(1, len1 + 1):
+        low, high = max(1, i - max_distance), min(len2, i + max_distance)
+        # The cells just outside the band count as over the limit.
+        cur[low - 1] = i if low == 1 and i <= max_distance else over
+        if high < len2:
+            cur[high + 1] = over
+        char1 = s1[i - 1]
+        row_min = cur[low - 1]
+        for j in range(low, high + 1):
+            dist = min(prev[j] + 1, cur[j - 1] + 1,
+                       prev[j - 1] + (char1 != s2[j - 1]))
+            cur[j] = dist
+            if dist < row_min:
+                row_min = dist
+        if row_min > max_distance:
+            return over
+        prev, cur = cur, prev
+    return min(prev[len2], over)
+
+
+# Bit-parallel edit distance: Myers (1999), as reformulated by Hyyrö
+# (2001). Rather than the matrix cells, it tracks the differences between
+# vertically adjacent cells of a column (always -1, 0 or +1) as two bit
+# vectors, VP and VN, with one bit per character of the pattern. A whole
+# column is computed with a handful of word operations, so a pattern of up
+# to 64 characters costs O(n) for a text of n characters.
+#
+# Longer patterns are split into blocks of 64 bits, and each block passes
+# its horizontal difference (the carry) on to the next one.
+
+WORD = 64
+WORD_MASK = (1 << WORD) - 1
+
+
+def _peq(pattern):
+    """For every character, a bitmask of where it appears in `pattern`,
+    split into 64 bit blocks."""
+    blocks = (len(pattern) + WORD - 1) // WORD
+    peq = {}
+    for k, char in enumerate(pattern):
+        if char not in peq:
+            peq[char] = [0] * blocks
+        peq[char][k // WORD] |= 1 << (k % WORD)
+    return peq
+
+
+def _myers(peq, length, text):
+    """Single word version, for patterns of at most 64 characters."""
+    mask = (1 << length) - 1
+    high = 1 << (length - 1)
+    vp, vn, score = mask, 0, length
+    zero = [0]
+    for char in text:
+        eq = peq.get(char, zero)[0]
+        x = eq | vn
+        d0 = (((x & vp) + vp) ^ vp) | x
+        hp = vn | (~(d0 | vp) & mask)
+        hn = vp & d0
+        if hp & high:
+            score += 1
+        elif hn & high:
+            score -= 1
+        # The top row goes up by one per column, hence the 1 shifted in.
+        hp = ((hp << 1) | 1) & mask
+        hn = (hn << 1) & mask
+        vp = hn | (~(d0 | hp) & mask)
+        vn = hp & d0
+    return score
+
+
+def _myers_blocked(peq, length, text):
+    """Blocked version for patterns longer than 64 characters."""
+    blocks = (length + WORD - 1) // WORD
+    last_high = 1 << ((length - 1) % WORD)
+    high = 1 << (WORD - 1)
+    vps, vns = [WORD_MASK] * blocks, [0] * blocks
+    score = length
+    zeros = [0] * blocks
+    for char in text:
+        eqs = peq.get(char, zeros)
+        carry = 1
+        for b in range(blocks):
+            vp, vn, eq = vps[b], vns[b], eqs[b]
+            x = eq | vn
+            if carry < 0:
+                eq |= 1
+            d0 = (((eq & vp) + vp) ^ vp) | eq
+            hp = vn | (~(d0 | vp) & WORD_MASK)
+            hn = vp & d0
+            top = last_high if b == blocks - 1 else high
+            carry_out = 1 if hp & top else (-1 if hn & top else 0)
+            hp = (hp << 1) & WORD_MASK
+            hn = (hn << 1) & WORD_MASK
+            if carry < 0:
+                hn |= 1
+            elif carry > 0:
+                hp |= 1
+            vps[b] = hn | (~(x | hp) & WORD_MASK)
+            vns[b] = hp & x
+            carry = carry_out
+        score += carry
+    return score
+
+
+def lev_bitparallel(s1, s2):
+    """Levenshtein distance with the bit-parallel algorithm, using the
+    shorter string as the pattern."""
+    if len(s1) > len(s2):
+        s1, s2 = s2, s1
+    basic = _check_degenerates(s1, s2)
+    if basic is not None:
+        return basic
+    if len(s1) <= WORD:
+        return _myers(_peq(s1), len(s1), s2)
+    return _myers_blocked(_peq(s1), len(s1), s2)
+
+
+def levenshtein(s1, s2, max_distance=None):
+    """Pick the fastest exact method: banded when there's a threshold,
+    otherwise bit-parallel."""
+    if max_distance is not None:
+        return lev_banded(s1, s2, max_distance)
+    return lev_bitparallel(s1, s2)
+
+
+_CANDIDATES = None
+
+
+def _set_candidates(candidates):
+    """Pool initializer: each worker gets the candidates once, rather
+    than with every task."""
+    global _CANDIDATES
+    _CANDIDATES = candidates
+
+
+def _distance_rows(queries, max_distance, candidates=None):
+    """Distances from each query to every candidate. The pattern bitmasks
+    are built once per query and reused for all the candidates."""
+    candidates = _CANDIDATES if candidates is None else candidates
+    rows = []
+    for query in queries:
+        length = len(query)
+        if length == 0:
+            rows.append([len(cand) for cand in candidates])
+            continue
+        peq = _peq(query)
+        myers = _myers if length <= WORD else _myers_blocked
+        row = []
+        for cand in candidates:
+            if max_distance is not None and \
+                    abs(length - len(cand)) > max_distance:
+                row.append(max_distance + 1)
+                continue
+            dist = myers(peq, length, cand)
+            if max_distance is not None and dist > max_distance:
+                dist = max_distance + 1
+            row.append(dist)
+        rows.append(row)
+    return rows
+
+
+def cdist(queries, candidates, max_distance=None, processes=None,
+          min_parallel=100000, chunk_size=64):
+    """Matrix of distances between every query and every candidate
+    (distances over `max_distance` are reported as `max_distance + 1`).
+
+    Batches of `chunk_size` queries are farmed out to a process pool once
+    there are at least `min_parallel` pairs to compare; below that, the
+    cost of starting the workers isn't worth it."""
+    queries, candidates = list(queries), list(candidates)
+    processes = processes or cpu_count() or 1
+    if processes < 2 or len(queries) * len(candidates) < min_parallel:
+        return _distance_rows(queries, max_distance, candidates)
+    chunks = [queries[k:k + chunk_size]
+              for k in range(0, len(queries), chunk_size)]
+    matrix = []
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_set_candidates,
+                             initargs=(candidates,)) as pool:
+        for rows in pool.map(_distance_rows, chunks,
+                             [max_distance] * len(chunks)):
+            matrix.extend(rows)
+    return matrix
+
+
+def _random_word(alphabet='abcdefgh', low=1, high=20):
+    return ''.join(choice(alphabet) for _ in range(rr(low, high)))
 
 
 if __name__ == '__main__':
@@ -132,4 +338,38 @@ if __name__ == '__main__':
             ('gargantua', 'pentagruel'),
         ]
         for pair in pairs:
-            lev_iterative(*pair)
+            dist = lev_iterative(*pair)
+            assert dist == lev_bitparallel(*pair) == lev_banded(
+                pair[0], pair[1], dist)
+            print('Levenshtein distance of "{}" and "{}" is {}'.format(
+                pair[0], pair[1], dist))
+        assert lev_iterative('sitting', 'kitten') == 3
+        assert lev_banded('liliputian', 'brobdingnagian', 3) == 4
+
+        print_h2('Levenshtein distance', 'bit-parallel, long strings')
+        for _ in range(200):
+            s1 = _random_word(low=0, high=150)
+            s2 = _random_word(low=0, high=150)
+            assert lev_bitparallel(s1, s2) == lev_iterative(s1, s2)
+        print('- Bit-parallel matches the DP on strings up to 150 chars.')
+
+        text1, text2 = _random_word(high=2000), _random_word(high=2000)
+        for func in [lev_iterative, lev_bitparallel]:
+            start = time.time()
+            func(text1, text2)
+            print_simple(func.__name__, '{:.4f}s'.format(time.time() - start),
+                         newline=False)
+
+    with Section('Levenshtein distance - batch fuzzy matching'):
+        words = [_random_word() for _ in range(300)]
+        queries = words[:30]
+        start = time.time()
+        matrix = cdist(queries, words, max_distance=3)
+        print_simple('Compared {} pairs'.format(len(queries) * len(words)),
+                     '{:.4f}s'.format(time.time() - start), newline=False)
+        for query, row in zip(queries, matrix):
+            assert row == [min(lev_iterative(query, word), 4)
+                           for word in words]
+        # Same results, split over a process pool.
+        assert cdist(queries, words, max_distance=3, processes=2,
+                     min_parallel=0, chunk_size=8) == matrix
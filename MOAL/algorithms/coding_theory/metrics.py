@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+__author__ = """Chris Tabor (dxdstudio@gmail.com)"""
+
+if __name__ == '__main__':
+    from os import getcwd
+    from os import sys
+    sys.path.append(getcwd())
+
+from time import time
+import numpy as np
+from MOAL.algorithms.coding_theory.hamming_distance import hamming as _hamming
+from MOAL.algorithms.coding_theory.lee_distance import lee_distance
+from MOAL.algorithms.geometry.manhattan_distance import manhattan_distance
+from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
+
+DEBUG = True if __name__ == '__main__' else False
+
+# Vectorised versions of the distances in `hamming_distance`,
+# `lee_distance` and `geometry.manhattan_distance`. Vectors are rows of a
+# 2D array, and every function compares one vector (or a block of them)
+# against many at once, so the loops run inside NumPy.
+#
+# All pairs of n and m vectors is an n x m matrix, and the intermediate
+# n x m x d array of differences is bigger still, so `cdist` and `pdist`
+# work through the rows a block at a time, sized to `memory_limit`.
+#
+# Binary fingerprints should be packed 64 bits to a uint64 with
+# `pack_bits`; their Hamming distance is then a popcount of the XOR,
+# which is 64x less data to move than one byte per bit.
+
+DEFAULT_MEMORY_LIMIT = 64 * 1024 * 1024
+
+
+def _signed(arr):
+    """Unsigned subtraction would wrap around, so widen those first."""
+    arr = np.asarray(arr)
+    if arr.dtype.kind in 'ub':
+        return arr.astype(np.int64)
+    return arr
+
+
+def hamming(u, v):
+    """Number of positions where the symbols differ."""
+    return np.count_nonzero(np.asarray(u) != np.asarray(v), axis=-1)
+
+
+def lee(u, v, q):
+    """Lee distance over an alphabet of size q: each position is the
+    shorter way round the circle of q symbols."""
+    diff = np.abs(_signed(u) - _signed(v)) % q
+    return np.minimum(diff, q - diff).sum(axis=-1)
+
+
+def manhattan(u, v):
+    return np.abs(_signed(u) - _signed(v)).sum(axis=-1)
+
+
+def pack_bits(bits):
+    """Pack rows of 0/1 values into rows of uint64 words, zero-padded up
+    to a multiple of 64 bits."""
+    bits = np.atleast_2d(np.asarray(bits, dtype=bool))
+    padding = -bits.shape[1] % 64
+    if padding:
+        bits = np.pad(bits, ((0, 0), (0, padding)))
+    # Big-endian bit order within bytes, then bytes into native words;
+    # the order doesn't matter for popcounts as long as it's consistent.
+    return np.ascontiguousarray(np.packbits(bits, axis=1)).view(np.uint64)
+
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def popcount(words):
+    """Number of set bits in each uint64."""
+    words = np.asarray(words, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    # SWAR popcount, for NumPy versions without the ufunc.
+    words = words - ((words >> np.uint64(1)) & _M1)
+    words = (words & _M2) + ((words >> np.uint64(2)) & _M2)
+    words = (words + (words >> np.uint64(4))) & _M4
+    return (words * _H01) >> np.uint64(56)
+
+
+def hamming_packed(u, v):
+    """Hamming distance between bit vectors packed with `pack_bits`."""
+    return popcount(np.bitwise_xor(u, v)).sum(axis=-1, dtype=np.int64)
+
+
+METRICS = {
+    'hamming': hamming,
+    'hamming_packed': hamming_packed,
+    'lee': lee,
+    'manhattan': manhattan,
+}
+
+
+def _metric(metric, q):
+    func = METRICS[metric] if not callable(metric) else metric
+    if func is lee:
+        if q is None:
+            raise ValueError('The Lee distance needs an alphabet size `q`')
+        return lambda u, v: lee(u, v, q)
+    return func
+
+
+def _rows_per_chunk(others, memory_limit):
+    """How many rows can be compared against all of `others` at once
+    while keeping the broadcast intermediate under `memory_limit`."""
+    per_row = max(1, others.shape[0] * others.shape[1] * 8)
+    return max(1, memory_limit // per_row)
+
+
+def one_to_many(u, vectors, metric='hamming', q=None):
+    """Distances from the vector `u` to every row of `vectors`."""
+    return _metric(metric, q)(np.asarray(u)[np.newaxis, :],
+                              np.asarray(vectors))
+
+
+def cdist_chunks(xs, ys, metric='hamming', q=None,
+                 memory_limit=DEFAULT_MEMORY_LIMIT):
+    """Yield (start row, block) pieces of the len(xs) x len(ys) distance
+    matrix, so the whole matrix never has to be in memory."""
+    xs, ys = np.atleast_2d(xs), np.atleast_2d(ys)
+    func = _metric(metric, q)
+    step = _rows_per_chunk(ys, memory_limit)
+    for start in range(0, xs.shape[0], step):
+        block = xs[start:start + step, np.newaxis, :]
+        yield start, func(block, ys[np.newaxis, :, :])
+
+
+def cdist(xs, ys, metric='hamming', q=None,
+          memory_limit=DEFAULT_MEMORY_LIMIT):
+    """Distances between every row of `xs` and every row of `ys`."""
+    xs, ys = np.atleast_2d(xs), np.atleast_2d(ys)
+    matrix = None
+    for start, block in cdist_chunks(xs, ys, metric=metric, q=q,
+                                     memory_limit=memory_limit):
+        if matrix is None:
+            matrix = np.empty((xs.shape[0], ys.shape[0]), dtype=block.dtype)
+        matrix[start:start + block.shape[0]] = block
+    if matrix is None:
+        matrix = np.empty((xs.shape[0], ys.shape[0]), dtype=np.int64)
+    return matrix
+
+
+def pdist(xs, metric='hamming', q=None, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """Condensed distance matrix of all pairs (i < j) of rows, in the same
+    order as `scipy.spatial.distance.pdist`: for each row, its distances
+    to the rows after it. Each chunk of rows is only compared with the
+    rows after its first one, so about half the full matrix is computed,
+    and chunks get bigger as there are fewer rows left to compare with."""
+    xs = np.atleast_2d(xs)
+    count = xs.shape[0]
+    func = _metric(metric, q)
+    result = None
+    offset = 0
+    start = 0
+    while start < count - 1:
+        others = xs[start + 1:]
+        stop = min(count - 1, start + _rows_per_chunk(others, memory_limit))
+        block = func(xs[start:stop, np.newaxis, :], others[np.newaxis, :, :])
+        if result is None:
+            result = np.empty(count * (count - 1) // 2, dtype=block.dtype)
+        for row in range(start, stop):
+            # Column 0 of the block is row `start + 1`.
+            tail = block[row - start, row - start:]
+            result[offset:offset + len(tail)] = tail
+            offset += len(tail)
+        start = stop
+    if result is None:
+        result = np.empty(0, dtype=np.int64)
+    return result
+
+
+def nearest(queries, vectors, k=1, metric='hamming', q=None,
+            memory_limit=DEFAULT_MEMORY_LIMIT):
+    """Brute force k nearest neighbours: (indexes, distances) arrays of
+    shape len(queries) x k, closest first. Works through the queries in
+    chunks and only ever keeps the top k of each row."""
+    vectors = np.atleast_2d(vectors)
+    k = min(k, vectors.shape[0])
+    indexes, distances = [], []
+    for _, block in cdist_chunks(queries, vectors, metric=metric, q=q,
+                                 memory_limit=memory_limit):
+        top = np.argpartition(block, k - 1, axis=1)[:, :k]
+        top_dist = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(top_dist, axis=1, kind='stable')
+        indexes.append(np.take_along_axis(top, order, axis=1))
+        distances.append(np.take_along_axis(top_dist, order, axis=1))
+    return np.concatenate(indexes), np.concatenate(distances)
+
+
+if DEBUG:
+    with Section('Distance metric kernels'):
+        rand = np.random.default_rng(1)
+        codes = rand.integers(0, 6, size=(200, 4))
+        print_simple('Lee distance, 3140 vs 2543', int(
+            lee([3, 1, 4, 0], [2, 5, 4, 3], q=6)))
+        assert lee([3, 1, 4, 0], [2, 5, 4, 3], q=6) == lee_distance(
+            3140, 2543)
+        assert hamming(list('Sanguine swine'), list('Dandelion wine')) == \
+            _hamming('Sanguine swine', 'Dandelion wine')
+        assert manhattan([1, 5], [4, 1]) == manhattan_distance(
+            {'x': 1, 'y': 5}, {'x': 4, 'y': 1})
+
+        print_h2('All pairs, chunked')
+        for metric in ['hamming', 'lee', 'manhattan']:
+            matrix = cdist(codes, codes, metric=metric, q=6,
+                           memory_limit=64 * 1024)
+            condensed = pdist(codes, metric=metric, q=6,
+                              memory_limit=64 * 1024)
+            rows, cols = np.triu_indices(len(codes), k=1)
+            assert np.array_equal(matrix[rows, cols], condensed)
+            assert np.array_equal(matrix, matrix.T)
+            print_simple(metric, 'mean distance {:.3f}'.format(
+                condensed.mean()), newline=False)
+
+    with Section('Distance metric kernels - packed fingerprints'):
+        count, bits = 100000, 256
+        fingerprints = rand.integers(0, 2, size=(count, bits), dtype=np.uint8)
+        packed = pack_bits(fingerprints)
+        print_simple('Packed shape', packed.shape)
+        queries = fingerprints[:5]
+        assert np.array_equal(
+            one_to_many(pack_bits(queries[0])[0], packed, 'hamming_packed'),
+            one_to_many(queries[0], fingerprints, 'hamming'))
+
+        for name, data, qs in [
+                ('unpacked', fingerprints, queries),
+                ('packed', packed, pack_bits(queries))]:
+            metric = 'hamming_packed' if name == 'packed' else 'hamming'
+            start = time()
+            indexes, distances = nearest(qs, data, k=3, metric=metric)
+            print_simple('{} 3-NN over {} fingerprints'.format(name, count),
+                         '{:.3f}s'.format(time() - start), newline=False)
+            assert np.all(indexes[:, 0] == np.arange(5))
+            assert np.all(distances[:, 0] == 0)
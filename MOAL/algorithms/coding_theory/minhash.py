@@ -7,9 +7,19 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
+from array import array
+from random import Random
+from random import choice
+from random import randrange as rr
+from time import time
 from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_simple
 from MOAL.helpers.display import prnt
-from random import randrange as rr
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 DEBUG = True if __name__ == '__main__' else False
@@ -31,68 +41,229 @@ def shingleify(pieces, offset=4):
 
 
 def hash_shingles(shingles):
-    hashed = []
-    for shingle in shingles:
-        hashed.append(sum(map(hash_fnv1a, shingle)))
-    return hashed
+    """One 64 bit hash per shingle. The pieces are joined with a separator
+    first, so the same pieces in a different order hash differently."""
+    return [hash_fnv1a(u'\x1f'.join(map(str, shingle))) for shingle in shingles]
 
 
 def hash_fnv1a(data):
     fnv_offset_basis = 14695981039346656037
     fnv_prime = 1099511628211
     hash = fnv_offset_basis
-    for byte in data:
-        byte = ord(byte)
+    for byte in data.encode('utf-8'):
         hash ^= byte
-        hash *= fnv_prime
+        hash = (hash * fnv_prime) & MAX_HASH_64
     return hash
 
 
-def randoms(total):
-    return [rr(1, 999) for _ in xrange(total)]
-
-
-def rehash(hash, randoms):
-    return [hash ^ n for n in randoms]
-
-
 def jaccard_coefficient_naive(set1, set2):
     set1 = set(set1)
     set2 = set(set2)
     common = float(len(set1.intersection(set2)))
     total = sum(map(len, [set1, set2]))
     total = float(total)
+    if total == 0:
+        return 1.0
     jaccard_coef = common / (total - common)
     print('Jaccard naive: {} / ({} - {}) = {} ({}%)'.format(
         common, total, common, jaccard_coef, jaccard_coef * 100))
     return jaccard_coef
 
 
-def jaccard_coefficient(set1, set2):
-    shingles = shingleify(list(set1) + list(set2))
-    rounds = len(shingles) % 4
-    coeffs = []
-    for round in range(rounds):
-        res = jaccard_coefficient_naive(
-            shingles[round - 1], shingles[round])
-        coeffs.append(res)
-    coeff = 0
-    if len(coeffs) > 0:
-        coeff = max(coeffs)
-    print('Jaccard - coeffs: {}, max coeff: {})'.format(coeffs, coeff))
-    return coeff
-
-
-def min_hash(set1, set2):
-    shingles = shingleify(list(set1) + list(set2))
-    hashes = hash_shingles(shingles)
-    hash = None
-    if len(hashes) > 0:
-        hash = min(hashes)
-    # Hash a second time with random numbers xor'd
-    new_hashes = rehash(hash, randoms(len(hashes)))
-    print('Hashes: {}'.format(new_hashes))
-    return new_hashes
+def shingle_hashes(tokens, offset=4):
+    """Hashes of the shingles of a token sequence. Sequences shorter than
+    `offset` become a single shingle, so they still get a signature."""
+    tokens = list(tokens)
+    shingles = shingleify(tokens, offset=offset) if len(
+        tokens) >= offset else ([tokens] if tokens else [])
+    return hash_shingles(shingles)
+
+
+def jaccard_coefficient(set1, set2, offset=4):
+    """The exact Jaccard coefficient of the two sequences' shingle sets,
+    which is what MinHash estimates."""
+    first = set(shingle_hashes(set1, offset=offset))
+    second = set(shingle_hashes(set2, offset=offset))
+    union = first | second
+    if not union:
+        return 1.0
+    return len(first & second) / float(len(union))
+
+
+# MinHash (Broder, 1997): for a random permutation of all possible
+# shingles, the chance that two sets have the same minimum element is
+# exactly their Jaccard coefficient. k independent "permutations" give k
+# minimums - the signature - and the fraction of positions where two
+# signatures agree estimates the coefficient with error ~ 1 / sqrt(k).
+#
+# Real permutations are far too big, so each one is simulated with a
+# universal hash h(x) = (a * x + b) mod p over the shingle hashes. With
+# p = 2^31 - 1 and x, a, b < p, a * x + b always fits in 64 bits, so the
+# arithmetic is exact in a uint64 array.
+
+MAX_HASH_64 = (1 << 64) - 1
+MERSENNE_PRIME = (1 << 31) - 1
+# Hash the document shingles this many at a time, to bound the size of
+# the (permutations x shingles) matrix.
+SIGNATURE_CHUNK = 4096
+
+
+class MinHasher(object):
+
+    def __init__(self, num_perm=128, seed=1):
+        rand = Random(seed)
+        self.num_perm = num_perm
+        a = [rand.randrange(1, MERSENNE_PRIME) for _ in range(num_perm)]
+        b = [rand.randrange(0, MERSENNE_PRIME) for _ in range(num_perm)]
+        if np is not None:
+            self.a = np.array(a, dtype=np.uint64)[:, np.newaxis]
+            self.b = np.array(b, dtype=np.uint64)[:, np.newaxis]
+        else:
+            self.a, self.b = a, b
+
+    def signature(self, hashes):
+        """The MinHash signature (num_perm uint64 values) of a collection
+        of 64 bit shingle hashes."""
+        if np is None:
+            return self._signature_python(hashes)
+        values = np.fromiter((value % MERSENNE_PRIME for value in hashes),
+                             dtype=np.uint64)
+        signature = np.full(self.num_perm, MERSENNE_PRIME, dtype=np.uint64)
+        for start in range(0, len(values), SIGNATURE_CHUNK):
+            chunk = values[np.newaxis, start:start + SIGNATURE_CHUNK]
+            permuted = (self.a * chunk + self.b) % np.uint64(MERSENNE_PRIME)
+            np.minimum(signature, permuted.min(axis=1), out=signature)
+        return signature
+
+    def _signature_python(self, hashes):
+        values = [value % MERSENNE_PRIME for value in hashes]
+        return array('Q', [
+            min([(a * value + b) % MERSENNE_PRIME for value in values] or [
+                MERSENNE_PRIME]) for a, b in zip(self.a, self.b)])
+
+    def tokens_signature(self, tokens, offset=4):
+        return self.signature(shingle_hashes(tokens, offset=offset))
+
+    @staticmethod
+    def similarity(sig1, sig2):
+        """Estimated Jaccard coefficient of two signatures."""
+        if np is not None:
+            return float(np.mean(np.asarray(sig1) == np.asarray(sig2)))
+        return sum(1 for x, y in zip(sig1, sig2) if x == y) / float(
+            len(sig1))
+
+
+def min_hash(set1, set2, num_perm=128, offset=4):
+    """Estimate the Jaccard coefficient of two sequences' shingle sets
+    from their MinHash signatures."""
+    hasher = MinHasher(num_perm=num_perm)
+    return hasher.similarity(hasher.tokens_signature(set1, offset=offset),
+                             hasher.tokens_signature(set2, offset=offset))
+
+
+def _false_probabilities(threshold, bands, rows, steps=100):
+    """Probability mass of false positives (below the threshold) and false
+    negatives (above it) for a given banding, integrating the S-curve
+    1 - (1 - s^r)^b numerically."""
+    false_pos = false_neg = 0.0
+    for step in range(steps):
+        sim = (step + 0.5) / steps
+        hit = 1 - (1 - sim ** rows) ** bands
+        if sim < threshold:
+            false_pos += hit / steps
+        else:
+            false_neg += (1 - hit) / steps
+    return false_pos, false_neg
+
+
+def optimal_bands(threshold, num_perm):
+    """The (bands, rows) split of the signature with the least combined
+    false positive and false negative probability at `threshold`."""
+    best, best_cost = None, None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            cost = sum(_false_probabilities(threshold, bands, rows))
+            if best_cost is None or cost < best_cost:
+                best, best_cost = (bands, rows), cost
+    return best
+
+
+class LSHIndex(object):
+    """Locality-sensitive hashing over MinHash signatures.
+
+    The signature is cut into b bands of r rows, and each band is hashed
+    into its own table. Two documents become candidates if any band
+    matches exactly, which happens with probability 1 - (1 - s^r)^b for
+    Jaccard similarity s: an S-curve that is steep around
+    (1/b)^(1/r). Lookups only touch b buckets, however many documents
+    are indexed.
+
+    Only the band keys are stored, unless `keep_signatures` is set, in
+    which case candidates are re-ranked by estimated similarity."""
+
+    def __init__(self, threshold=0.5, num_perm=128, shingle_size=4,
+                 seed=1, keep_signatures=True):
+        self.hasher = MinHasher(num_perm=num_perm, seed=seed)
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+        self.tables = [{} for _ in range(self.bands)]
+        self.signatures = {} if keep_signatures else None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        for band in range(self.bands):
+            yield signature[band * rows:(band + 1) * rows].tobytes()
+
+    def add(self, doc_id, tokens):
+        signature = self.hasher.tokens_signature(
+            tokens, offset=self.shingle_size)
+        for table, key in zip(self.tables, self._band_keys(signature)):
+            bucket = table.get(key)
+            if bucket is None:
+                table[key] = [doc_id]
+            else:
+                bucket.append(doc_id)
+        if self.signatures is not None:
+            self.signatures[doc_id] = signature
+        self.count += 1
+        return signature
+
+    def candidates(self, signature):
+        found = set()
+        for table, key in zip(self.tables, self._band_keys(signature)):
+            found.update(table.get(key, ()))
+        return found
+
+    def query(self, tokens):
+        """Ids of documents likely to be at least `threshold` similar.
+        With stored signatures, returns (estimate, doc_id) pairs above the
+        threshold instead, most similar first."""
+        signature = self.hasher.tokens_signature(
+            tokens, offset=self.shingle_size)
+        found = self.candidates(signature)
+        if self.signatures is None:
+            return found
+        ranked = [(self.hasher.similarity(signature, self.signatures[doc]),
+                   doc) for doc in found]
+        return sorted([pair for pair in ranked if pair[0] >= self.threshold],
+                      key=lambda pair: (-pair[0], str(pair[1])))
+
+
+def _near_duplicates(vocabulary, docs, length=60, noise=0.1):
+    """Random documents, each followed by a lightly edited copy."""
+    corpus = []
+    for num in range(docs):
+        doc = [choice(vocabulary) for _ in range(length)]
+        copy = [choice(vocabulary) if rr(0, 100) < noise * 100 else word
+                for word in doc]
+        corpus.append(('doc{}'.format(num), doc))
+        corpus.append(('doc{}-copy'.format(num), copy))
+    return corpus
 
 
 if __name__ == '__main__':
@@ -110,5 +281,33 @@ if __name__ == '__main__':
         for sets in comparisons:
             prnt('Testing:', sets)
             jaccard_coefficient_naive(*sets)
-            jaccard_coefficient(*sets)
-            min_hash(*sets)
+            print('Exact: {:.3f}, MinHash estimate: {:.3f}'.format(
+                jaccard_coefficient(*sets, offset=1),
+                min_hash(*sets, offset=1)))
+
+        text1 = 'the quick brown fox jumps over the lazy dog ' * 3
+        text2 = text1.replace('lazy', 'sleepy')
+        exact = jaccard_coefficient(text1.split(), text2.split(), offset=2)
+        estimate = min_hash(text1.split(), text2.split(), num_perm=256,
+                            offset=2)
+        assert abs(exact - estimate) < 0.15
+        print_simple('Shingled sentences, exact vs estimate', (
+            round(exact, 3), round(estimate, 3)))
+
+    with Section('MinHash - LSH near-duplicate index'):
+        vocabulary = ['word{}'.format(num) for num in range(5000)]
+        corpus = _near_duplicates(vocabulary, 1000, noise=0.05)
+        index = LSHIndex(threshold=0.5, num_perm=128, shingle_size=2)
+        print_simple('Bands x rows', (index.bands, index.rows))
+        start = time()
+        for doc_id, tokens in corpus:
+            index.add(doc_id, tokens)
+        print_simple('Indexed {} documents'.format(len(index)),
+                     '{:.3f}s'.format(time() - start), newline=False)
+        start, found = time(), 0
+        for doc_id, tokens in corpus[::2]:
+            matches = [doc for _, doc in index.query(tokens)]
+            found += '{}-copy'.format(doc_id) in matches
+        print_simple('Copies found', '{} of {} in {:.3f}s'.format(
+            found, len(corpus) // 2, time() - start), newline=False)
+        assert found > 0.9 * len(corpus) // 2
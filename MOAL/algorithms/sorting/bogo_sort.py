@@ -8,6 +8,7 @@ if __name__ == '__main__':
     sys.path.append(getcwd())
 
 from MOAL.helpers.display import Section
+from MOAL.helpers.trials import QUICK_TRIALS
 from MOAL.helpers.trials import run_sorting_trials
 from random import randrange as rr
 from pprint import pprint as ppr
@@ -31,4 +32,5 @@ def bogo_sort(items):
 
 if __name__ == '__main__':
     with Section('Bogo Sort (LOL)'):
-        ppr(run_sorting_trials(bogo_sort, magnitudes=[3, 5, 10]))
+        ppr(run_sorting_trials(
+            bogo_sort, magnitudes=[3, 5, 10], **QUICK_TRIALS))
@@ -8,6 +8,7 @@ if __name__ == '__main__':
     sys.path.append(getcwd())
 
 from MOAL.helpers.display import Section
+from MOAL.helpers.trials import QUICK_TRIALS
 from MOAL.helpers.trials import run_sorting_trials
 from pprint import pprint as ppr
 
@@ -34,4 +35,5 @@ def bubble_sort(items):
 
 if __name__ == '__main__':
     with Section('Bubble Sort'):
-        ppr(run_sorting_trials(bubble_sort, test_output=True))
+        ppr(run_sorting_trials(
+            bubble_sort, test_output=True, **QUICK_TRIALS))
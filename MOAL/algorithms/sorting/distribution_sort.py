@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+__author__ = """Chris Tabor (dxdstudio@gmail.com)"""
+
+if __name__ == '__main__':
+    from os import getcwd
+    from os import sys
+    sys.path.append(getcwd())
+
+from itertools import chain
+from math import isfinite
+from random import randrange as rr
+from random import random
+from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.trials import QUICK_TRIALS
+from MOAL.helpers.trials import run_sorting_trials
+from pprint import pprint as ppr
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Distribution (non-comparison) sorts. Instead of comparing items, these
+# look at the keys themselves - their value or their digits - and put each
+# item straight into the right place or bucket, which beats the
+# O(n log n) lower bound for comparison sorts when the keys are bounded:
+#
+# - Counting sort: O(n + k) for integers spanning a range of k values.
+# - LSD radix sort: O(n * w / d) for w-bit integers, d bits per pass.
+# - MSD radix sort: for byte strings, bucketing on one byte at a time and
+#   only recursing into buckets that still need it.
+# - Bucket sort: O(n) expected for uniformly distributed numbers.
+#
+# Unlike the other sorts in this package, these return a new list.
+
+RADIX_BITS = 8
+# Buckets smaller than this are finished with a comparison sort.
+MSD_CUTOFF = 32
+
+
+def counting_sort(items, key=None, min_value=None, max_value=None):
+    """Stable sort of integers (or items with integer keys). Raises
+    ValueError if a key falls outside `min_value`..`max_value`, when
+    those are given."""
+    if not items:
+        return []
+    keys = items if key is None else [key(item) for item in items]
+    low = min(keys) if min_value is None else min_value
+    high = max(keys) if max_value is None else max_value
+    if min_value is not None or max_value is not None:
+        if min(keys) < low or max(keys) > high:
+            raise ValueError('Keys must be between {} and {}'.format(
+                low, high))
+    counts = [0] * (high - low + 1)
+    for k in keys:
+        counts[k - low] += 1
+    if key is None:
+        # The items are the keys, so there's nothing to carry along.
+        return list(chain.from_iterable(
+            [value] * count for value, count in enumerate(counts, low)
+            if count))
+    # Turn the counts into starting offsets, then place each item.
+    total = 0
+    for value, count in enumerate(counts):
+        counts[value] = total
+        total += count
+    result = [None] * len(items)
+    for k, item in zip(keys, items):
+        result[counts[k - low]] = item
+        counts[k - low] += 1
+    return result
+
+
+def _lsd_radix_sort_numpy(items, low, high):
+    arr = np.asarray(items, dtype=np.int64)
+    offsets = (arr - low).astype(np.uint64)
+    # NumPy's stable sort *is* a radix sort for 16 bit (and smaller)
+    # integers, so each pass sorts on a 16 bit digit.
+    for shift in range(0, max(1, (high - low).bit_length()), 16):
+        digits = ((offsets >> np.uint64(shift)) & np.uint64(0xFFFF)).astype(
+            np.uint16)
+        offsets = offsets[np.argsort(digits, kind='stable')]
+    return (offsets.astype(np.int64) + low).tolist()
+
+
+def lsd_radix_sort(items, bits=RADIX_BITS):
+    """Sort fixed-width integers a digit of `bits` bits at a time,
+    least significant first. Negative numbers are handled by sorting
+    their offset from the minimum."""
+    if len(items) < 2:
+        return list(items)
+    low, high = min(items), max(items)
+    if np is not None and -2 ** 63 <= low and high < 2 ** 63 and \
+            high - low < 2 ** 63:
+        return _lsd_radix_sort_numpy(items, low, high)
+    mask = (1 << bits) - 1
+    offsets = [num - low for num in items]
+    for shift in range(0, max(1, (high - low).bit_length()), bits):
+        buckets = [[] for _ in range(mask + 1)]
+        for num in offsets:
+            buckets[(num >> shift) & mask].append(num)
+        offsets = list(chain.from_iterable(buckets))
+    return [num + low for num in offsets]
+
+
+def msd_radix_sort(items):
+    """Sort byte strings, bucketing on the first byte, then the second
+    byte within each bucket, and so on. Uses an explicit stack, so long
+    shared prefixes can't hit the recursion limit."""
+    result = []
+    # Buckets are pushed in reverse, so they're popped in order and
+    # everything is appended to `result` in its final position.
+    stack = [(list(items), 0)]
+    while stack:
+        bucket, depth = stack.pop()
+        if len(bucket) < MSD_CUTOFF:
+            result.extend(sorted(bucket))
+            continue
+        # Strings that end here sort before all the longer ones.
+        ended = []
+        buckets = [[] for _ in range(256)]
+        for string in bucket:
+            if len(string) == depth:
+                ended.append(string)
+            else:
+                buckets[string[depth]].append(string)
+        for sub in reversed(buckets):
+            if sub:
+                stack.append((sub, depth + 1))
+        result.extend(ended)
+    return result
+
+
+def _finite(keys):
+    """False if any key is infinite or NaN (or an int too big to be
+    a float), since those can't be placed in a bucket."""
+    try:
+        return all(isfinite(k) for k in keys)
+    except OverflowError:
+        return False
+
+
+def bucket_sort(items, buckets=None, key=None):
+    """Stable sort for numbers spread evenly over their range; each
+    bucket is then sorted with a comparison sort. Falls back to `sorted`
+    for infinities and NaNs."""
+    if len(items) < 2:
+        return list(items)
+    keys = items if key is None else [key(item) for item in items]
+    if not _finite(keys):
+        return sorted(items, key=key)
+    low, high = min(keys), max(keys)
+    if low == high:
+        return list(items)
+    if not isfinite(high - low):
+        return sorted(items, key=key)
+    count = buckets or len(items)
+    scale = count / float(high - low)
+    slots = [[] for _ in range(count)]
+    for k, item in zip(keys, items):
+        slots[min(int((k - low) * scale), count - 1)].append(item)
+    result = []
+    for slot in slots:
+        if len(slot) > 1:
+            slot.sort(key=key)
+        result.extend(slot)
+    return result
+
+
+def choose_sort(items, key=None):
+    """Pick the sort best suited to the keys: counting sort for integers
+    in a range not much bigger than the input, radix sort for other
+    integers and for byte strings, bucket sort for floats, and the
+    built-in sort for anything else."""
+    if len(items) < MSD_CUTOFF:
+        return sorted
+    keys = items if key is None else [key(item) for item in items]
+    kinds = set(map(type, keys))
+    if kinds == {int}:
+        if max(keys) - min(keys) <= 2 * len(keys):
+            return counting_sort
+        return sorted if key is not None else lsd_radix_sort
+    if key is not None:
+        return sorted
+    if kinds == {bytes}:
+        return msd_radix_sort
+    if kinds <= {int, float}:
+        return bucket_sort if _finite(keys) else sorted
+    return sorted
+
+
+def auto_sort(items, key=None):
+    sorting_func = choose_sort(items, key=key)
+    if key is None:
+        return sorting_func(items)
+    return sorting_func(items, key=key)
+
+
+def _random_bytes(magnitude):
+    return [bytes(rr(97, 123) for _ in range(rr(1, 12)))
+            for _ in range(magnitude)]
+
+
+def _small_integers(magnitude):
+    return [rr(0, 999) for _ in range(magnitude)]
+
+
+def _wide_integers(magnitude):
+    return [rr(-2 ** 63, 2 ** 63) for _ in range(magnitude)]
+
+
+def _uniform_floats(magnitude):
+    return [random() for _ in range(magnitude)]
+
+
+if __name__ == '__main__':
+    magnitudes = [10, 100, 1000, 10000, 100000]
+
+    with Section('Distribution Sorts - small integers'):
+        for func in [counting_sort, lsd_radix_sort, bucket_sort, sorted]:
+            ppr(run_sorting_trials(
+                func, magnitudes=magnitudes, generator=_small_integers,
+                **QUICK_TRIALS))
+
+    with Section('Distribution Sorts - 64 bit integers'):
+        for func in [lsd_radix_sort, sorted]:
+            ppr(run_sorting_trials(
+                func, magnitudes=magnitudes, generator=_wide_integers,
+                **QUICK_TRIALS))
+
+    with Section('Distribution Sorts - byte strings'):
+        for func in [msd_radix_sort, sorted]:
+            ppr(run_sorting_trials(
+                func, magnitudes=magnitudes, generator=_random_bytes,
+                **QUICK_TRIALS))
+
+    with Section('Distribution Sorts - uniform floats'):
+        for func in [bucket_sort, sorted]:
+            ppr(run_sorting_trials(
+                func, magnitudes=magnitudes, generator=_uniform_floats,
+                **QUICK_TRIALS))
+
+    with Section('Distribution Sorts - automatic selection'):
+        samples = {
+            'small ints': [rr(0, 999) for _ in range(1000)],
+            'wide ints': [rr(-10 ** 12, 10 ** 12) for _ in range(1000)],
+            'bytes': _random_bytes(1000),
+            'floats': [random() for _ in range(1000)],
+            'floats and inf': [random() for _ in range(500)] + [
+                float('inf'), float('-inf')],
+            'floats and nan': [random() for _ in range(500)] + [
+                float('nan')],
+            'str': [str(rr(0, 999)) for _ in range(1000)],
+        }
+        for name, items in samples.items():
+            func = choose_sort(items)
+            assert auto_sort(items) == sorted(items)
+            print('- {}: {}'.format(name, func.__name__))
+
+        print_h2('Stable counting sort by key')
+        people = [('ann', 31), ('bob', 25), ('cy', 31), ('di', 25)]
+        by_age = counting_sort(people, key=lambda person: person[1])
+        assert by_age == [('bob', 25), ('di', 25), ('ann', 31), ('cy', 31)]
+        ppr(by_age)
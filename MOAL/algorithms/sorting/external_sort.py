@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+__author__ = """Chris Tabor (dxdstudio@gmail.com)"""
+
+if __name__ == '__main__':
+    from os import getcwd
+    from os import sys
+    sys.path.append(getcwd())
+
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from heapq import merge
+from itertools import islice
+from random import randrange as rr
+from sys import getsizeof
+from tempfile import TemporaryDirectory
+from time import time
+from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
+
+# External merge sort: https://en.wikipedia.org/wiki/External_sorting
+#
+# 1. Read the input in runs that fit in `memory_limit` bytes, sort each
+#    run in memory and spill it to a temp file.
+# 2. k-way merge the run files with `heapq.merge`, reading each one
+#    through a buffered reader, a batch at a time.
+#
+# Run files are a sequence of pickled lists of `batch_size` items, which
+# is compact, handles any picklable item, and means a reader only ever
+# holds one batch per run. If there are more runs than `max_fan_in`,
+# groups of them are merged into bigger runs first, so the number of open
+# files stays bounded.
+#
+# Item sizes are estimated with `sys.getsizeof`, which doesn't count what
+# the item refers to, so treat the limit as a rough budget, not a cap.
+
+DEFAULT_MEMORY_LIMIT = 64 * 1024 * 1024
+READ_BUFFER = 1024 * 1024
+
+
+def _write_run(items, path, batch_size):
+    with open(path, 'wb', buffering=READ_BUFFER) as run:
+        iterator = iter(items)
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                break
+            pickle.dump(batch, run, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_run(path):
+    with open(path, 'rb', buffering=READ_BUFFER) as run:
+        while True:
+            try:
+                batch = pickle.load(run)
+            except EOFError:
+                return
+            for item in batch:
+                yield item
+
+
+def _sort_and_spill(sorting_func, key, items, path, batch_size):
+    """Sort one run and write it out. Module level so it can run in a
+    worker process; returns the number of items written."""
+    items = sorting_func(items) if key is None else sorting_func(
+        items, key=key)
+    _write_run(items, path, batch_size)
+    return len(items)
+
+
+class ExternalSort(object):
+    """Sorts iterables too big to fit in memory, yielding the items in
+    order. With `processes` > 1 the runs are sorted and spilled by a
+    process pool while the main process keeps reading input; `key` and
+    `sorting_func` then have to be picklable."""
+
+    def __init__(self, memory_limit=DEFAULT_MEMORY_LIMIT, key=None,
+                 sorting_func=sorted, batch_size=1024, max_fan_in=64,
+                 processes=1, tmpdir=None):
+        if max_fan_in < 2:
+            raise ValueError('Fan in must be at least 2')
+        self.memory_limit = memory_limit
+        self.key = key
+        self.sorting_func = sorting_func
+        self.batch_size = batch_size
+        self.max_fan_in = max_fan_in
+        self.processes = processes
+        self.tmpdir = tmpdir
+        # Stats from the last sort.
+        self.runs = 0
+        self.merge_passes = 0
+
+    def _read_runs(self, iterable):
+        """Yield lists of items whose estimated size fits the limit."""
+        run, used = [], 0
+        for item in iterable:
+            run.append(item)
+            used += getsizeof(item) + 8
+            if used >= self.memory_limit:
+                yield run
+                run, used = [], 0
+        if run:
+            yield run
+
+    def _spill(self, iterable, workdir):
+        paths = []
+
+        def next_path():
+            paths.append(os.path.join(workdir, 'run{}'.format(len(paths))))
+            return paths[-1]
+
+        if self.processes < 2:
+            for run in self._read_runs(iterable):
+                _sort_and_spill(self.sorting_func, self.key, run,
+                                next_path(), self.batch_size)
+            return paths
+        with ProcessPoolExecutor(max_workers=self.processes) as pool:
+            pending = []
+            for run in self._read_runs(iterable):
+                pending.append(pool.submit(
+                    _sort_and_spill, self.sorting_func, self.key, run,
+                    next_path(), self.batch_size))
+                del run
+                # Don't read further ahead than the pool can keep up with,
+                # or the queued runs would blow the memory budget.
+                if len(pending) >= self.processes:
+                    pending.pop(0).result()
+            for future in pending:
+                future.result()
+        return paths
+
+    def _merged(self, paths):
+        return merge(*[_read_run(path) for path in paths], key=self.key)
+
+    def _reduce(self, paths, workdir):
+        """Merge groups of runs until at most `max_fan_in` are left."""
+        while len(paths) > self.max_fan_in:
+            self.merge_passes += 1
+            merged = []
+            for start in range(0, len(paths), self.max_fan_in):
+                group = paths[start:start + self.max_fan_in]
+                path = '{}.{}'.format(group[0], self.merge_passes)
+                _write_run(self._merged(group), path, self.batch_size)
+                for old in group:
+                    os.remove(old)
+                merged.append(path)
+            paths = merged
+        return paths
+
+    def iter_sorted(self, iterable):
+        self.runs, self.merge_passes = 0, 0
+        with TemporaryDirectory(dir=self.tmpdir) as workdir:
+            paths = self._spill(iterable, workdir)
+            self.runs = len(paths)
+            paths = self._reduce(paths, workdir)
+            self.merge_passes += 1
+            for item in self._merged(paths):
+                yield item
+
+    def sort_lines(self, in_path, out_path, skip_header=False):
+        """Sort a text file line by line (e.g. CSV or NDJSON exports),
+        with `key` applied to each line. A CSV header can be kept in
+        place with `skip_header`."""
+        with open(in_path, buffering=READ_BUFFER) as source, \
+                open(out_path, 'w', buffering=READ_BUFFER) as dest:
+            if skip_header:
+                dest.write(next(source, ''))
+            for line in self.iter_sorted(source):
+                if not line.endswith('\n'):
+                    line += '\n'
+                dest.write(line)
+
+
+def external_sort(iterable, key=None, memory_limit=DEFAULT_MEMORY_LIMIT,
+                  processes=1):
+    return ExternalSort(memory_limit=memory_limit, key=key,
+                        processes=processes).iter_sorted(iterable)
+
+
+def _csv_amount(line):
+    return int(line.split(',')[1])
+
+
+if __name__ == '__main__':
+    with Section('External Merge Sort'):
+        items = [rr(0, 1000000) for _ in range(200000)]
+        # Small enough that the input is spread over a few dozen runs.
+        sorter = ExternalSort(memory_limit=256 * 1024, max_fan_in=8)
+        start = time()
+        result = list(sorter.iter_sorted(iter(items)))
+        print_simple('Sorted 200,000 items', '{:.3f}s, {} runs, {} passes'
+                     .format(time() - start, sorter.runs,
+                             sorter.merge_passes), newline=False)
+        assert result == sorted(items)
+
+        print_h2('Sorting a CSV file by column')
+        with TemporaryDirectory() as workdir:
+            source = os.path.join(workdir, 'export.csv')
+            dest = os.path.join(workdir, 'sorted.csv')
+            with open(source, 'w') as csv:
+                csv.write('id,amount\n')
+                for num in range(50000):
+                    csv.write('{},{}\n'.format(num, rr(0, 100000)))
+            sorter = ExternalSort(memory_limit=512 * 1024, key=_csv_amount,
+                                  processes=2)
+            sorter.sort_lines(source, dest, skip_header=True)
+            with open(dest) as csv:
+                assert next(csv) == 'id,amount\n'
+                amounts = [_csv_amount(line) for line in csv]
+            assert len(amounts) == 50000 and amounts == sorted(amounts)
+            print_simple('Rows sorted', len(amounts))
+            print_simple('Runs spilled in parallel', sorter.runs)
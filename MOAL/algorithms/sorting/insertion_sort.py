@@ -9,6 +9,7 @@ if __name__ == '__main__':
 
 from MOAL.helpers.display import Section
 from MOAL.helpers.display import prnt
+from MOAL.helpers.trials import QUICK_TRIALS
 from MOAL.helpers.trials import run_sorting_trials
 
 
@@ -35,5 +36,5 @@ def insertion_sort(items):
 
 if __name__ == '__main__':
     with Section('Insertion Sort'):
-        results = run_sorting_trials(insertion_sort)
+        results = run_sorting_trials(insertion_sort, **QUICK_TRIALS)
         prnt('Insertion sort results:', results)
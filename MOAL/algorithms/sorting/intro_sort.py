@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+__author__ = """Chris Tabor (dxdstudio@gmail.com)"""
+
+if __name__ == '__main__':
+    from os import getcwd
+    from os import sys
+    sys.path.append(getcwd())
+
+from MOAL.helpers.display import Section
+from MOAL.helpers.trials import QUICK_TRIALS
+from MOAL.helpers.trials import run_sorting_trials
+from pprint import pprint as ppr
+
+# Introsort (Musser, 1997) with some of the refinements from
+# pattern-defeating quicksort (Peters, 2021):
+#   https://en.wikipedia.org/wiki/Introsort
+#   https://github.com/orlp/pdqsort
+#
+# - Quicksort, but small ranges are finished with insertion sort.
+# - Pivots are the median of three, or for big ranges Tukey's "ninther"
+#   (median of three medians of three), which defeats the classic
+#   sorted/reversed/organ-pipe worst cases.
+# - If recursion gets deeper than ~2 log2(n) (i.e. the pivots keep
+#   being bad), the range is heapsorted instead, so it's O(n log n) always.
+# - Only the smaller partition is recursed into and the bigger one is
+#   looped on, so the stack depth is O(log n) regardless.
+# - If a partition needed no swaps at all, the range was probably already
+#   sorted; a bounded insertion sort tries to finish it in linear time.
+#
+# With `key`, the keys are computed once up front and kept in a parallel
+# list; every swap is applied to both lists.
+
+INSERTION_THRESHOLD = 16
+NINTHER_THRESHOLD = 128
+# Give up on the optimistic insertion sort after this many moves.
+PARTIAL_INSERTION_LIMIT = 8
+
+
+class _Ranges(object):
+    """The list being sorted, plus (optionally) the items that ride
+    along with it when sorting by key."""
+
+    __slots__ = ('keys', 'values')
+
+    def __init__(self, keys, values):
+        self.keys = keys
+        self.values = values
+
+    def swap(self, i, j):
+        keys = self.keys
+        keys[i], keys[j] = keys[j], keys[i]
+        if self.values is not None:
+            values = self.values
+            values[i], values[j] = values[j], values[i]
+
+
+def _insertion_sort(data, low, high):
+    """Sort keys[low:high] in place."""
+    keys, values = data.keys, data.values
+    for i in range(low + 1, high):
+        key = keys[i]
+        if not key < keys[i - 1]:
+            continue
+        value = values[i] if values is not None else None
+        j = i - 1
+        while j >= low and key < keys[j]:
+            keys[j + 1] = keys[j]
+            if values is not None:
+                values[j + 1] = values[j]
+            j -= 1
+        keys[j + 1] = key
+        if values is not None:
+            values[j + 1] = value
+
+
+def _partial_insertion_sort(data, low, high):
+    """Insertion sort that bails out after a few moves. Returns True if
+    the range ended up sorted."""
+    keys, values = data.keys, data.values
+    moves = 0
+    for i in range(low + 1, high):
+        key = keys[i]
+        if not key < keys[i - 1]:
+            continue
+        value = values[i] if values is not None else None
+        j = i - 1
+        while j >= low and key < keys[j]:
+            keys[j + 1] = keys[j]
+            if values is not None:
+                values[j + 1] = values[j]
+            j -= 1
+        keys[j + 1] = key
+        if values is not None:
+            values[j + 1] = value
+        moves += i - j - 1
+        if moves > PARTIAL_INSERTION_LIMIT:
+            return False
+    return True
+
+
+def _sift_down(data, low, start, end):
+    keys = data.keys
+    root = start
+    while True:
+        child = 2 * (root - low) + 1 + low
+        if child >= end:
+            return
+        if child + 1 < end and keys[child] < keys[child + 1]:
+            child += 1
+        if keys[root] < keys[child]:
+            data.swap(root, child)
+            root = child
+        else:
+            return
+
+
+def _heap_sort(data, low, high):
+    """Sort keys[low:high] in place with a max heap."""
+    for start in range((high - low) // 2 - 1 + low, low - 1, -1):
+        _sift_down(data, low, start, high)
+    for end in range(high - 1, low, -1):
+        data.swap(low, end)
+        _sift_down(data, low, low, end)
+
+
+def _sort3(data, a, b, c):
+    """Order the three positions so keys[a] <= keys[b] <= keys[c]."""
+    keys = data.keys
+    if keys[b] < keys[a]:
+        data.swap(a, b)
+    if keys[c] < keys[b]:
+        data.swap(b, c)
+        if keys[b] < keys[a]:
+            data.swap(a, b)
+
+
+def _choose_pivot(data, low, high):
+    """Move the chosen pivot to `low`."""
+    size = high - low
+    mid = low + size // 2
+    if size > NINTHER_THRESHOLD:
+        step = size // 8
+        _sort3(data, low, low + step, low + 2 * step)
+        _sort3(data, mid - step, mid, mid + step)
+        _sort3(data, high - 1 - 2 * step, high - 1 - step, high - 1)
+        _sort3(data, low + step, mid, high - 1 - step)
+    else:
+        _sort3(data, low, mid, high - 1)
+    data.swap(low, mid)
+
+
+def _partition(data, low, high):
+    """Hoare partition around keys[low]. Both scans stop on keys equal to
+    the pivot, which keeps ranges full of duplicates balanced. Returns the
+    pivot's final position and whether anything had to be swapped."""
+    keys = data.keys
+    pivot = keys[low]
+    i, j = low, high
+    swapped = False
+    while True:
+        i += 1
+        while i < high and keys[i] < pivot:
+            i += 1
+        j -= 1
+        while pivot < keys[j]:
+            j -= 1
+        if i >= j:
+            break
+        data.swap(i, j)
+        swapped = True
+    data.swap(low, j)
+    return j, swapped
+
+
+def _intro_sort(data, low, high, depth):
+    while high - low > INSERTION_THRESHOLD:
+        if depth == 0:
+            _heap_sort(data, low, high)
+            return
+        depth -= 1
+        _choose_pivot(data, low, high)
+        pivot, swapped = _partition(data, low, high)
+        if not swapped and _partial_insertion_sort(data, low, pivot) and \
+                _partial_insertion_sort(data, pivot + 1, high):
+            return
+        # Recurse into the smaller side, loop on the bigger one.
+        if pivot - low < high - pivot:
+            _intro_sort(data, low, pivot, depth)
+            low = pivot + 1
+        else:
+            _intro_sort(data, pivot + 1, high, depth)
+            high = pivot
+    _insertion_sort(data, low, high)
+
+
+def intro_sort(items, key=None):
+    """Sort `items` in place (and return it). Not stable."""
+    size = len(items)
+    if size < 2:
+        return items
+    if key is None:
+        data = _Ranges(items, None)
+    else:
+        data = _Ranges([key(item) for item in items], items)
+    _intro_sort(data, 0, size, 2 * size.bit_length())
+    return items
+
+
+if __name__ == '__main__':
+    with Section('Intro Sort'):
+        ppr(run_sorting_trials(
+            intro_sort, magnitudes=[10, 100, 1000, 10000], **QUICK_TRIALS))
+
+    with Section('Intro Sort - adversarial inputs'):
+        size = 20000
+        inputs = {
+            'sorted': list(range(size)),
+            'reversed': list(range(size, 0, -1)),
+            'all equal': [7] * size,
+            'organ pipe': list(range(size // 2)) + list(
+                range(size // 2, 0, -1)),
+        }
+        for name, items in inputs.items():
+            expected = sorted(items)
+            assert intro_sort(items) == expected
+            print('- {} input sorted correctly'.format(name))
+
+        words = ['pear', 'Apple', 'fig', 'banana', 'Cherry']
+        intro_sort(words, key=str.lower)
+        assert words == ['Apple', 'banana', 'Cherry', 'fig', 'pear']
+        ppr(words)
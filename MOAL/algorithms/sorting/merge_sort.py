@@ -7,7 +7,9 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
+from bisect import bisect_right
 from MOAL.helpers.display import Section
+from MOAL.helpers.trials import QUICK_TRIALS
 from MOAL.helpers.trials import run_sorting_trials
 from random import randrange as rr
 from random import random
@@ -56,9 +58,154 @@ def merge_sort(items, iteration=0, side=None):
         merge_sort(right, iteration=iteration + 1, side='right'))
 
 
+# A "natural" bottom-up merge sort, in the spirit of Timsort. Rather than
+# splitting blindly in half, it scans for runs that are already in order
+# (reversing strictly descending ones in place, which keeps it stable),
+# pads short runs out to MIN_RUN with binary insertion sort, then merges
+# neighbouring runs pairwise, level by level. Each level merges from one
+# list into the other and back, so the only extra memory is a single
+# buffer allocated up front - no slicing or concatenating. Already sorted
+# input is one run and costs a single pass.
+#
+# With `key`, the keys are computed once and carried in a parallel list.
+
+MIN_RUN = 32
+
+
+def _reverse(keys, values, low, high):
+    keys[low:high] = keys[low:high][::-1]
+    if values is not None:
+        values[low:high] = values[low:high][::-1]
+
+
+def _binary_insertion_sort(keys, values, low, start, high):
+    """Extend the sorted range keys[low:start] to keys[low:high]."""
+    for i in range(start, high):
+        key = keys[i]
+        pos = bisect_right(keys, key, low, i)
+        if pos == i:
+            continue
+        keys[pos + 1:i + 1] = keys[pos:i]
+        keys[pos] = key
+        if values is not None:
+            value = values[i]
+            values[pos + 1:i + 1] = values[pos:i]
+            values[pos] = value
+
+
+def _find_runs(keys, values):
+    """Returns the boundaries of the (now ascending) runs."""
+    size = len(keys)
+    bounds = [0]
+    low = 0
+    while low < size:
+        high = low + 1
+        if high < size and keys[high] < keys[low]:
+            while high < size and keys[high] < keys[high - 1]:
+                high += 1
+            _reverse(keys, values, low, high)
+        else:
+            while high < size and not keys[high] < keys[high - 1]:
+                high += 1
+        end = min(size, low + MIN_RUN)
+        if high < end:
+            _binary_insertion_sort(keys, values, low, high, end)
+            high = end
+        bounds.append(high)
+        low = high
+    return bounds
+
+
+def _merge_into(src, dst, low, mid, high):
+    """Stable merge of src[low:mid] and src[mid:high] into dst[low:high]."""
+    i, j, out = low, mid, low
+    while i < mid and j < high:
+        if src[j] < src[i]:
+            dst[out] = src[j]
+            j += 1
+        else:
+            dst[out] = src[i]
+            i += 1
+        out += 1
+    if i < mid:
+        dst[out:high] = src[i:mid]
+    else:
+        dst[out:high] = src[j:high]
+
+
+def _merge_pairs_into(keys, values, dst_keys, dst_values, low, mid, high):
+    """Same as `_merge_into`, moving the values along with the keys."""
+    i, j, out = low, mid, low
+    while i < mid and j < high:
+        if keys[j] < keys[i]:
+            dst_keys[out] = keys[j]
+            dst_values[out] = values[j]
+            j += 1
+        else:
+            dst_keys[out] = keys[i]
+            dst_values[out] = values[i]
+            i += 1
+        out += 1
+    if i < mid:
+        dst_keys[out:high] = keys[i:mid]
+        dst_values[out:high] = values[i:mid]
+    else:
+        dst_keys[out:high] = keys[j:high]
+        dst_values[out:high] = values[j:high]
+
+
+def natural_merge_sort(items, key=None):
+    """Stable, in place (and returns `items`). O(n) on sorted input."""
+    size = len(items)
+    if size < 2:
+        return items
+    if key is None:
+        keys, values = items, None
+    else:
+        keys, values = [key(item) for item in items], items
+    bounds = _find_runs(keys, values)
+    if len(bounds) == 2:
+        return items
+    # The one and only buffer (two, in lockstep, when sorting by key).
+    src_keys, dst_keys = keys, [None] * size
+    src_values = values
+    dst_values = None if values is None else [None] * size
+    while len(bounds) > 2:
+        merged = [0]
+        for k in range(0, len(bounds) - 1, 2):
+            low = bounds[k]
+            if k + 2 >= len(bounds):
+                # Odd run out; carry it over to the next level.
+                high = bounds[k + 1]
+                dst_keys[low:high] = src_keys[low:high]
+                if values is not None:
+                    dst_values[low:high] = src_values[low:high]
+            else:
+                mid, high = bounds[k + 1], bounds[k + 2]
+                if not src_keys[mid] < src_keys[mid - 1]:
+                    # The two runs are already in order.
+                    dst_keys[low:high] = src_keys[low:high]
+                    if values is not None:
+                        dst_values[low:high] = src_values[low:high]
+                elif values is None:
+                    _merge_into(src_keys, dst_keys, low, mid, high)
+                else:
+                    _merge_pairs_into(src_keys, src_values,
+                                      dst_keys, dst_values, low, mid, high)
+            merged.append(high)
+        src_keys, dst_keys = dst_keys, src_keys
+        src_values, dst_values = dst_values, src_values
+        bounds = merged
+    if src_keys is not keys:
+        keys[:] = src_keys
+        if values is not None:
+            values[:] = src_values
+    return items
+
+
 if __name__ == '__main__':
     with Section('Merge Sort'):
-        results = run_sorting_trials(merge_sort)
+        results = run_sorting_trials(merge_sort, **QUICK_TRIALS)
         ppr(results)
 
     with Section('Merge Sort - integers'):
@@ -66,3 +213,23 @@ if __name__ == '__main__':
 
     with Section('Merge Sort - floating point integers'):
         ppr(merge_sort([random() * float(rr(1, 9999)) for _ in range(20)]))
+
+    with Section('Natural Merge Sort'):
+        ppr(run_sorting_trials(
+            natural_merge_sort, magnitudes=[10, 100, 1000, 10000],
+            **QUICK_TRIALS))
+        # Runs already in order are found and merged, not re-sorted.
+        sawtooth = [num % 500 for num in range(5000)]
+        assert natural_merge_sort(sawtooth[:]) == sorted(sawtooth)
+        # Stable, with the key computed once per item.
+        calls = []
+
+        def first_letter(word):
+            calls.append(word)
+            return word[0]
+
+        words = ['bravo', 'alpha', 'beta', 'apex', 'charlie', 'azure']
+        natural_merge_sort(words, key=first_letter)
+        assert words == ['alpha', 'apex', 'azure', 'bravo', 'beta', 'charlie']
+        assert len(calls) == len(words)
+        ppr(words)
@@ -9,6 +9,7 @@ if __name__ == '__main__':
 
 from MOAL.helpers.display import Section
 from MOAL.helpers.generic import swap_item
+from MOAL.helpers.trials import QUICK_TRIALS
 from MOAL.helpers.trials import run_sorting_trials
 from pprint import pprint as ppr
 
@@ -45,4 +46,5 @@ def quick_sort(items, low=None, high=None):
 
 if __name__ == '__main__':
     with Section('Quick Sort'):
-        ppr(run_sorting_trials(quick_sort, magnitudes=[10, 100, 1000]))
+        ppr(run_sorting_trials(
+            quick_sort, magnitudes=[10, 100, 1000], **QUICK_TRIALS))
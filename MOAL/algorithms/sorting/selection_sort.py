@@ -9,6 +9,7 @@ if __name__ == '__main__':
 
 from MOAL.helpers.display import Section
 from MOAL.helpers.generic import swap_item
+from MOAL.helpers.trials import QUICK_TRIALS
 from MOAL.helpers.trials import run_sorting_trials
 from pprint import pprint as ppr
 
@@ -40,4 +41,5 @@ def selection_sort(items):
 if __name__ == '__main__':
     with Section('Selection Sort'):
         ppr(run_sorting_trials(
-            selection_sort, magnitudes=[10, 100, 1000, 5000]))
+            selection_sort, magnitudes=[10, 100, 1000, 5000],
+            **QUICK_TRIALS))
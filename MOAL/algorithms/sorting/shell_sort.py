@@ -8,6 +8,7 @@ if __name__ == '__main__':
     sys.path.append(getcwd())
 
 from MOAL.helpers.display import Section
+from MOAL.helpers.trials import QUICK_TRIALS
 from MOAL.helpers.trials import run_sorting_trials
 from MOAL.algorithms.sorting.insertion_sort import insertion_sort
 from MOAL.algorithms.sorting.quick_sort import quick_sort
@@ -49,6 +50,9 @@ if __name__ == '__main__':
         TEST_MAGNITUDES = [4, 10, 50, 100, 500, 1000, 10000]
         # Compare helper sorting functions
         # in isolation to the hybrid shell function
-        ppr(run_sorting_trials(shell_sort, magnitudes=TEST_MAGNITUDES))
-        ppr(run_sorting_trials(quick_sort, magnitudes=TEST_MAGNITUDES))
-        ppr(run_sorting_trials(insertion_sort, magnitudes=TEST_MAGNITUDES))
+        ppr(run_sorting_trials(
+            shell_sort, magnitudes=TEST_MAGNITUDES, **QUICK_TRIALS))
+        ppr(run_sorting_trials(
+            quick_sort, magnitudes=TEST_MAGNITUDES, **QUICK_TRIALS))
+        ppr(run_sorting_trials(
+            insertion_sort, magnitudes=TEST_MAGNITUDES, **QUICK_TRIALS))
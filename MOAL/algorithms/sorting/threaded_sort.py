@@ -7,75 +7,113 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
+from concurrent.futures import ProcessPoolExecutor
+from heapq import merge
+from itertools import repeat
+from os import cpu_count
+from sys import argv
+from time import time
 from MOAL.helpers.display import Section
-from MOAL.helpers.generic import subdivide_groups
+from MOAL.helpers.display import print_simple
 from MOAL.helpers.generic import random_number_set
-from MOAL.algorithms.sorting.quick_sort import quick_sort
-from pprint import pprint as ppr
-from Queue import Queue
-from threading import Lock
-from threading import Thread
+from MOAL.algorithms.sorting.intro_sort import intro_sort
 
 
-SORT_LOCK = Lock()
+def _chunks(items, count):
+    """Split `items` into `count` contiguous chunks whose sizes
+    differ by at most one."""
+    size, extra = divmod(len(items), count)
+    chunks, start = [], 0
+    for k in range(count):
+        end = start + size + (1 if k < extra else 0)
+        if end > start:
+            chunks.append(items[start:end])
+        start = end
+    return chunks
 
 
-class ThreadSort:
-    """An experiment to divide a list of items up into sub-groups
-    and then sort them individually on different threads.
-    Doesn't really perform better than the original algorithm,
-    though it could be useful for processing individual lists separately."""
+def _sort_chunk(sorting_func, key, chunk):
+    """Runs in a worker process. Sorting functions here either return the
+    sorted list (like `sorted`) or sort in place and return it (like the
+    ones in this package), so using the return value covers both."""
+    if key is None:
+        return sorting_func(chunk)
+    return sorting_func(chunk, key=key)
 
-    def __init__(self, sorting_func, threads=2):
-        self.threads = threads
+
+class ParallelSort(object):
+    """Sorts chunks of a list in separate processes, then k-way merges the
+    sorted chunks with `heapq.merge`.
+
+    Threads can't help here, since sorting pure Python objects never
+    releases the GIL; processes can, at the cost of pickling each chunk
+    over and back. That cost is linear while the sort is n log n, so it
+    only pays off for big inputs: anything under `min_parallel` items is
+    just sorted in-process.
+
+    `sorting_func` and `key` are sent to the workers, so they have to be
+    picklable (builtins or module level functions, not lambdas)."""
+
+    def __init__(self, sorting_func=sorted, processes=None,
+                 min_parallel=100000):
         self.sorting_func = sorting_func
-        self.sorting_queue = Queue()
-        self.sorted_items = []
-
-    def _disperse(self):
-        for _ in range(self.threads):
-            t = Thread(target=self._worker, kwargs={
-                'sorted_items': self.sorted_items})
-            t.daemon = True
-            t.start()
-        return self
-
-    def _worker(self, sorted_items=None):
-        while True:
-            items = self.sorting_queue.get()
-            self.sorted_items += self.sorting_func(items)
-            self.sorting_queue.task_done()
-
-    def _enqueue(self, items):
-        # Get the number of thread groups to run based on length and threads.
-        groups = subdivide_groups(items, divisions=self.threads)
-        # For each sub group, sort on a separate thread.
-        for group in groups:
-            self.sorting_queue.put(group)
-        return self
-
-    def run(self, items):
-        # Make sure thread number is never greater than the number of items.
-        num_items = len(items)
-        while self.threads > num_items:
-            self.threads -= 1
-        if num_items < 2:
-            return items
-        # Prevent passing in div by zero errors.
-        if self.threads == 0:
-            self.threads = 1
-        self._disperse()._enqueue(items)
-        # Block until complete.
-        self.sorting_queue.join()
-        # Perform the second sort on already sorted sublists.
-        return self.sorting_func(self.sorted_items)
+        self.processes = processes or cpu_count() or 1
+        self.min_parallel = min_parallel
 
+    def _sorted_chunks(self, items, key):
+        chunks = _chunks(items, self.processes)
+        with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+            return list(pool.map(
+                _sort_chunk, repeat(self.sorting_func), repeat(key), chunks))
 
-if __name__ == '__main__':
-    with Section('Threaded Sorts'):
-        threaded_quicksort = ThreadSort(quick_sort, threads=4)
+    def iter_sorted(self, items, key=None):
+        """Yield the items in order. The merge is lazy, so the first items
+        are available as soon as the chunks are sorted, without building
+        the whole output list."""
+        items = list(items)
+        if self.processes < 2 or len(items) < self.min_parallel:
+            return iter(_sort_chunk(self.sorting_func, key, items))
+        return merge(*self._sorted_chunks(items, key), key=key)
+
+    def run(self, items, key=None):
+        return list(self.iter_sorted(items, key=key))
 
+
+def speedup_curve(size, max_processes=None, sorting_func=sorted):
+    """Time a sort of `size` random numbers using 1 to `max_processes`
+    processes. Returns a list of (processes, seconds, speed-up) tuples."""
+    max_processes = max_processes or cpu_count() or 1
+    items = random_number_set(max_rand=size * 10, max_range=size)
+    expected = sorted(items)
+    curve = []
+    for processes in range(1, max_processes + 1):
+        sorter = ParallelSort(
+            sorting_func=sorting_func, processes=processes, min_parallel=0)
+        start = time()
+        result = sorter.run(items)
+        took = time() - start
+        assert result == expected
+        curve.append((processes, took, curve[0][1] / took if curve else 1.0))
+    return curve
+
+
+if __name__ == '__main__':
+    with Section('Parallel Sorts'):
+        sorter = ParallelSort(sorting_func=intro_sort, processes=4,
+                              min_parallel=0)
         rand = random_number_set(max_range=20)
-        res = threaded_quicksort.run(rand)
+        res = sorter.run(rand)
         print('Is valid? {}'.format(res == sorted(rand)))
-        ppr(res)
+        print(res)
+        words = ['pear', 'Apple', 'fig', 'banana', 'Cherry', 'date']
+        assert sorter.run(words, key=str.lower) == sorted(words, key=str.lower)
+        # Small inputs never start a pool.
+        assert ParallelSort().run([3, 1, 2]) == [1, 2, 3]
+
+    with Section('Parallel Sorts - speed-up curve'):
+        # Pass the number of items to sort, e.g. 5000000.
+        size = int(argv[1]) if len(argv) > 1 else 1000000
+        for processes, took, speedup in speedup_curve(size):
+            print_simple('{} process(es)'.format(processes),
+                         '{:.3f}s ({:.2f}x)'.format(took, speedup),
+                         newline=False)
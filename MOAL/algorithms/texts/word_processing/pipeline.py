@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+__author__ = """Chris Tabor (dxdstudio@gmail.com)"""
+
+if __name__ == '__main__':
+    from os import getcwd
+    from os import sys
+    sys.path.append(getcwd())
+
+import os
+import re
+from collections import Counter
+from string import punctuation
+from time import time
+from MOAL.algorithms.texts.word_processing.stemming import PorterStemmer
+from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
+
+DEBUG = True if __name__ == '__main__' else False
+
+# A text analysis pipeline made of generators, so a document goes through
+# it a chunk at a time and is never all in memory:
+#
+#   read_chunks -> normalize -> tokenize -> remove_stopwords -> stem
+#
+# `Analyzer` strings them together; it's what indexers should call, on
+# the documents and on the queries, so both get the same treatment.
+
+CHUNK_SIZE = 64 * 1024
+# Punctuation becomes whitespace (rather than being deleted) so that
+# "a.b" is two tokens, not "ab".
+PUNCTUATION_TO_SPACE = str.maketrans(punctuation, ' ' * len(punctuation))
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+STOP_WORDS = frozenset("""
+a about above after again against all am an and any are as at be because
+been before being below between both but by can could did do does doing
+down during each few for from further had has have having he her here
+hers herself him himself his how i if in into is it its itself just me
+more most my myself no nor not now of off on once only or other our ours
+ourselves out over own same she should so some such than that the their
+theirs them themselves then there these they this those through to too
+under until up very was we were what when where which while who whom why
+will with would you your yours yourself yourselves
+""".split())
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE, encoding='utf-8'):
+    """Yield the text of a file `chunk_size` characters at a time."""
+    with open(path, encoding=encoding, errors='replace') as infile:
+        while True:
+            chunk = infile.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def normalize(chunks, table=PUNCTUATION_TO_SPACE):
+    """Lower case each chunk and map its punctuation to spaces, with one
+    `str.translate` pass instead of a Python loop over characters."""
+    for chunk in chunks:
+        yield chunk.lower().translate(table)
+
+
+def tokenize(chunks, pattern=TOKEN_RE):
+    """Yield the tokens of a stream of chunks. A token can straddle two
+    chunks, so anything running up to the end of a chunk is held back and
+    glued onto the start of the next one."""
+    carry = ''
+    for chunk in chunks:
+        chunk = carry + chunk
+        carry = ''
+        for match in pattern.finditer(chunk):
+            if match.end() == len(chunk):
+                carry = match.group()
+                break
+            yield match.group()
+    if carry:
+        yield carry
+
+
+def remove_stopwords(tokens, stopwords=STOP_WORDS):
+    for token in tokens:
+        if token not in stopwords:
+            yield token
+
+
+def stem(tokens, stemmer=None):
+    stemmer = stemmer or PorterStemmer()
+    for token in tokens:
+        yield stemmer(token)
+
+
+class Analyzer(object):
+    """Text (a string, or an iterable of chunks) in, tokens out.
+
+    Each analyzer keeps its own stemmer, so its memo of stemmed words
+    carries over from one document to the next."""
+
+    def __init__(self, stopwords=STOP_WORDS, stemmer=True,
+                 chunk_size=CHUNK_SIZE):
+        self.stopwords = stopwords
+        if stemmer is True:
+            stemmer = PorterStemmer()
+        self.stemmer = stemmer or None
+        self.chunk_size = chunk_size
+
+    def __call__(self, text):
+        chunks = [text] if isinstance(text, str) else text
+        tokens = tokenize(normalize(chunks))
+        if self.stopwords:
+            tokens = remove_stopwords(tokens, self.stopwords)
+        if self.stemmer is not None:
+            tokens = stem(tokens, self.stemmer)
+        return tokens
+
+    def file(self, path, encoding='utf-8'):
+        """Lazily analyze a file."""
+        return self(read_chunks(path, self.chunk_size, encoding))
+
+
+if DEBUG:
+    with Section('Text pipeline'):
+        analyzer = Analyzer()
+        text = ('The runners were running; the runner ran!\n'
+                'Connections, connected and connecting (e.g. networks).')
+        tokens = list(analyzer(text))
+        print_simple('Tokens', tokens)
+        assert tokens == ['runner', 'run', 'runner', 'ran', 'connect',
+                          'connect', 'connect', 'e', 'g', 'network']
+
+        print_h2('Chunk boundaries')
+        # Split at every possible place: the tokens must come out the same.
+        plain = Analyzer(stopwords=None, stemmer=None)
+        expected = list(plain(text))
+        for cut in range(len(text) + 1):
+            assert list(plain([text[:cut], text[cut:]])) == expected
+        assert list(plain(text[pos:pos + 3] for pos in range(
+            0, len(text), 3))) == expected
+        print('- Same tokens however the text is chunked.')
+
+    with Section('Text pipeline - streaming a file'):
+        path = os.path.join(os.path.dirname(__file__), 'stemming.py')
+        start = time()
+        counts = Counter(analyzer.file(path))
+        print_simple('Most common stems in stemming.py, {:.3f}s'.format(
+            time() - start), counts.most_common(8))
+        print_simple('Stem memo', analyzer.stemmer.cache_info())
@@ -7,7 +7,9 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
+from functools import lru_cache
 from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
 
 DEBUG = True if __name__ == '__main__' else False
 
@@ -15,10 +17,161 @@ DEBUG = True if __name__ == '__main__' else False
 def suffix_strip(word):
     for suffix in ['ing', 'ed', 'ly']:
         if word.endswith(suffix):
-            return word.replace(suffix, '')
+            return word[:-len(suffix)]
     return word
 
 
+# The Porter stemmer: Porter, M.F., "An algorithm for suffix stripping",
+# Program 14(3), 1980. https://tartarus.org/martin/PorterStemmer/
+#
+# A word is read as [C](VC)^m[V], runs of consonants and vowels, and m is
+# its "measure". Each step strips or rewrites one suffix, but only if what
+# is left has a big enough measure, so short words aren't mangled the way
+# `suffix_strip` mangles them.
+
+# Suffix -> replacement, for steps 2, 3 and 4. Within a step only the
+# longest matching suffix is considered. Step 2 follows the reference
+# implementation rather than the paper: 'bli' -> 'ble' instead of
+# 'abli' -> 'able', and the extra 'logi' -> 'log'.
+STEP2 = {
+    'ational': 'ate', 'tional': 'tion', 'enci': 'ence', 'anci': 'ance',
+    'izer': 'ize', 'bli': 'ble', 'alli': 'al', 'entli': 'ent', 'eli': 'e',
+    'ousli': 'ous', 'ization': 'ize', 'ation': 'ate', 'ator': 'ate',
+    'alism': 'al', 'iveness': 'ive', 'fulness': 'ful', 'ousness': 'ous',
+    'aliti': 'al', 'iviti': 'ive', 'biliti': 'ble', 'logi': 'log',
+}
+STEP3 = {
+    'icate': 'ic', 'ative': '', 'alize': 'al', 'iciti': 'ic', 'ical': 'ic',
+    'ful': '', 'ness': '',
+}
+STEP4 = dict.fromkeys([
+    'al', 'ance', 'ence', 'er', 'ic', 'able', 'ible', 'ant', 'ement',
+    'ment', 'ent', 'ion', 'ou', 'ism', 'ate', 'iti', 'ous', 'ive', 'ize',
+], '')
+
+
+def _is_consonant(word, i):
+    char = word[i]
+    if char in 'aeiou':
+        return False
+    if char == 'y':
+        return i == 0 or not _is_consonant(word, i - 1)
+    return True
+
+
+def measure(stem):
+    """The m in [C](VC)^m[V]: how many vowel runs are followed by a
+    consonant run."""
+    count, vowel = 0, False
+    for i in range(len(stem)):
+        if _is_consonant(stem, i):
+            if vowel:
+                count += 1
+            vowel = False
+        else:
+            vowel = True
+    return count
+
+
+def _has_vowel(stem):
+    return any(not _is_consonant(stem, i) for i in range(len(stem)))
+
+
+def _ends_double_consonant(stem):
+    return (len(stem) > 1 and stem[-1] == stem[-2] and
+            _is_consonant(stem, len(stem) - 1))
+
+
+def _ends_cvc(stem):
+    """Consonant, vowel, consonant, where the last isn't w, x or y."""
+    size = len(stem)
+    return (size > 2 and stem[-1] not in 'wxy' and
+            _is_consonant(stem, size - 1) and
+            not _is_consonant(stem, size - 2) and
+            _is_consonant(stem, size - 3))
+
+
+def _longest_suffix(word, rules):
+    for start in range(max(0, len(word) - 7), len(word)):
+        if word[start:] in rules:
+            return word[start:]
+    return None
+
+
+def _step1(word):
+    if word.endswith('sses') or word.endswith('ies'):
+        word = word[:-2]
+    elif word.endswith('s') and not word.endswith('ss'):
+        word = word[:-1]
+
+    if word.endswith('eed'):
+        if measure(word[:-3]) > 0:
+            word = word[:-1]
+    else:
+        for suffix in ('ed', 'ing'):
+            if word.endswith(suffix) and _has_vowel(word[:-len(suffix)]):
+                word = word[:-len(suffix)]
+                if word[-2:] in ('at', 'bl', 'iz'):
+                    word += 'e'
+                elif _ends_double_consonant(word) and word[-1] not in 'lsz':
+                    word = word[:-1]
+                elif measure(word) == 1 and _ends_cvc(word):
+                    word += 'e'
+                break
+
+    if word.endswith('y') and _has_vowel(word[:-1]):
+        word = word[:-1] + 'i'
+    return word
+
+
+def _replace(word, rules, min_measure):
+    suffix = _longest_suffix(word, rules)
+    if suffix is None:
+        return word
+    stem = word[:-len(suffix)]
+    if measure(stem) < min_measure:
+        return word
+    if suffix == 'ion' and not stem.endswith(('s', 't')):
+        return word
+    return stem + rules[suffix]
+
+
+def _step5(word):
+    if word.endswith('e'):
+        stem = word[:-1]
+        size = measure(stem)
+        if size > 1 or (size == 1 and not _ends_cvc(stem)):
+            word = stem
+    if word.endswith('ll') and measure(word) > 1:
+        word = word[:-1]
+    return word
+
+
+def porter_stem(word):
+    """Stem a lower case word."""
+    if len(word) <= 2:
+        return word
+    word = _step1(word)
+    word = _replace(word, STEP2, 1)
+    word = _replace(word, STEP3, 1)
+    word = _replace(word, STEP4, 2)
+    return _step5(word)
+
+
+class PorterStemmer(object):
+    """`porter_stem` with an LRU memo. Word frequencies are Zipfian, so
+    a few thousand entries catch most of the words in any text."""
+
+    def __init__(self, memo_size=8192):
+        self.stem = lru_cache(maxsize=memo_size)(porter_stem)
+
+    def __call__(self, word):
+        return self.stem(word)
+
+    def cache_info(self):
+        return self.stem.cache_info()
+
+
 if DEBUG:
     with Section('Stemming algorithms'):
         words = ['swimming', 'running', 'flying', 'slated', 'dated',
@@ -26,8 +179,20 @@ if DEBUG:
         # Simple, which causes invalid words.
         for word in words:
             print('{} => {}'.format(word, suffix_strip(word)))
-        # See a separate project of mine:
-        # https://github.com/Automotron/namebot
-        #   /blob/master/namebot/normalization.py
-        # for example of using the NLTK stemmer, which actually works well,
-        # and implements multiple types.
+        assert suffix_strip('bedding') == 'bedd'
+
+        print_h2('Porter stemmer')
+        stemmer = PorterStemmer()
+        for word in words:
+            print('{} => {}'.format(word, stemmer(word)))
+        examples = {
+            'caresses': 'caress', 'ponies': 'poni', 'cats': 'cat',
+            'agreed': 'agre', 'motoring': 'motor', 'sing': 'sing',
+            'hopping': 'hop', 'filing': 'file', 'happy': 'happi',
+            'relational': 'relat', 'generalizations': 'gener',
+            'adjustment': 'adjust', 'adoption': 'adopt',
+            'controlling': 'control', 'effective': 'effect',
+        }
+        for word, stem in examples.items():
+            assert stemmer(word) == stem, (word, stemmer(word))
+        print(stemmer.cache_info())
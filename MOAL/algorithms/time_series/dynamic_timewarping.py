@@ -7,14 +7,40 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
-from MOAL.helpers.display import Section
-import mlpy
-import matplotlib.pyplot as plot
-import matplotlib.cm as cm
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from math import floor
+from os import cpu_count
 from random import randrange as rr
+from time import time
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
 
 DEBUG = True if __name__ == '__main__' else False
 
+# Dynamic time warping: https://en.wikipedia.org/wiki/Dynamic_time_warping
+#
+# The cost of aligning x[:i + 1] with y[:j + 1] is
+#   D[i, j] = c(i, j) + min(D[i - 1, j - 1], D[i - 1, j], D[i, j - 1])
+# The D[i, j - 1] term makes each row depend on itself, which looks like it
+# needs a Python loop per cell. But unrolling it, with C the running sum of
+# the row's costs and T[j] = c(i, j) + min(D[i - 1, j - 1], D[i - 1, j]):
+#   D[i, j] = min over l <= j of (T[l] + C[j] - C[l])
+#           = C[j] + running minimum of (T - C)
+# so a row is a handful of NumPy operations, and only the rows are looped.
+#
+# Windows restrict row i to columns lo[i]..hi[i]: the Sakoe-Chiba band
+# (within r of the diagonal) or the Itakura parallelogram (bounded slope).
+# With `max_cost`, the DP gives up as soon as a whole row is over it.
+
+METRICS = {
+    'sqeuclidean': lambda a, b: (a - b) ** 2,
+    'abs': lambda a, b: np.abs(a - b),
+}
+
 
 def random_timesequence(start, end, steps=3):
     seq = []
@@ -27,27 +53,282 @@ def random_timesequence(start, end, steps=3):
     return seq
 
 
+def sakoe_chiba(n, m, radius):
+    """Column bounds (inclusive) per row: within `radius` of the diagonal,
+    which is stretched to run corner to corner when n != m."""
+    diagonal = np.arange(n) * ((m - 1) / float(max(n - 1, 1)))
+    lo = np.maximum(0, np.floor(diagonal - radius)).astype(np.int64)
+    hi = np.minimum(m - 1, np.ceil(diagonal + radius)).astype(np.int64)
+    return lo, hi
+
+
+def itakura(n, m, slope=2.0):
+    """Column bounds per row for the Itakura parallelogram: the warping
+    path's slope stays between 1 / slope and slope."""
+    lo, hi = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    for i in range(n):
+        u = i / float(max(n - 1, 1))
+        low = max(u / slope, 1 - slope * (1 - u))
+        high = min(u * slope, 1 - (1 - u) / slope)
+        lo[i] = max(0, int(ceil(low * (m - 1) - 1e-9)))
+        hi[i] = min(m - 1, int(floor(high * (m - 1) + 1e-9)))
+        # Too narrow to hold a cell; keep the nearest diagonal one.
+        if lo[i] > hi[i]:
+            lo[i] = hi[i] = int(round(u * (m - 1)))
+    return lo, hi
+
+
+def _bounds(n, m, window, radius, slope):
+    if window is None:
+        return np.zeros(n, dtype=np.int64), np.full(n, m - 1, dtype=np.int64)
+    if window == 'sakoe_chiba':
+        return sakoe_chiba(n, m, radius)
+    if window == 'itakura':
+        return itakura(n, m, slope)
+    raise ValueError('Unknown window {}'.format(window))
+
+
+def dtw(x, y, window=None, radius=10, slope=2.0, metric='sqeuclidean',
+        max_cost=np.inf, return_path=False):
+    """DTW cost between sequences x and y (`inf` if it's over `max_cost`).
+    With `return_path`, returns (cost, path) where the path is a list of
+    aligned (i, j) index pairs."""
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    n, m = len(x), len(y)
+    if n == 0 or m == 0:
+        return (np.inf, []) if return_path else np.inf
+    lo, hi = _bounds(n, m, window, radius, slope)
+    cost = METRICS[metric]
+    prev = np.full(m, np.inf)
+    rows = [] if return_path else None
+    for i in range(n):
+        start, stop = lo[i], hi[i] + 1
+        costs = cost(x[i], y[start:stop])
+        if i == 0:
+            best = np.full(stop - start, np.inf)
+            if start == 0:
+                best[0] = 0.0
+        else:
+            # min(D[i - 1, j - 1], D[i - 1, j]) for each j in the window.
+            left = prev[start - 1:stop - 1] if start > 0 else np.concatenate(
+                ([np.inf], prev[:stop - 1]))
+            best = np.minimum(left, prev[start:stop])
+        through = costs + best
+        running = np.cumsum(costs)
+        row = np.minimum.accumulate(through - running) + running
+        prev = np.full(m, np.inf)
+        prev[start:stop] = row
+        if rows is not None:
+            rows.append(prev)
+        if row.min() > max_cost:
+            return (np.inf, []) if return_path else np.inf
+    total = float(prev[m - 1])
+    if total > max_cost:
+        total = np.inf
+    if not return_path:
+        return total
+    return total, _backtrack(rows) if np.isfinite(total) else []
+
+
+def _backtrack(rows):
+    i, j = len(rows) - 1, len(rows[0]) - 1
+    path = [(i, j)]
+    while i > 0 or j > 0:
+        steps = []
+        if i > 0 and j > 0:
+            steps.append((rows[i - 1][j - 1], i - 1, j - 1))
+        if i > 0:
+            steps.append((rows[i - 1][j], i - 1, j))
+        if j > 0:
+            steps.append((rows[i][j - 1], i, j - 1))
+        _, i, j = min(steps)
+        path.append((i, j))
+    return path[::-1]
+
+
+def dtw_naive(x, y):
+    """The textbook O(n * m) double loop, for reference."""
+    n, m = len(x), len(y)
+    table = [[float('inf')] * (m + 1) for _ in range(n + 1)]
+    table[0][0] = 0
+    for i in range(1, n + 1):
+        for j in range(1, m + 1):
+            table[i][j] = (x[i - 1] - y[j - 1]) ** 2 + min(
+                table[i - 1][j - 1], table[i - 1][j], table[i][j - 1])
+    return table[n][m]
+
+
+# Lower bounds, for ruling candidates out without running the full DP.
+# Both assume squared (or absolute) point costs and equal lengths.
+
+def lb_kim(query, candidate, metric='sqeuclidean'):
+    """Every warping path aligns the first points and the last points, so
+    their costs alone are a lower bound (LB_KimFL). O(1)."""
+    cost = METRICS[metric]
+    if len(query) == 1:
+        return float(cost(query[0], candidate[0]))
+    return float(cost(query[0], candidate[0]) + cost(query[-1], candidate[-1]))
+
+
+def envelope(series, radius):
+    """Upper and lower envelopes: the max and min within `radius`."""
+    series = np.asarray(series, dtype=float)
+    padded_max = np.pad(series, radius, mode='constant',
+                        constant_values=-np.inf)
+    padded_min = np.pad(series, radius, mode='constant',
+                        constant_values=np.inf)
+    window = 2 * radius + 1
+    return (sliding_window_view(padded_max, window).max(axis=1),
+            sliding_window_view(padded_min, window).min(axis=1))
+
+
+def lb_keogh(candidate, upper, lower, metric='sqeuclidean'):
+    """Keogh's bound: any candidate point outside the query's envelope
+    costs at least its distance to the envelope, under a Sakoe-Chiba band
+    of the same radius. O(n)."""
+    candidate = np.asarray(candidate, dtype=float)
+    cost = METRICS[metric]
+    above = np.where(candidate > upper, cost(candidate, upper), 0.0)
+    below = np.where(candidate < lower, cost(candidate, lower), 0.0)
+    return float(above.sum() + below.sum())
+
+
+def _znorm(series):
+    std = series.std()
+    return (series - series.mean()) / (std if std > 0 else 1.0)
+
+
+def subsequence_search(query, series, radius=10, normalize=True):
+    """Find the window of `series` closest to `query` under banded DTW,
+    in the manner of the UCR suite: each window is tried against a cascade
+    of ever tighter (and costlier) lower bounds, and only reaches the full
+    DP - which itself abandons early - if none of them can rule it out.
+
+    Returns (cost, position, stats) where stats counts how many windows
+    each stage pruned."""
+    query = np.asarray(query, dtype=float)
+    series = np.asarray(series, dtype=float)
+    length = len(query)
+    if normalize:
+        query = _znorm(query)
+    upper, lower = envelope(query, radius)
+    windows = sliding_window_view(series, length)
+    best, position = np.inf, None
+    stats = {'lb_kim': 0, 'lb_keogh': 0, 'lb_keogh_reversed': 0,
+             'abandoned': 0, 'dtw': 0}
+    for pos in range(len(windows)):
+        window = _znorm(windows[pos]) if normalize else windows[pos]
+        if lb_kim(query, window) >= best:
+            stats['lb_kim'] += 1
+            continue
+        if lb_keogh(window, upper, lower) >= best:
+            stats['lb_keogh'] += 1
+            continue
+        # The bound holds with the roles swapped too.
+        window_upper, window_lower = envelope(window, radius)
+        if lb_keogh(query, window_upper, window_lower) >= best:
+            stats['lb_keogh_reversed'] += 1
+            continue
+        dist = dtw(query, window, window='sakoe_chiba', radius=radius,
+                   max_cost=best)
+        if np.isinf(dist):
+            stats['abandoned'] += 1
+        else:
+            stats['dtw'] += 1
+            if dist < best:
+                best, position = dist, pos
+    return best, position, stats
+
+
+_CANDIDATES = None
+
+
+def _set_candidates(candidates):
+    """Pool initializer: ship the candidates to each worker once."""
+    global _CANDIDATES
+    _CANDIDATES = candidates
+
+
+def _dtw_rows(queries, options, candidates=None):
+    candidates = _CANDIDATES if candidates is None else candidates
+    return [[dtw(query, cand, **options) for cand in candidates]
+            for query in queries]
+
+
+def dtw_many(queries, candidates, processes=None, min_parallel=64,
+             chunk_size=4, **options):
+    """Matrix of DTW costs from each query to each candidate. `options`
+    are passed on to `dtw`. Chunks of queries go to a process pool once
+    there are at least `min_parallel` pairs."""
+    queries = [np.asarray(query, dtype=float) for query in queries]
+    candidates = [np.asarray(cand, dtype=float) for cand in candidates]
+    processes = processes or cpu_count() or 1
+    if processes < 2 or len(queries) * len(candidates) < min_parallel:
+        return np.array(_dtw_rows(queries, options, candidates))
+    chunks = [queries[k:k + chunk_size]
+              for k in range(0, len(queries), chunk_size)]
+    rows = []
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_set_candidates,
+                             initargs=(candidates,)) as pool:
+        for chunk_rows in pool.map(_dtw_rows, chunks,
+                                   [options] * len(chunks)):
+            rows.extend(chunk_rows)
+    return np.array(rows)
+
+
 if DEBUG:
-    with Section('Dynamic Time Warping algorithm - MLPY'):
-        # Using MLPY:
-        # First, make sure deps are setup.
-        # `brew install gsl`
-        # Download from SF: http://mlpy.sourceforge.net/
-        # Then install using setup.py:
-        # `cd MLPY_PATH/setup.py install`
-
-        # Now this makes it fun.
+    with Section('Dynamic Time Warping algorithm'):
         x, y = random_timesequence(0, 10), random_timesequence(0, 10)
+        cost, path = dtw(x, y, return_path=True)
+        print_simple('Sequences', (x, y))
+        print_simple('Cost and warping path', (cost, path))
+        assert cost == dtw_naive(x, y)
+        assert sum((x[i] - y[j]) ** 2 for i, j in path) == cost
+
+        print_h2('Windows and early abandoning')
+        rand = np.random.default_rng(7)
+        a, b = rand.normal(size=300).cumsum(), rand.normal(size=300).cumsum()
+        full = dtw(a, b)
+        assert abs(full - dtw_naive(a.tolist(), b.tolist())) < 1e-6 * full
+        banded = dtw(a, b, window='sakoe_chiba', radius=10)
+        parallelogram = dtw(a, b, window='itakura')
+        # A narrower window can only make the best path more expensive.
+        assert full <= parallelogram and full <= banded
+        assert np.isinf(dtw(a, b, max_cost=full / 2))
+        print_simple('Unconstrained / Sakoe-Chiba / Itakura', (
+            round(full, 2), round(banded, 2), round(parallelogram, 2)))
+
+        print_h2('Lower bounds')
+        upper, lower = envelope(a, 10)
+        bounds = (lb_kim(a, b), lb_keogh(b, upper, lower))
+        assert max(bounds) <= banded
+        print_simple('LB_Kim / LB_Keogh / DTW', bounds + (banded,))
+
+    with Section('Dynamic Time Warping - subsequence search'):
+        walk = rand.normal(size=20000).cumsum()
+        query = np.sin(np.linspace(0, 6, 128)) * 5
+        planted = 12345
+        walk[planted:planted + 128] = query * 1.5 + 3 + rand.normal(
+            scale=0.05, size=128)
+        start = time()
+        cost, position, stats = subsequence_search(query, walk, radius=6)
+        print_simple('Best match', 'position {}, cost {:.3f}, {:.2f}s'.format(
+            position, cost, time() - start), newline=False)
+        print_simple('Windows pruned at each stage', stats)
+        assert position == planted
 
-        # Taken from examples: http://mlpy.sourceforge.net/docs/3.5/dtw.html#id3
-        distance, cost, path = mlpy.dtw_std(x, y, dist_only=False)
-        fig = plot.figure(1)
-        axes = fig.add_subplot(111)
-        plot1 = plot.imshow(
-            cost.T, origin='lower', cmap=cm.gray, interpolation='nearest')
-
-        plot2 = plot.plot(path[0], path[1], 'w')
-        bound = 0.5
-        xlim = axes.set_xlim((-bound, cost.shape[0] - bound))
-        ylim = axes.set_ylim((-bound, cost.shape[1] - bound))
-        plot.show()
+    with Section('Dynamic Time Warping - batch'):
+        series = [rand.normal(size=rr(40, 60)).cumsum() for _ in range(20)]
+        start = time()
+        serial = dtw_many(series, series, processes=1,
+                          window='sakoe_chiba', radius=5)
+        print_simple('20 x 20 in-process', '{:.3f}s'.format(time() - start),
+                     newline=False)
+        start = time()
+        pooled = dtw_many(series, series, processes=2, min_parallel=0,
+                          window='sakoe_chiba', radius=5)
+        print_simple('20 x 20 over 2 processes', '{:.3f}s'.format(
+            time() - start), newline=False)
+        assert np.allclose(serial, pooled)
+        assert np.allclose(np.diag(serial), 0)
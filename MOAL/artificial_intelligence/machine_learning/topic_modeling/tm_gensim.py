@@ -7,13 +7,15 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
+from MOAL.algorithms.texts.word_processing.pipeline import Analyzer
+from MOAL.algorithms.texts.word_processing.pipeline import \
+    PUNCTUATION_TO_SPACE
 from MOAL.helpers.display import Section
 from MOAL.helpers.display import print_h2
 from pyquery import PyQuery as Pq
 from gensim import corpora
 from gensim import models
 from gensim import similarities
-from string import punctuation
 from nltk.corpus import stopwords
 from collections import defaultdict
 from pprint import pprint as ppr
@@ -23,6 +25,8 @@ import os
 DEBUG = True if __name__ == '__main__' else False
 stop = stopwords.words('english') + ['i.e.', 'e.g.']
 path = os.path.dirname(__file__)
+# Stop words, but no stemming, so the topics stay readable.
+analyzer = Analyzer(stopwords=frozenset(stop), stemmer=None)
 
 LOGGING = False
 
@@ -64,26 +68,33 @@ def get_frequency(docs):
 
 
 def clean_token(token):
-    token = token.lower()
-    for piece in ['\n', '\t', ''] + list(punctuation):
-        token = token.replace(piece, '')
-    return token
+    return ''.join(token.lower().translate(PUNCTUATION_TO_SPACE).split())
 
 
 def get_tokens(line):
-    tokens = []
-    for token in line.split(' '):
-        if token not in stop and token != '':
-            tokens.append(clean_token(token))
-    return tokens
+    return list(analyzer(line))
+
+
+def iter_filetokens(name):
+    """The tokens of a file, streamed through the analyzer a chunk at a
+    time rather than read in whole."""
+    return analyzer.file(os.path.join(path, name))
 
 
 def get_filetokens(name):
-    tokens = []
-    with open('{}/{}'.format(path, name)) as filedata:
-        for line in filedata.readlines():
-            tokens += get_tokens(line)
-    return tokens
+    return list(iter_filetokens(name))
+
+
+class FileCorpus(object):
+    """Documents as token streams, re-read from disk on every pass, so a
+    `TopicModeler` can be built over more text than fits in memory."""
+
+    def __init__(self, names):
+        self.names = names
+
+    def __iter__(self):
+        for name in self.names:
+            yield iter_filetokens(name)
 
 
 class TopicModeler:
@@ -152,8 +163,8 @@ class TopicModeler:
 if DEBUG:
     with Section('Topic Modeling'):
 
-        doc_tokens = [get_filetokens('topic{}.txt'.format(
-                      filenum)) for filenum in range(1, 5)]
+        doc_tokens = FileCorpus(['topic{}.txt'.format(
+                                 filenum) for filenum in range(1, 5)])
 
         tm = TopicModeler(doc_tokens)
 
@@ -7,9 +7,19 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
+from collections import deque
+from queue import Empty
+from queue import Full
 from random import choice
+from threading import Condition
+from threading import Lock
+from threading import Thread
+from time import monotonic
+from time import perf_counter
 from MOAL.helpers.text import gibberish
 from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
 from MOAL.data_structures.abstract.stack import Stack
 
 
@@ -45,15 +55,207 @@ class Dequeue(Queue):
 
     def enqueue(self, item):
         if self.direction == 'backwards':
-            self.items.insert(len(self.items) - 1, item)
+            self.items.append(item)
         else:
             super(Dequeue, self).enqueue(item)
 
     def dequeue(self):
         if self.direction == 'backwards':
-            self.items.remove()
-        else:
-            super(Dequeue, self).enqueue()
+            return self.items.pop(0)
+        return super(Dequeue, self).dequeue()
+
+
+# The list based queues above shift every item on each enqueue (or, for
+# a 'backwards' Dequeue, each dequeue), so they're O(n) an operation.
+# `collections.deque` is a linked list of fixed size blocks, so both ends
+# are O(1). These wrap one with an optional capacity, and the same
+# blocking/non-blocking interface as the standard library's `queue.Queue`:
+# `enqueue`/`dequeue` never wait and raise `Full`/`Empty`, while `put`/`get`
+# wait (up to `timeout` seconds) for room or for an item.
+
+
+class BoundedQueue(object):
+    """A thread-safe FIFO queue holding at most `maxsize` items (None for
+    no limit)."""
+
+    def __init__(self, maxsize=None, items=()):
+        self.maxsize = maxsize
+        self.limit = maxsize if maxsize is not None else float('inf')
+        self.items = deque()
+        # Two conditions over one lock, as in `queue.Queue`. The methods
+        # that never wait take the lock itself, which is cheaper.
+        self.mutex = Lock()
+        self.not_empty = Condition(self.mutex)
+        self.not_full = Condition(self.mutex)
+        # How many threads are waiting on each, so there's only a `notify`
+        # when it'd wake someone; it costs as much as the rest of an
+        # operation.
+        self.getters = 0
+        self.putters = 0
+        self.enqueue_many(items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def is_empty(self):
+        return not self.items
+
+    def is_full(self):
+        return len(self.items) >= self.limit
+
+    def peek(self):
+        with self.mutex:
+            if not self.items:
+                raise Empty
+            return self.items[0]
+
+    def enqueue(self, item):
+        with self.mutex:
+            if len(self.items) >= self.limit:
+                raise Full
+            self.items.append(item)
+            if self.getters:
+                self.not_empty.notify()
+
+    def dequeue(self):
+        with self.mutex:
+            if not self.items:
+                raise Empty
+            item = self.items.popleft()
+            if self.putters:
+                self.not_full.notify()
+            return item
+
+    def enqueue_many(self, items):
+        """Add all of `items`, or (if they don't all fit) none of them."""
+        items = list(items)
+        with self.mutex:
+            if len(self.items) + len(items) > self.limit:
+                raise Full
+            self.items.extend(items)
+            if self.getters:
+                self.not_empty.notify(len(items))
+
+    def _take(self, count):
+        popleft = self.items.popleft
+        taken = [popleft() for _ in range(min(count, len(self.items)))]
+        if self.putters:
+            self.not_full.notify(len(taken))
+        return taken
+
+    def dequeue_many(self, count):
+        """Up to `count` items, as many as there are; maybe none."""
+        with self.mutex:
+            return self._take(count)
+
+    def _wait(self, condition, ready, timeout):
+        """Wait (with the lock held) until `ready()`, or raise `Full` or
+        `Empty` if `timeout` runs out first."""
+        deadline = None if timeout is None else monotonic() + timeout
+        while not ready():
+            if deadline is None:
+                condition.wait()
+                continue
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise Full if condition is self.not_full else Empty
+            condition.wait(remaining)
+
+    def _wait_for_room(self, timeout):
+        self.putters += 1
+        try:
+            self._wait(self.not_full,
+                       lambda: len(self.items) < self.limit, timeout)
+        finally:
+            self.putters -= 1
+
+    def _wait_for_items(self, timeout):
+        self.getters += 1
+        try:
+            self._wait(self.not_empty, lambda: self.items, timeout)
+        finally:
+            self.getters -= 1
+
+    def put(self, item, block=True, timeout=None):
+        """Add an item, waiting for room if the queue is full."""
+        if not block:
+            return self.enqueue(item)
+        with self.mutex:
+            self._wait_for_room(timeout)
+            self.items.append(item)
+            if self.getters:
+                self.not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        """Take the next item, waiting for one if the queue is empty."""
+        if not block:
+            return self.dequeue()
+        with self.mutex:
+            self._wait_for_items(timeout)
+            item = self.items.popleft()
+            if self.putters:
+                self.not_full.notify()
+            return item
+
+    def put_many(self, items, timeout=None):
+        """Add the items in order, waiting for room as needed. On a timeout
+        the ones that fit are left in the queue."""
+        for item in items:
+            self.put(item, timeout=timeout)
+
+    def get_many(self, count, timeout=None):
+        """Wait for at least one item, then take up to `count`."""
+        with self.mutex:
+            self._wait_for_items(timeout)
+            return self._take(count)
+
+
+class BoundedDequeue(BoundedQueue):
+    """A double ended version: items can also be added at the front and
+    taken from the back, all O(1)."""
+
+    def enqueue_front(self, item):
+        with self.mutex:
+            if len(self.items) >= self.limit:
+                raise Full
+            self.items.appendleft(item)
+            if self.getters:
+                self.not_empty.notify()
+
+    def dequeue_back(self):
+        with self.mutex:
+            if not self.items:
+                raise Empty
+            item = self.items.pop()
+            if self.putters:
+                self.not_full.notify()
+            return item
+
+    def peek_back(self):
+        with self.mutex:
+            if not self.items:
+                raise Empty
+            return self.items[-1]
+
+
+def benchmark(operations=10 ** 6, sizes=(100, 10000, 100000)):
+    """Seconds for `operations` enqueues and dequeues (alternating, so the
+    queue stays at `size` items) with each implementation."""
+    results = {}
+    for size in sizes:
+        for name, queue in [('Queue (list)', Queue()),
+                            ('Dequeue (list)', Dequeue('backwards')),
+                            ('BoundedQueue (deque)', BoundedQueue()),
+                            ('BoundedDequeue (deque)', BoundedDequeue())]:
+            for item in range(size):
+                queue.enqueue(item)
+            enqueue, dequeue = queue.enqueue, queue.dequeue
+            start = perf_counter()
+            for item in range(operations // 2):
+                enqueue(item)
+                dequeue()
+            results[(size, name)] = perf_counter() - start
+    return results
 
 
 class HotPotatoSimulator(Queue):
@@ -66,10 +268,8 @@ class HotPotatoSimulator(Queue):
     def adjust_position(self):
         print('Out of range... adjusting position to a valid index.')
         # If `self.num` is greater than the length of the list,
-        # keep adjusting until it's in range.
-        while self.out_of_range():
-            self.num -= 1
-            self.adjust_position()
+        # clamp it to the last index.
+        self.num = max(0, min(self.num, len(self.items) - 1))
 
     def move(self):
         if self.out_of_range():
@@ -121,3 +321,65 @@ if __name__ == '__main__':
 
         for _ in range(10):
             pq.print_job()
+
+    with Section('Bounded, deque backed queues'):
+        bq = BoundedQueue(maxsize=3, items=[1, 2])
+        bq.enqueue(3)
+        assert bq.is_full()
+        try:
+            bq.enqueue(4)
+        except Full:
+            print_simple('Enqueue on a full queue', 'raises Full')
+        try:
+            bq.enqueue_many([4, 5])
+        except Full:
+            pass
+        # All or nothing: neither was added.
+        assert len(bq) == 3
+        assert bq.dequeue_many(2) == [1, 2]
+        assert bq.dequeue() == 3
+        assert bq.dequeue_many(5) == []
+        try:
+            bq.get(timeout=0.01)
+        except Empty:
+            print_simple('Get on an empty queue, with a timeout',
+                         'raises Empty')
+
+        bdq = BoundedDequeue(maxsize=4, items=['b', 'c'])
+        bdq.enqueue_front('a')
+        bdq.enqueue('d')
+        assert bdq.peek() == 'a' and bdq.peek_back() == 'd'
+        assert [bdq.dequeue(), bdq.dequeue_back()] == ['a', 'd']
+        print_simple('Deque, front and back', list(bdq.items))
+
+        print_h2('Producer/consumer, blocking on a queue of 5')
+        work, consumed = BoundedQueue(maxsize=5), []
+
+        def produce():
+            work.put_many(range(100))
+            work.put(None)
+
+        def consume():
+            while True:
+                batch = work.get_many(8)
+                consumed.extend(item for item in batch if item is not None)
+                if None in batch:
+                    return
+
+        threads = [Thread(target=produce), Thread(target=consume)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert consumed == list(range(100))
+        print_simple('Consumed in order', len(consumed))
+
+    with Section('Queues - list vs deque, 10^6 operations'):
+        # The list based ones get slower with the queue's size; the deque
+        # based ones don't. (Their fixed cost is mostly the lock, so a short
+        # list still wins single threaded. At 10^5 items the list based
+        # Queue takes around a minute, so that size is left out here.)
+        results = benchmark(sizes=(100, 10000))
+        for (size, name), elapsed in sorted(results.items()):
+            print_simple('{} items: {}'.format(size, name),
+                         '{:.3f}s'.format(elapsed), newline=False)
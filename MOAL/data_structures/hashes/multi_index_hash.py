@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+__author__ = """Chris Tabor (dxdstudio@gmail.com)"""
+
+if __name__ == '__main__':
+    from os import getcwd
+    from os import sys
+    sys.path.append(getcwd())
+
+from heapq import nsmallest
+from itertools import combinations
+from math import comb
+from random import getrandbits
+from random import randrange
+from statistics import median
+from time import perf_counter
+from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
+from MOAL.helpers.text import random_binary
+
+DEBUG = True if __name__ == '__main__' else False
+
+
+try:
+    popcount = int.bit_count
+except AttributeError:
+    def popcount(num):
+        return bin(num).count('1')
+
+
+def as_code(code):
+    """Accept bit strings like the ones from `random_binary`, or ints."""
+    if isinstance(code, str):
+        return int(code, 2)
+    return code
+
+
+class MultiIndexHash(object):
+    """Multi-index hashing for Hamming space (Norouzi, Punjani and Fleet,
+    "Fast Search in Hamming Space with Multi-Index Hashing", 2012).
+
+    Each b-bit code is cut into m disjoint substrings, and each substring
+    gets its own hash table. If two codes are within distance r, then by
+    the pigeonhole principle at least one of their substrings is within
+    floor(r / m). So a search only has to probe, in every table, the
+    substrings within that small radius of the query's - and the number of
+    those grows far slower than the number within r of the whole code.
+    Every candidate found is then checked with a full popcount.
+
+    For k nearest neighbours the substring radius grows one step at a
+    time; once every table has been probed to radius s, every code within
+    m * (s + 1) - 1 of the query has been seen, so the search can stop as
+    soon as the k-th best is within that."""
+
+    def __init__(self, codes, bits, substrings=None):
+        self.bits = bits
+        self.codes = [as_code(code) for code in codes]
+        # Around log2(n) bits per substring keeps the tables dense but
+        # the buckets small.
+        if substrings is None:
+            per_table = max(1, len(self.codes).bit_length())
+            substrings = max(1, bits // per_table)
+        self.substrings = substrings
+        # (shift, mask, width) for each substring.
+        self.spans = []
+        base, extra = divmod(bits, substrings)
+        shift = 0
+        for k in range(substrings):
+            width = base + (1 if k < extra else 0)
+            self.spans.append((shift, (1 << width) - 1, width))
+            shift += width
+        self.tables = [{} for _ in range(substrings)]
+        for index, code in enumerate(self.codes):
+            for table, (shift, mask, _) in zip(self.tables, self.spans):
+                key = (code >> shift) & mask
+                bucket = table.get(key)
+                if bucket is None:
+                    table[key] = [index]
+                else:
+                    bucket.append(index)
+        self._flips = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _masks(self, width, dist):
+        """All `width` bit masks with exactly `dist` bits set."""
+        key = (width, dist)
+        if key not in self._flips:
+            self._flips[key] = [sum(1 << bit for bit in bits)
+                                for bits in combinations(range(width), dist)]
+        return self._flips[key]
+
+    def _too_costly(self, dist):
+        """Probing radius `dist` costs C(width, dist) lookups per table.
+        For a query far from everything, that outgrows the number of
+        codes, and a linear scan is cheaper."""
+        return sum(comb(width, dist) for _, _, width in self.spans
+                   if dist <= width) > len(self.codes)
+
+    def _probe(self, query, dist, seen, found):
+        """Look up every substring exactly `dist` away from the query's,
+        in every table, and add (distance, index) for new candidates."""
+        codes = self.codes
+        for table, (shift, mask, width) in zip(self.tables, self.spans):
+            if dist > width:
+                continue
+            sub = (query >> shift) & mask
+            for flip in self._masks(width, dist):
+                for index in table.get(sub ^ flip, ()):
+                    if index not in seen:
+                        seen.add(index)
+                        found.append((popcount(codes[index] ^ query), index))
+
+    def radius(self, query, r):
+        """All codes within Hamming distance r, as (distance, index)."""
+        query = as_code(query)
+        seen, found = set(), []
+        for dist in range(r // self.substrings + 1):
+            if self._too_costly(dist):
+                return sorted(pair for pair in (
+                    (popcount(code ^ query), index)
+                    for index, code in enumerate(self.codes)) if pair[0] <= r)
+            self._probe(query, dist, seen, found)
+        return sorted(pair for pair in found if pair[0] <= r)
+
+    def knn(self, query, k=1):
+        """The k closest codes, as (distance, index) pairs, closest first."""
+        query = as_code(query)
+        k = min(k, len(self.codes))
+        seen, found = set(), []
+        widest = max(width for _, _, width in self.spans)
+        for dist in range(widest + 1):
+            if self._too_costly(dist):
+                return brute_knn(self.codes, query, k)
+            self._probe(query, dist, seen, found)
+            if len(found) >= k:
+                best = nsmallest(k, found)
+                if best[-1][0] <= self.substrings * (dist + 1) - 1:
+                    return best
+        return nsmallest(k, found)
+
+    def knn_many(self, queries, k=1):
+        return [self.knn(query, k) for query in queries]
+
+    def radius_many(self, queries, r):
+        return [self.radius(query, r) for query in queries]
+
+
+def brute_knn(codes, query, k=1):
+    return nsmallest(k, ((popcount(code ^ query), index)
+                         for index, code in enumerate(codes)))
+
+
+def benchmark(count=100000, bits=64, queries=100, noise=4):
+    """Median per-query time (ms) for multi-index hashing vs a linear scan,
+    looking up near-duplicates of indexed codes (`noise` bits flipped):
+    the closest code, and every code within `noise` bits."""
+    codes = [getrandbits(bits) for _ in range(count)]
+    lookups = []
+    for num in range(queries):
+        code = codes[num * (count // queries)]
+        for _ in range(noise):
+            code ^= 1 << randrange(bits)
+        lookups.append(code)
+    start = perf_counter()
+    index = MultiIndexHash(codes, bits)
+    results = {'build_s': perf_counter() - start,
+               'substrings': index.substrings}
+
+    def brute_radius(query, r):
+        return [(dist, pos) for pos, dist in enumerate(
+            popcount(code ^ query) for code in codes) if dist <= r]
+
+    for name, search in [
+            ('mih knn', lambda q: index.knn(q, 1)),
+            ('brute knn', lambda q: brute_knn(codes, q, 1)),
+            ('mih radius', lambda q: index.radius(q, noise)),
+            ('brute radius', lambda q: brute_radius(q, noise))]:
+        times = []
+        for lookup in lookups:
+            start = perf_counter()
+            search(lookup)
+            times.append((perf_counter() - start) * 1000)
+        results[name] = median(times)
+    return results
+
+
+if DEBUG:
+    with Section('Multi-index hashing - Hamming nearest neighbours'):
+        codes = [random_binary(32) for _ in range(20000)]
+        mih = MultiIndexHash(codes, bits=32)
+        print_simple('Tables', mih.substrings)
+        query = codes[123]
+        nearest = mih.knn(query, k=5)
+        ints = mih.codes
+        assert nearest[0] == (0, 123)
+        assert [d for d, _ in nearest] == [
+            d for d, _ in brute_knn(ints, as_code(query), 5)]
+        print_simple('5 nearest to {}'.format(query), [
+            (dist, codes[index]) for dist, index in nearest])
+        within = mih.radius(query, 6)
+        assert within == sorted(
+            (popcount(code ^ ints[123]), index)
+            for index, code in enumerate(ints)
+            if popcount(code ^ ints[123]) <= 6)
+        print_simple('Codes within 6 bits', len(within))
+
+        print_h2('Batch queries')
+        queries = [random_binary(32) for _ in range(50)]
+        for query, found in zip(queries, mih.knn_many(queries, k=3)):
+            assert [d for d, _ in found] == [
+                d for d, _ in brute_knn(ints, as_code(query), 3)]
+        print('- 50 batch queries match brute force.')
+
+    with Section('Multi-index hashing - benchmark'):
+        for bits in [32, 64, 128]:
+            res = benchmark(count=100000, bits=bits, queries=50)
+            print_simple('{} bit codes, {} tables, built in {:.2f}s'.format(
+                bits, res['substrings'], res['build_s']),
+                'per query (vs brute): knn {:.3f}ms ({:.3f}ms), '
+                'radius {:.3f}ms ({:.3f}ms)'.format(
+                    res['mih knn'], res['brute knn'],
+                    res['mih radius'], res['brute radius']), newline=False)
@@ -7,93 +7,328 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
+from array import array
+from threading import Condition
+from threading import Lock
+from time import sleep
+from time import time
 from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
 
 DEBUG = True if __name__ == '__main__' else False
 
+# What to do when a write doesn't fit in the remaining free space.
+OVERWRITE = 'overwrite'  # Drop the oldest unread items to make room.
+BLOCK = 'block'  # Wait until the consumer frees up enough room.
+ERROR = 'error'  # Raise BufferFull straight away.
+POLICIES = (OVERWRITE, BLOCK, ERROR)
+
 
 class InvalidBufferLength(Exception):
     pass
 
 
-class CircularBuffer(list):
+class BufferFull(Exception):
+    pass
+
+
+class _NullLock(object):
+    """Stands in for a lock where none is needed."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class CircularBuffer(object):
+    """A fixed capacity ring buffer over a typed `array`.
+
+    Nothing is ever reallocated or shifted; the read and write positions
+    are monotonic counters, and `counter % capacity` gives the slot. That
+    makes the number of unread items simply `head - tail`, with no
+    ambiguity between "full" and "empty".
+
+    Batch reads hand back memoryview segments of the underlying storage
+    (one, or two if the data wraps around the end), so no copy is made.
+    The slots stay unread until the caller is done with them and calls
+    `consume`, so the producer can't write over them in the meantime."""
 
-    def __init__(self, items, **kwargs):
-        # Testing enforcement of maximum ring size
-        self.MAX_SIZE = 8
-        # Keep a "pointer" to the active index; it starts at 0.
-        self.pointer = 0
-        if not isinstance(items, list):
-            raise TypeError
-        if len(items) > self.MAX_SIZE:
-            raise InvalidBufferLength(
-                'Number of items cannot exceed {}'.format(self.MAX_SIZE))
-        super(CircularBuffer, self).__init__(items, **kwargs)
+    def __init__(self, capacity, typecode='d', policy=OVERWRITE):
+        if capacity < 1:
+            raise InvalidBufferLength('Capacity must be at least 1')
+        if policy not in POLICIES:
+            raise ValueError('Policy must be one of {}'.format(POLICIES))
+        self.capacity = capacity
+        self.typecode = typecode
+        self.policy = policy
+        self._data = array(typecode, [0]) * capacity
+        self._view = memoryview(self._data)
+        # Total number of items ever written and read, respectively.
+        self._head = 0
+        self._tail = 0
+        # Number of unread items lost to the overwrite policy.
+        self.dropped = 0
+        self._lock = Lock()
+        self._not_full = Condition(self._lock)
+        self._not_empty = Condition(self._lock)
+
+    def __len__(self):
+        return self._head - self._tail
+
+    def __getitem__(self, index):
+        """Index relative to the oldest unread item."""
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('buffer index out of range')
+        return self._data[(self._tail + index) % self.capacity]
+
+    def __iter__(self):
+        for segment in self.peek_many(len(self)):
+            for item in segment:
+                yield item
 
     def __str__(self):
-        indices = map(str, range(len(self)))
-        chars = map(str, self)
-        print('Current pointer: {}\n{}'.format(
-            self.pointer, ' ' + '   '.join(indices)))
-        return '[{}]'.format('] ['.join(chars))
-
-    def __delitem__(self, key):
-        # Delitem becomes a no-op here because we just overwrite items instead.
-        pass
-
-    def __getitem__(self, key):
-        return super(CircularBuffer, self).__getitem__(key)
-
-    def __setitem__(self, index, value):
-        # If the pointer is at the end, append the value at the beginning.
-        old = self.pointer
-        if self.pointer >= self.MAX_SIZE:
-            # Reset pointer position to the beginning, **before** appending.
-            self.pointer = 0
-            super(CircularBuffer, self).__setitem__(self.pointer, value)
-        else:
-            # Set the given value
-            super(CircularBuffer, self).__setitem__(index, value)
-
-        # Update pointer **after**
-        self.pointer += 1
-        print('  POINTER: {} => {}'.format(old, self.pointer))
-
-    def append(self, value):
-        return self.__setitem__(self.pointer, value)
+        return '<{} {}/{} unread, {} dropped>'.format(
+            self.__class__.__name__, len(self), self.capacity, self.dropped)
+
+    @property
+    def free(self):
+        return self.capacity - len(self)
+
+    def _segments(self, start, count):
+        """Views over `count` slots starting at counter `start`,
+        split in two if they run past the end of the storage."""
+        index = start % self.capacity
+        first = min(count, self.capacity - index)
+        segments = [self._view[index:index + first]]
+        if count > first:
+            segments.append(self._view[:count - first])
+        return segments
+
+    def _as_array(self, values):
+        if isinstance(values, array) and values.typecode == self.typecode:
+            return values
+        return array(self.typecode, values)
+
+    def _wait_for_space(self, count, timeout):
+        """Called with the lock held; returns once `count` slots are free."""
+        if count <= self.free:
+            return
+        if self.policy == OVERWRITE:
+            lost = count - self.free
+            self._tail += lost
+            self.dropped += lost
+        elif self.policy == ERROR:
+            raise BufferFull('{} items do not fit, only {} free'.format(
+                count, self.free))
+        elif not self._not_full.wait_for(
+                lambda: count <= self.free, timeout):
+            raise BufferFull('Timed out waiting for {} free slots'.format(
+                count))
+
+    def _wait_for_data(self, timeout):
+        """Called with the lock held; returns once something is unread."""
+        if not self._not_empty.wait_for(lambda: len(self) > 0, timeout):
+            return False
+        return True
+
+    def _publish(self, values):
+        source = memoryview(values)
+        offset = 0
+        for segment in self._segments(self._head, len(values)):
+            segment[:] = source[offset:offset + len(segment)]
+            offset += len(segment)
+        # Only advance the head once the data is in place, so a
+        # concurrent reader never sees a slot before it's filled.
+        self._head += len(values)
+
+    def write(self, value, timeout=None):
+        return self.write_many((value,), timeout=timeout)
+
+    def write_many(self, values, timeout=None):
+        """Copy a batch of values in, applying the full-buffer policy.
+        Returns the number of values written."""
+        values = self._as_array(values)
+        excess = len(values) - self.capacity
+        if excess > 0:
+            if self.policy != OVERWRITE:
+                raise InvalidBufferLength(
+                    'Batch of {} exceeds capacity {}'.format(
+                        len(values), self.capacity))
+            # Everything but the newest `capacity` items would be
+            # overwritten straight away anyway.
+            values = values[excess:]
+        with self._lock:
+            self.dropped += max(excess, 0)
+            self._wait_for_space(len(values), timeout)
+            self._publish(values)
+            self._not_empty.notify_all()
+        return len(values)
+
+    def peek_many(self, count, block=False, timeout=None):
+        """Zero-copy views over up to `count` of the oldest unread items,
+        without consuming them; pass the total length to `consume` once
+        they've been used. (With the overwrite policy a write can still
+        drop them, so use `read_array` there.)"""
+        with self._lock:
+            if block and not self._wait_for_data(timeout):
+                return []
+            count = min(count, len(self))
+            if count == 0:
+                return []
+            return self._segments(self._tail, count)
+
+    def _advance(self, count):
+        """Called with the lock held; frees up `count` slots."""
+        self._tail += count
+        self._not_full.notify_all()
+
+    def consume(self, count):
+        """Mark up to `count` unread items as read, freeing their slots."""
+        with self._lock:
+            count = min(count, len(self))
+            self._advance(count)
+        return count
+
+    def read_array(self, count, block=False, timeout=None):
+        """Consume up to `count` items, copied into a new array."""
+        result = array(self.typecode)
+        with self._lock:
+            if block and not self._wait_for_data(timeout):
+                return result
+            count = min(count, len(self))
+            if count:
+                for segment in self._segments(self._tail, count):
+                    result.frombytes(segment.tobytes())
+            self._advance(len(result))
+        return result
+
+    def read(self):
+        with self._lock:
+            if len(self) == 0:
+                raise IndexError('read from empty buffer')
+            value = self[0]
+            self._advance(1)
+        return value
+
+
+class SPSCCircularBuffer(CircularBuffer):
+    """Single-producer/single-consumer variant that takes no locks.
+
+    The producer is the only one who ever moves the head and the consumer
+    is the only one who ever moves the tail, and each side publishes its
+    counter only after it's done touching the slots. Waiting is done by
+    polling with a small back off instead of with a condition variable.
+    Since overwriting would mean the producer moving the tail, that policy
+    isn't supported here."""
+
+    # Longest sleep between polls, in seconds.
+    MAX_BACKOFF = 0.001
+
+    def __init__(self, capacity, typecode='d', policy=BLOCK):
+        if policy == OVERWRITE:
+            raise ValueError('SPSC mode cannot overwrite unread items')
+        super(SPSCCircularBuffer, self).__init__(
+            capacity, typecode=typecode, policy=policy)
+        self._lock = _NullLock()
+
+    def _poll(self, condition, timeout):
+        deadline = None if timeout is None else time() + timeout
+        delay = 0
+        while not condition():
+            if deadline is not None and time() >= deadline:
+                return False
+            sleep(delay)
+            delay = min(self.MAX_BACKOFF, (delay * 2) or 1e-6)
+        return True
+
+    def _wait_for_space(self, count, timeout):
+        if count <= self.free:
+            return
+        if self.policy == ERROR:
+            raise BufferFull('{} items do not fit, only {} free'.format(
+                count, self.free))
+        if not self._poll(lambda: count <= self.free, timeout):
+            raise BufferFull('Timed out waiting for {} free slots'.format(
+                count))
+
+    def _wait_for_data(self, timeout):
+        return self._poll(lambda: len(self) > 0, timeout)
+
+    def write_many(self, values, timeout=None):
+        values = self._as_array(values)
+        if len(values) > self.capacity:
+            raise InvalidBufferLength('Batch of {} exceeds capacity {}'.format(
+                len(values), self.capacity))
+        self._wait_for_space(len(values), timeout)
+        self._publish(values)
+        return len(values)
+
+    def _advance(self, count):
+        self._tail += count
 
 
 if DEBUG:
     with Section('Array - Circular Buffer'):
-        # Populate a full buffer
-        circbuff = CircularBuffer(range(8))
+        circbuff = CircularBuffer(8, typecode='l')
+        circbuff.write_many(range(8))
         print(circbuff)
 
-        # Start overwriting values
-        circbuff.append('A')
-        circbuff.append('B')
-        circbuff.append('C')
-        circbuff.append('D')
-        circbuff.append('E')
-        circbuff.append('0')
-        circbuff.append('10')
-        print(circbuff)
+        # Start overwriting values; the oldest ones get dropped.
+        circbuff.write_many([100, 101, 102, 103, 104])
+        assert list(circbuff) == [5, 6, 7, 100, 101, 102, 103, 104]
+        assert circbuff.dropped == 5
+        assert circbuff[0] == 5 and circbuff[-1] == 104
 
-        # Test that the indices have been overwritten properly.
-        assert circbuff[0] == 'A'
-        assert circbuff[1] == 'B'
-        assert circbuff[2] == 'C'
-        assert circbuff[3] == 'D'
-        assert circbuff[4] == 'E'
+        print_h2('Zero-copy batch reads across the wrap-around')
+        segments = circbuff.peek_many(6)
+        print_simple('Segments', [segment.tolist() for segment in segments])
+        assert len(segments) == 2
+        assert sum([s.tolist() for s in segments], []) == [
+            5, 6, 7, 100, 101, 102]
+        # Still unread until they're consumed.
+        assert len(circbuff) == 8
+        assert circbuff.consume(6) == 6
+        assert list(circbuff) == [103, 104]
 
-        # Add some more to check...
-        circbuff.append('Z')
-        circbuff.append('X')
-        circbuff.append('Y')
+        print_h2('Error policy')
+        strict = CircularBuffer(4, typecode='B', policy=ERROR)
+        strict.write_many(b'abcd')
+        try:
+            strict.write(ord('e'))
+        except BufferFull:
+            print('- Prevented overwriting unread data.')
+        assert strict.read_array(4).tobytes() == b'abcd'
 
-        # Check that it wraps around properly (again).
-        assert circbuff[7] == 'Z'
-        assert circbuff[0] == 'X'
-        assert circbuff[1] == 'Y'
+    with Section('Array - Circular Buffer - threaded telemetry'):
+        from threading import Thread
 
-        print(circbuff)
+        def produce(ring, total, batch=64):
+            for start in range(0, total, batch):
+                ring.write_many(range(start, min(start + batch, total)))
+
+        def consume(ring, total, received):
+            while len(received) < total:
+                segments = ring.peek_many(256, block=True, timeout=5)
+                for segment in segments:
+                    received.extend(segment.tolist())
+                # Only now can the producer reuse the slots.
+                ring.consume(sum(len(segment) for segment in segments))
+
+        for ring in [CircularBuffer(1024, typecode='l', policy=BLOCK),
+                     SPSCCircularBuffer(1024, typecode='l')]:
+            received, total = [], 100000
+            threads = [Thread(target=produce, args=(ring, total)),
+                       Thread(target=consume, args=(ring, total, received))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert received == list(range(total))
+            print_simple(ring.__class__.__name__, 'received {} items in order'
+                         .format(len(received)))
@@ -7,57 +7,298 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
+from array import array
+from array import typecodes
+from bisect import bisect_left
+from bisect import bisect_right
+from random import randrange as rr
+from sys import argv
+from time import time
 from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
 
 DEBUG = True if __name__ == '__main__' else False
 
+# 'u' is deprecated in newer Pythons in favour of 'w' (always UCS-4).
+CHAR_TYPECODE = 'w' if 'w' in typecodes else 'u'
+GAP_CHAR = u'_'
 
-class GapBuffer(list):
 
-    def __init__(self, string, gap_size=8):
-        self.gap_size = gap_size
-        chars = list(string)
-        mid = len(string) // 2
-        # This forms the gap reference
-        self.left_pointer, self.right_pointer = mid, mid + gap_size
-        for k, char in enumerate(chars):
-            if k == mid:
-                for _ in range(gap_size):
-                    self.append(' ')
-            self.append(char)
+class GapBuffer(object):
+    """A text buffer with a "gap" of free space at the cursor.
+
+    Typing and deleting near the cursor only touches the edge of the gap,
+    so local edits are O(1) amortised. Moving the cursor by d characters
+    slides the text across the gap, which is O(d).
+
+    Line starts are tracked the same way: newlines before the gap are kept
+    as absolute offsets, and newlines after it as distances from the end of
+    the text, so neither list has to be renumbered when the gap fills up
+    or shrinks. Both stay sorted, which makes line/column lookups a bisect.
+    """
+
+    def __init__(self, text=u'', gap_size=64):
+        self.min_gap = max(1, gap_size)
+        self._buf = array(CHAR_TYPECODE, text) + array(
+            CHAR_TYPECODE, GAP_CHAR * self.min_gap)
+        self.gap_start = len(text)
+        self.gap_end = len(self._buf)
+        # Offsets of newlines before the gap, ascending.
+        self._nl_before = [k for k, char in enumerate(text) if char == '\n']
+        # Distances from the end of newlines after the gap, ascending
+        # (so the newline nearest the cursor is last).
+        self._nl_after = []
+
+    def __len__(self):
+        return len(self._buf) - (self.gap_end - self.gap_start)
+
+    def __getitem__(self, pos):
+        if pos < 0:
+            pos += len(self)
+        if not 0 <= pos < len(self):
+            raise IndexError('gap buffer index out of range')
+        if pos >= self.gap_start:
+            pos += self.gap_end - self.gap_start
+        return self._buf[pos]
 
     def __str__(self):
-        # Useful for visualizing the "gap" in the list.
-        val = ''
-        for k, char in enumerate(self):
-            if k == self.left_pointer:
-                val += '['
-            elif k == self.right_pointer:
-                val += ']'
-            val += char
-        return val
+        return self.text()
+
+    def text(self):
+        return (self._buf[:self.gap_start] +
+                self._buf[self.gap_end:]).tounicode()
+
+    def debug_view(self):
+        """Useful for visualizing the "gap" in the buffer."""
+        return u'{}[{}]{}'.format(
+            self._buf[:self.gap_start].tounicode(),
+            self._buf[self.gap_start:self.gap_end].tounicode(),
+            self._buf[self.gap_end:].tounicode())
+
+    @property
+    def cursor(self):
+        return self.gap_start
 
     def move(self, count):
-        # Wrap around if the count is too high
-        if self.left_pointer + count >= len(self):
-            self.left_pointer = count
-            self.right_pointer = count + self.gap_size
-        elif self.right_pointer + count >= len(self):
-            diff = self.right_pointer - len(self)
-            self.right_pointer = diff
-            self.left_pointer = len(self) - diff
-        else:
-            self.left_pointer += count
-            self.right_pointer += count
-        print(self)
+        """Move the cursor `count` characters (negative moves left)."""
+        self.move_to(self.gap_start + count)
+
+    def move_to(self, pos):
+        """Put the cursor at `pos`, sliding text across the gap."""
+        pos = max(0, min(pos, len(self)))
+        buf, size = self._buf, len(self)
+        if pos < self.gap_start:
+            count = self.gap_start - pos
+            buf[self.gap_end - count:self.gap_end] = buf[pos:self.gap_start]
+            # Newlines in [pos, gap_start) now sit after the gap.
+            split = bisect_left(self._nl_before, pos)
+            moved = self._nl_before[split:]
+            del self._nl_before[split:]
+            self._nl_after.extend(size - offset for offset in reversed(moved))
+            self.gap_start -= count
+            self.gap_end -= count
+        elif pos > self.gap_start:
+            count = pos - self.gap_start
+            buf[self.gap_start:pos] = buf[self.gap_end:self.gap_end + count]
+            # Newlines that were before `pos` are now before the gap.
+            split = bisect_right(self._nl_after, size - pos)
+            moved = self._nl_after[split:]
+            del self._nl_after[split:]
+            self._nl_before.extend(size - dist for dist in reversed(moved))
+            self.gap_start += count
+            self.gap_end += count
+
+    def _grow(self, needed):
+        """Double the gap (at least), so repeated typing is amortised O(1)."""
+        extra = max(needed, len(self._buf), self.min_gap)
+        self._buf = (self._buf[:self.gap_start] +
+                     array(CHAR_TYPECODE, GAP_CHAR * (
+                         self.gap_end - self.gap_start + extra)) +
+                     self._buf[self.gap_end:])
+        self.gap_end += extra
+
+    def insert(self, text):
+        """Insert `text` at the cursor, leaving the cursor after it."""
+        count = len(text)
+        if count > self.gap_end - self.gap_start:
+            self._grow(count)
+        start = self.gap_start
+        self._buf[start:start + count] = array(CHAR_TYPECODE, text)
+        if u'\n' in text:
+            offset = text.find(u'\n')
+            while offset != -1:
+                self._nl_before.append(start + offset)
+                offset = text.find(u'\n', offset + 1)
+        self.gap_start += count
+
+    def delete(self, count=1):
+        """Delete up to `count` characters after the cursor."""
+        count = min(count, len(self._buf) - self.gap_end)
+        size = len(self)
+        # Those newlines are the ones furthest from the end.
+        split = bisect_left(self._nl_after, size - self.gap_start - count + 1)
+        del self._nl_after[split:]
+        self.gap_end += count
+        return count
+
+    def backspace(self, count=1):
+        """Delete up to `count` characters before the cursor."""
+        count = min(count, self.gap_start)
+        self.gap_start -= count
+        split = bisect_left(self._nl_before, self.gap_start)
+        del self._nl_before[split:]
+        return count
+
+    @property
+    def line_count(self):
+        return len(self._nl_before) + len(self._nl_after) + 1
+
+    def line_index(self, pos):
+        """Return the (line, column) of offset `pos`, both 0-based."""
+        if not 0 <= pos <= len(self):
+            raise IndexError('position out of range')
+        line = bisect_left(self._nl_before, pos)
+        if pos > self.gap_start:
+            line += len(self._nl_after) - bisect_right(
+                self._nl_after, len(self) - pos)
+        return line, pos - self.line_start(line)
+
+    def line_start(self, line):
+        """Offset of the first character on `line` (0-based)."""
+        if line == 0:
+            return 0
+        if not 0 < line < self.line_count:
+            raise IndexError('line out of range')
+        before = len(self._nl_before)
+        if line - 1 < before:
+            return self._nl_before[line - 1] + 1
+        dist = self._nl_after[len(self._nl_after) - (line - before)]
+        return len(self) - dist + 1
+
+
+class PieceTable(object):
+    """The alternative representation used by many editors: the original
+    text is never modified, insertions are appended to an "add" buffer, and
+    the document is a list of (buffer, start, length) pieces. Included as a
+    point of comparison for the gap buffer benchmark."""
+
+    def __init__(self, text=u''):
+        self.buffers = [text, []]
+        self._add_len = 0
+        self.pieces = [(0, 0, len(text))] if text else []
+
+    def __len__(self):
+        return sum(piece[2] for piece in self.pieces)
+
+    def _locate(self, pos):
+        """Index of the piece containing `pos`, and the offset within it."""
+        offset = 0
+        for k, (_, _, length) in enumerate(self.pieces):
+            if pos < offset + length:
+                return k, pos - offset
+            offset += length
+        return len(self.pieces), 0
+
+    def _split(self, pos):
+        """Make sure a piece boundary exists at `pos`, returning its index."""
+        k, within = self._locate(pos)
+        if within:
+            buf, start, length = self.pieces[k]
+            self.pieces[k:k + 1] = [
+                (buf, start, within), (buf, start + within, length - within)]
+            k += 1
+        return k
+
+    def insert(self, pos, text):
+        self.buffers[1].append(text)
+        k = self._split(pos)
+        self.pieces.insert(k, (1, self._add_len, len(text)))
+        self._add_len += len(text)
+
+    def delete(self, pos, count):
+        start = self._split(pos)
+        end = self._split(pos + count)
+        del self.pieces[start:end]
+
+    def text(self):
+        added = u''.join(self.buffers[1])
+        return u''.join(
+            (self.buffers[0] if buf == 0 else added)[start:start + length]
+            for buf, start, length in self.pieces)
+
+
+def benchmark_edits(size, edits=1000, locality=64):
+    """Time `edits` local insert/delete pairs near a wandering cursor
+    in a document of `size` characters, for each representation."""
+    line = u'The quick brown fox jumps over the lazy dog.\n'
+    text = (line * (size // len(line) + 1))[:size]
+    positions, pos = [], size // 2
+    for _ in range(edits):
+        pos = max(0, min(size - 1, pos + rr(-locality, locality)))
+        positions.append(pos)
+    results = {}
+
+    gbuff = GapBuffer(text)
+    start = time()
+    for pos in positions:
+        gbuff.move_to(pos)
+        gbuff.insert(u'xyz')
+        gbuff.backspace(1)
+        gbuff.delete(2)
+    results['gap buffer'] = time() - start
+
+    table = PieceTable(text)
+    start = time()
+    for pos in positions:
+        table.insert(pos, u'xyz')
+        table.delete(pos + 2, 3)
+    results['piece table'] = time() - start
+
+    string = text
+    start = time()
+    for pos in positions:
+        string = string[:pos] + u'xyz' + string[pos:]
+        string = string[:pos + 2] + string[pos + 5:]
+    results['str concatenation'] = time() - start
+
+    assert gbuff.text() == table.text() == string
+    return results
 
 
 if DEBUG:
     with Section('Gap Buffer'):
-        test_sentence = raw_input('Enter some starting text: ')
-        if test_sentence == '':
-            test_sentence = 'Hello world, how are you today?'
-        gbuff = GapBuffer(test_sentence)
-        print(gbuff)
-        for n in range(20):
-            gbuff.move(n)
+        gbuff = GapBuffer(u'Hello world, how are you today?', gap_size=4)
+        print(gbuff.debug_view())
+        gbuff.move_to(5)
+        gbuff.insert(u',')
+        gbuff.move(8)
+        gbuff.delete(3)
+        gbuff.insert(u'how is it going')
+        print(gbuff.debug_view())
+        assert gbuff.text() == u'Hello, world, how is it going are you today?'
+        gbuff.backspace(len(u'how is it going'))
+        gbuff.insert(u'\n')
+        print(gbuff.debug_view())
+
+        print_h2('Line/column lookups')
+        doc = GapBuffer(u'first line\nsecond\n\nfourth line here')
+        doc.move_to(14)
+        doc.insert(u'ary\nline')
+        text = doc.text()
+        print(text)
+        for pos in range(len(text) + 1):
+            line = text[:pos].count(u'\n')
+            col = pos - (text.rfind(u'\n', 0, pos) + 1)
+            assert doc.line_index(pos) == (line, col)
+        for line, start in enumerate([0] + [
+                k + 1 for k, char in enumerate(text) if char == u'\n']):
+            assert doc.line_start(line) == start
+        print_simple('Lines', doc.line_count)
+
+    with Section('Gap Buffer - edit throughput'):
+        # Pass a size in MB to run bigger documents, e.g. 100.
+        megabytes = float(argv[1]) if len(argv) > 1 else 1
+        results = benchmark_edits(int(megabytes * 1000000))
+        for name, took in sorted(results.items(), key=lambda res: res[1]):
+            print_simple(name, '{:.4f}s'.format(took), newline=False)
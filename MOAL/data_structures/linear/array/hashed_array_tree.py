@@ -7,46 +7,198 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
+from array import array
+from time import time
 from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
 from MOAL.helpers.display import print_simple
 
 DEBUG = True if __name__ == '__main__' else False
 
 
-class HashedArrayTree:
+class HashedArrayTree(object):
 
     # See http://www.drdobbs.com/database/algorithm-alley/184409965?pgno=5
     # for details.
+    #
+    # The top array holds 2^k pointers to leaves of 2^k items each, so the
+    # capacity is 4^k. An index splits into (leaf, offset) with a shift and
+    # a mask. Only the leaves actually in use are allocated, so at most one
+    # leaf (plus the unused top slots) is wasted: O(sqrt(n)) space.
+    #
+    # When the tree fills up, it's rebuilt with k + 1: each new leaf is
+    # exactly two old leaves glued together. The old leaves are released as
+    # they are merged, so the rebuild never holds two full copies at once.
 
-    def __init__(self):
-        self.top = []
+    def __init__(self, items=None, typecode='l'):
+        self.typecode = typecode
+        self.power = 1
+        self.top = [None] * 2
         self.count = 0
+        if items is not None:
+            self.extend(items)
+
+    @property
+    def leaf_size(self):
+        return 1 << self.power
+
+    @property
+    def capacity(self):
+        return 1 << (2 * self.power)
+
+    @property
+    def wasted(self):
+        """Allocated leaf slots not holding an item, plus empty top slots."""
+        allocated = sum(len(leaf) for leaf in self.top if leaf is not None)
+        empty_top = sum(1 for leaf in self.top if leaf is None)
+        return allocated - self.count + empty_top
+
+    def __len__(self):
+        return self.count
 
-    def add_leaf(self, leaves):
-        if len(self.top) + leaves % 2 != 0:
-            raise ValueError('Leaf count must be a power of 2!')
-        for n in range(leaves):
-            self.count += 1
-            self.top.append([])
+    def _locate(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('HAT index out of range')
+        return index >> self.power, index & (self.leaf_size - 1)
 
-    def add(self, leaf, items):
-        if len(self.top[leaf]) + len(items) % 2 != 0:
-            raise ValueError('Items count not a power of 2')
-        self.top[leaf] += items
+    def __getitem__(self, index):
+        leaf, offset = self._locate(index)
+        return self.top[leaf][offset]
+
+    def __setitem__(self, index, value):
+        leaf, offset = self._locate(index)
+        self.top[leaf][offset] = value
+
+    def __iter__(self):
+        remaining = self.count
+        for leaf in self.top:
+            if remaining <= 0:
+                break
+            for item in leaf[:remaining]:
+                yield item
+            remaining -= len(leaf)
 
     def __str__(self):
-        return '[{}]'.format(', '.join(map(str, self.top)))
+        return '[{}]'.format(', '.join(
+            str(leaf[:max(0, self.count - k * self.leaf_size)].tolist())
+            for k, leaf in enumerate(self.top) if leaf is not None))
+
+    def _new_leaf(self):
+        return array(self.typecode, [0]) * self.leaf_size
+
+    def _resize(self, power):
+        """Rebuild with leaves of 2^power items, re-slicing the old leaves
+        and dropping each one as soon as it's been copied."""
+        old_top, old_size = self.top, self.leaf_size
+        new_size = 1 << power
+        self.top = []
+        remaining = self.count
+        leaf = array(self.typecode)
+        for k in range(len(old_top)):
+            if remaining <= 0:
+                break
+            chunk = old_top[k][:min(old_size, remaining)]
+            old_top[k] = None
+            remaining -= len(chunk)
+            pos = 0
+            while pos < len(chunk):
+                take = min(new_size - len(leaf), len(chunk) - pos)
+                leaf.extend(chunk[pos:pos + take])
+                pos += take
+                if len(leaf) == new_size:
+                    self.top.append(leaf)
+                    leaf = array(self.typecode)
+        if leaf:
+            # Pad the partial last leaf back out to full size.
+            leaf.extend(array(self.typecode, [0]) * (new_size - len(leaf)))
+            self.top.append(leaf)
+        self.top.extend([None] * (new_size - len(self.top)))
+        self.power = power
+
+    def append(self, value):
+        if self.count == self.capacity:
+            self._resize(self.power + 1)
+        leaf, offset = self.count >> self.power, self.count & (
+            self.leaf_size - 1)
+        if self.top[leaf] is None:
+            self.top[leaf] = self._new_leaf()
+        self.top[leaf][offset] = value
+        self.count += 1
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def pop(self):
+        if self.count == 0:
+            raise IndexError('pop from empty HAT')
+        self.count -= 1
+        leaf, offset = self.count >> self.power, self.count & (
+            self.leaf_size - 1)
+        value = self.top[leaf][offset]
+        if offset == 0:
+            # Last item of this leaf is gone; release it.
+            self.top[leaf] = None
+        # Shrink once only an eighth is in use, so alternating
+        # append/pop at a boundary doesn't thrash.
+        if self.power > 1 and self.count <= self.capacity // 8:
+            self._resize(self.power - 1)
+        return value
+
+
+def _fill(container, count):
+    for num in range(count):
+        container.append(num)
+    return container
+
+
+def benchmark_appends(count, typecode='l'):
+    """Time `count` appends, then repeat them to measure the peak traced
+    memory while growing (tracing slows things down, so it's kept out of
+    the timed run), for a list, a typed array and a HAT."""
+    import tracemalloc
+    results = {}
+    for name, factory in [
+            ('list', list),
+            ('array', lambda: array(typecode)),
+            ('hashed array tree', lambda: HashedArrayTree(typecode=typecode))]:
+        start = time()
+        _fill(factory(), count)
+        took = time() - start
+        tracemalloc.start()
+        _fill(factory(), count)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {'time': took, 'peak_bytes': peak}
+    return results
 
 
 if DEBUG:
     with Section('Hashed array tree'):
         hat = HashedArrayTree()
-        hat.add_leaf(4)
-        print_simple('HAT', hat)
-        try:
-            hat.add(1, ['foo', 'bar', 'bim', 'baz', 'bim'])
-        except ValueError:
-            print('- Prevented unexpected value.')
-            hat.add(1, ['foo', 'bar', 'bim', 'baz'])
-        hat.add(2, ['foo', 'baz'])
-        print(hat)
+        for num in range(20):
+            hat.append(num)
+        print_simple('HAT', str(hat))
+        print_simple('Capacity / leaf size / wasted', (
+            hat.capacity, hat.leaf_size, hat.wasted))
+        assert list(hat) == list(range(20))
+        assert hat[17] == 17 and hat[-1] == 19
+        hat[3] = 300
+        assert hat[3] == 300
+
+        print_h2('Growth and shrinking')
+        big = HashedArrayTree(range(100000))
+        assert list(big) == list(range(100000))
+        assert big.wasted <= 2 * big.leaf_size
+        print_simple('Leaf size for 100,000 items', big.leaf_size)
+        while len(big) > 10:
+            big.pop()
+        assert list(big) == list(range(10))
+        print_simple('Leaf size after popping down to 10', big.leaf_size)
+
+    with Section('Hashed array tree - append benchmark'):
+        for name, res in sorted(benchmark_appends(1000000).items()):
+            print_simple(name, '{:.3f}s, peak {:,} bytes'.format(
+                res['time'], res['peak_bytes']), newline=False)
@@ -7,72 +7,438 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
+from MOAL.data_structures.linear.lists.skip_lists import SkipList
 from MOAL.helpers.display import Section
-from MOAL.helpers.display import print_success
-from MOAL.helpers.display import print_info
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
+from MOAL.helpers.display import print_table
 from random import randrange as rr
+from random import choice
+from random import seed
+from time import time
 
 
 DEBUG = True if __name__ == '__main__' else False
 
+# Every block starts on (and is sized to) a multiple of this.
+ALIGNMENT = 16
 
-class MemoryManager:
 
-    def __init__(self):
-        self.memory_blocks = {}
-        self.last_block = 1
-        self.MAX_RAM = 16000000000
-        self.free_ram = self.MAX_RAM
+def _align(size, alignment=ALIGNMENT):
+    return max(alignment, (size + alignment - 1) // alignment * alignment)
+
+
+def _next_power_of_two(num):
+    power = 1
+    while power < num:
+        power <<= 1
+    return power
+
+
+class Allocator(object):
+    """Base class for allocators that hand out address ranges of a
+    simulated heap (a `bytearray`). Subclasses implement `_allocate` and
+    `_release`; this keeps the bookkeeping used for the metrics."""
+
+    name = 'allocator'
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.memory = bytearray(capacity)
+        # address -> (block size, requested size)
+        self.allocated = {}
+        self.requested = 0
+        self.in_use = 0
+        # Highest address ever handed out; how big the heap really needs
+        # to be for this workload.
+        self.peak_footprint = 0
+        self.peak_in_use = 0
 
     def __str__(self):
-        print_success('Viewing applications in memory...')
-        for node, ram_usage in self.memory_blocks.iteritems():
-            print('--- {} | {} bytes @ {}'.format(
-                node, sum([f[0] for f in ram_usage]),
-                [f[1] for f in ram_usage]))
-        return ''
-
-    def _divvy_ram(self, ram):
-        """This is an arbitrary, somewhat meaningless method, to simulate
-        the notion of free blocks of ram that must be allocated and
-        referenced via pointer. A given program may require X ram, but
-        the location of available ram may be disparate, so various blocks have
-        to be stored as a free linked list, or similar data structure.
-        Since we've already covered linked lists, association lists, etc...,
-        there isn't much value outside learning the context of this data
-        structure, which tends to be in memory management."""
-        subdivisions = rr(2, 20)  # Arbitrary number
-        flist = []
-        while subdivisions > 0:
-            diff = rr(0, ram)
-            # Store ram as [current block of memory, location]
-            flist.append([diff, str(self.last_block).zfill(4)])
-            ram = ram - diff
-            self.last_block += 1
-            subdivisions -= 1
-            if DEBUG:
-                print_info('Ram: {} / diff: {}'.format(ram, diff))
-        return flist
-
-    def malloc(self, item, ram):
-        self.memory_blocks[item] = self._divvy_ram(ram)
-        self.free_ram -= ram
-        print('Ram decreased: {} ({} bytes)'.format(self.free_ram, ram))
-
-    def free(self, item):
-        ram = sum([f[0] for f in self.memory_blocks[item]])
-        self.free_ram += ram
-        print('Ram increased: {} ({} bytes)'.format(self.free_ram, ram))
-        del self.memory_blocks[item]
+        return '<{} {}/{} bytes in use, {:.1%} fragmented>'.format(
+            self.name, self.in_use, self.capacity, self.fragmentation())
+
+    def malloc(self, size):
+        """Reserve at least `size` bytes, returning the block's address.
+        Raises MemoryError if no free block is big enough."""
+        if size <= 0:
+            raise ValueError('Allocation size must be positive')
+        address, block = self._allocate(size)
+        self.allocated[address] = (block, size)
+        self.requested += size
+        self.in_use += block
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        self.peak_footprint = max(self.peak_footprint, address + block)
+        return address
+
+    def free(self, address):
+        try:
+            block, size = self.allocated.pop(address)
+        except KeyError:
+            raise ValueError('Invalid free of address {}'.format(address))
+        self.requested -= size
+        self.in_use -= block
+        self._release(address, block)
+
+    def view(self, address):
+        """A writable memoryview of an allocated block's requested bytes."""
+        block, size = self.allocated[address]
+        return memoryview(self.memory)[address:address + size]
+
+    def free_blocks(self):
+        """Sizes of all free blocks."""
+        raise NotImplementedError
+
+    def fragmentation(self):
+        """External fragmentation: 1 - largest free block / all free space.
+        0 means all the free memory is one contiguous block."""
+        blocks = self.free_blocks()
+        total = sum(blocks)
+        if not total:
+            return 0.0
+        return 1 - max(blocks) / float(total)
+
+    def internal_waste(self):
+        """Bytes handed out beyond what was requested (rounding, etc)."""
+        return self.in_use - self.requested
+
+    def _allocate(self, size):
+        """Return (address, block size) of a newly reserved block."""
+        raise NotImplementedError
+
+    def _release(self, address, block):
+        raise NotImplementedError
+
+
+class FreeListAllocator(Allocator):
+    """A classic free list with immediate coalescing.
+
+    Free blocks are indexed three ways:
+        - by start and end address (dicts), so a freed block can find and
+          merge with free neighbours in O(1).
+        - by (size, address) in a skip list, so best fit is a single
+          O(log n) successor search.
+        - in a max segment tree over address order, so first fit (the
+          lowest addressed block that's big enough) is O(log n) too,
+          rather than a walk down the list.
+    """
+
+    FIRST_FIT = 'first-fit'
+    BEST_FIT = 'best-fit'
+
+    def __init__(self, capacity, policy=FIRST_FIT):
+        if policy not in (self.FIRST_FIT, self.BEST_FIT):
+            raise ValueError('Unknown fit policy: {}'.format(policy))
+        capacity = capacity // ALIGNMENT * ALIGNMENT
+        super(FreeListAllocator, self).__init__(capacity)
+        self.name = policy
+        self.policy = policy
+        self._by_start = {}
+        self._by_end = {}
+        self._by_size = SkipList()
+        self._leaves = _next_power_of_two(max(1, capacity // ALIGNMENT))
+        self._tree = [0] * (2 * self._leaves)
+        self._add_free(0, capacity)
+
+    def _set_tree(self, address, size):
+        pos = address // ALIGNMENT + self._leaves
+        tree = self._tree
+        tree[pos] = size
+        pos //= 2
+        while pos:
+            tree[pos] = max(tree[2 * pos], tree[2 * pos + 1])
+            pos //= 2
+
+    def _add_free(self, address, size):
+        self._by_start[address] = size
+        self._by_end[address + size] = address
+        self._by_size.insert((size, address))
+        self._set_tree(address, size)
+
+    def _remove_free(self, address):
+        size = self._by_start.pop(address)
+        del self._by_end[address + size]
+        self._by_size.remove((size, address))
+        self._set_tree(address, 0)
+        return size
+
+    def _first_fit(self, size):
+        tree = self._tree
+        if tree[1] < size:
+            return None
+        pos = 1
+        while pos < self._leaves:
+            pos = 2 * pos if tree[2 * pos] >= size else 2 * pos + 1
+        return (pos - self._leaves) * ALIGNMENT
+
+    def _best_fit(self, size):
+        index = self._by_size.rank((size, -1))
+        if index >= len(self._by_size):
+            return None
+        return self._by_size.select(index)[1]
+
+    def _allocate(self, size):
+        size = _align(size)
+        if self.policy == self.FIRST_FIT:
+            address = self._first_fit(size)
+        else:
+            address = self._best_fit(size)
+        if address is None:
+            raise MemoryError('No free block of {} bytes'.format(size))
+        available = self._remove_free(address)
+        # Split off whatever isn't needed as a new free block.
+        if available > size:
+            self._add_free(address + size, available - size)
+        return address, size
+
+    def _release(self, address, size):
+        # Coalesce with the free blocks immediately after and before.
+        if address + size in self._by_start:
+            size += self._remove_free(address + size)
+        if address in self._by_end:
+            left = self._by_end[address]
+            size += self._remove_free(left)
+            address = left
+        self._add_free(address, size)
+
+    def free_blocks(self):
+        return list(self._by_start.values())
+
+
+class BuddyAllocator(Allocator):
+    """Binary buddy system: the heap is a power of two, and every block
+    is a power of two, aligned to its own size. Splitting a block gives two
+    "buddies", and a block's buddy is always at `address ^ size`, so freeing
+    can merge back up in O(log capacity) with no searching. The cost is
+    internal fragmentation from rounding every request up."""
+
+    name = 'buddy'
+
+    def __init__(self, capacity, min_block=ALIGNMENT):
+        # Round down so the whole heap is one top level block.
+        capacity = _next_power_of_two(capacity + 1) // 2 if \
+            capacity & (capacity - 1) else capacity
+        super(BuddyAllocator, self).__init__(capacity)
+        self.min_block = min_block
+        self.max_order = (capacity // min_block).bit_length() - 1
+        # free_lists[order] holds addresses of free blocks of
+        # min_block * 2^order bytes.
+        self.free_lists = [set() for _ in range(self.max_order + 1)]
+        self.free_lists[self.max_order].add(0)
+
+    def _order(self, size):
+        order, block = 0, self.min_block
+        while block < size:
+            block <<= 1
+            order += 1
+        return order
+
+    def _allocate(self, size):
+        order = self._order(size)
+        found = order
+        while found <= self.max_order and not self.free_lists[found]:
+            found += 1
+        if found > self.max_order:
+            raise MemoryError('No free block of {} bytes'.format(
+                self.min_block << order))
+        address = self.free_lists[found].pop()
+        # Split down, putting the upper halves back as free buddies.
+        while found > order:
+            found -= 1
+            self.free_lists[found].add(address + (self.min_block << found))
+        return address, self.min_block << order
+
+    def _release(self, address, size):
+        order = self._order(size)
+        while order < self.max_order:
+            buddy = address ^ (self.min_block << order)
+            if buddy not in self.free_lists[order]:
+                break
+            self.free_lists[order].remove(buddy)
+            address = min(address, buddy)
+            order += 1
+        self.free_lists[order].add(address)
+
+    def free_blocks(self):
+        return [self.min_block << order
+                for order, blocks in enumerate(self.free_lists)
+                for _ in blocks]
+
+
+class _Slab(object):
+
+    __slots__ = ('address', 'object_size', 'free_slots', 'used')
+
+    def __init__(self, address, object_size, slab_size):
+        self.address = address
+        self.object_size = object_size
+        self.free_slots = list(range(
+            address + slab_size - object_size, address - 1, -object_size))
+        self.used = 0
+
+
+class SlabAllocator(Allocator):
+    """Object caches on top of another allocator: small requests are
+    rounded to a size class and served from fixed size "slabs" (pages
+    carved into equal slots), so allocating and freeing is a list
+    push/pop and same-sized objects never fragment each other.
+    Larger requests go straight to the backing allocator."""
+
+    name = 'slab'
+
+    def __init__(self, capacity, slab_size=4096,
+                 size_classes=(16, 32, 64, 128, 256, 512, 1024)):
+        super(SlabAllocator, self).__init__(capacity)
+        self.backing = FreeListAllocator(capacity, FreeListAllocator.BEST_FIT)
+        # Share the same simulated memory.
+        self.memory = self.backing.memory
+        self.slab_size = slab_size
+        self.size_classes = sorted(size_classes)
+        # size class -> slabs with at least one free slot
+        self.partial = dict((size, []) for size in self.size_classes)
+        # object address -> slab
+        self._owners = {}
+
+    def _size_class(self, size):
+        for size_class in self.size_classes:
+            if size <= size_class:
+                return size_class
+        return None
+
+    def _allocate(self, size):
+        size_class = self._size_class(size)
+        if size_class is None:
+            address = self.backing.malloc(size)
+            return address, self.backing.allocated[address][0]
+        partial = self.partial[size_class]
+        if not partial:
+            partial.append(_Slab(self.backing.malloc(self.slab_size),
+                                 size_class, self.slab_size))
+        slab = partial[-1]
+        address = slab.free_slots.pop()
+        slab.used += 1
+        if not slab.free_slots:
+            partial.pop()
+        self._owners[address] = slab
+        return address, size_class
+
+    def _release(self, address, size):
+        slab = self._owners.pop(address, None)
+        if slab is None:
+            self.backing.free(address)
+            return
+        partial = self.partial[slab.object_size]
+        if not slab.free_slots:
+            partial.append(slab)
+        slab.free_slots.append(address)
+        slab.used -= 1
+        # Hand completely empty slabs back, but keep one around to
+        # avoid thrashing when a single object is allocated and freed.
+        if slab.used == 0 and len(partial) > 1:
+            partial.remove(slab)
+            self.backing.free(slab.address)
+
+    def malloc(self, size):
+        address = super(SlabAllocator, self).malloc(size)
+        self.peak_footprint = self.backing.peak_footprint
+        return address
+
+    def free_blocks(self):
+        return self.backing.free_blocks()
+
+
+def generate_trace(operations=20000, sizes=(16, 24, 40, 64, 100, 256, 1000,
+                                           4000), max_live=2000):
+    """Generate a random allocation trace of ('malloc', id, size) and
+    ('free', id) events, mixing sizes and lifetimes to provoke
+    fragmentation."""
+    trace, live, next_id = [], [], 0
+    for _ in range(operations):
+        if live and (len(live) >= max_live or rr(0, 100) < 45):
+            trace.append(('free', live.pop(rr(0, len(live)))))
+        else:
+            trace.append(('malloc', next_id, choice(sizes)))
+            live.append(next_id)
+            next_id += 1
+    return trace
+
+
+def replay(allocator, trace):
+    """Run a trace against an allocator, returning throughput and
+    fragmentation/footprint metrics."""
+    addresses = {}
+    failures = 0
+    peak_fragmentation = 0.0
+    start = time()
+    for count, event in enumerate(trace):
+        if event[0] == 'malloc':
+            try:
+                addresses[event[1]] = allocator.malloc(event[2])
+            except MemoryError:
+                failures += 1
+        elif event[1] in addresses:
+            allocator.free(addresses.pop(event[1]))
+        if count % 500 == 0:
+            peak_fragmentation = max(
+                peak_fragmentation, allocator.fragmentation())
+    took = time() - start
+    return {
+        'allocator': allocator.name,
+        'ops_per_sec': int(len(trace) / took) if took else 0,
+        'failures': failures,
+        'peak_footprint': allocator.peak_footprint,
+        'peak_in_use': allocator.peak_in_use,
+        'peak_fragmentation': round(peak_fragmentation, 3),
+    }
+
+
+def benchmark(capacity=4 * 1024 * 1024, operations=20000):
+    seed(1)
+    trace = generate_trace(operations)
+    return [replay(allocator, trace) for allocator in [
+        FreeListAllocator(capacity, FreeListAllocator.FIRST_FIT),
+        FreeListAllocator(capacity, FreeListAllocator.BEST_FIT),
+        BuddyAllocator(capacity),
+        SlabAllocator(capacity)]]
 
 
 if DEBUG:
     with Section('Free list - Memory Manager'):
-        manager = MemoryManager()
-        manager.malloc('itunes', 128000000)
-        manager.malloc('photoshop', 256000000)
-        manager.malloc('chrome', 64000000)
-        print(manager)
-        manager.free('photoshop')
-        manager.free('itunes')
+        manager = FreeListAllocator(1024)
+        itunes = manager.malloc(128)
+        photoshop = manager.malloc(256)
+        chrome = manager.malloc(64)
+        manager.view(chrome)[:6] = b'chrome'
+        assert manager.memory[chrome:chrome + 6] == b'chrome'
         print(manager)
+        manager.free(itunes)
+        print_simple('Free blocks after freeing itunes',
+                     sorted(manager.free_blocks()))
+        manager.free(photoshop)
+        print_simple('Coalesced after freeing photoshop',
+                     sorted(manager.free_blocks()))
+        assert sorted(manager.free_blocks()) == [384, 576]
+        manager.free(chrome)
+        assert manager.free_blocks() == [1024]
+
+        print_h2('Best fit vs first fit')
+        for policy in [FreeListAllocator.FIRST_FIT,
+                       FreeListAllocator.BEST_FIT]:
+            heap = FreeListAllocator(1024, policy)
+            blocks = [heap.malloc(size) for size in [256, 64, 128, 64]]
+            heap.free(blocks[0])
+            heap.free(blocks[2])
+            print_simple(policy, 'A 100 byte block goes to address {}'.format(
+                heap.malloc(100)), newline=False)
+
+        print_h2('Buddy allocator')
+        buddy = BuddyAllocator(1024)
+        first, second = buddy.malloc(100), buddy.malloc(100)
+        print_simple('Two 100 byte requests (128 byte blocks)',
+                     [first, second])
+        buddy.free(first)
+        buddy.free(second)
+        assert buddy.free_blocks() == [1024]
+
+    with Section('Free list - allocator trace replay'):
+        print_table(benchmark())
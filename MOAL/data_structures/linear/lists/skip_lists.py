@@ -2,127 +2,461 @@
 
 __author__ = """Chris Tabor (dxdstudio@gmail.com)"""
 
-# Based on code from
+# Originally based on code from
 # https://kunigami.wordpress.com/2012/09/25/skip-lists-in-python/
+# Span counts (for rank/select) follow the "indexable skiplist" idea, see:
+# http://code.activestate.com/recipes/576930/
+# and the zset implementation in Redis (t_zset.c).
 
 if __name__ == '__main__':
     from os import getcwd
     from os import sys
     sys.path.append(getcwd())
 
+from random import random
 from random import randrange as rr
+from threading import Condition
+from threading import Lock
+from threading import local
 from MOAL.helpers.text import gibberish
 from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
 
+DEBUG = True if __name__ == '__main__' else False
 
-class SkipNode:
+# 2^32 items is far more than will fit in memory, so 32 levels is plenty
+# for a promotion probability of 1/2.
+MAX_LEVEL = 32
 
-    def __init__(self, height=0, elem=None):
-        self.elem = elem
-        # This usually results in a default to
-        # zero when initializing the first node.
-        self.height = height
-        self.next = [None] * self.height
 
-    def view(self):
-        res = ''
-        for el in self.next:
-            res += '[{}] --> '.format(
-                el.elem['value'] if el is not None else el)
-        print(res)
+def _identity(item):
+    return item
 
 
-class SkipList:
+class SkipNode(object):
+    """A single tower in the skip list. `next[i]` is the successor at level i,
+    and `span[i]` is the number of level-0 hops that pointer skips over,
+    which is what makes rank/select possible in O(log n)."""
 
-    def __init__(self):
-        self.head = SkipNode()
-
-    def random_height(self):
-        return rr(1, 10)
-
-    def update_list(self, elem):
-        # Get a copy of the next list, but as empty NoneType values
-        updated = [None] * len(self.head.next)
-        # Copy the head into a new variable
-        x = self.head
-        # Reverse and go over the original list while
-        # there are actual elements, filling in the updatedd copy by swapping
-        # the nodes with each pass.
-        # for i, el in enumerate(reversed(self.head.next)):
-        for i in reversed(range(len(self.head.next))):
-            while x.next[i] is not None and \
-                    x.next[i].elem['value'] < elem['value']:
-                # Continue updating x to the next grater elements' index
-                x = x.next[i]
-            updated[i] = x
-        return updated
-
-    def view(self):
-        print('Viewing entire skip list:')
-        for node in self.head.next:
-            print('{} --> {}'.format(self.head.elem, node.view()))
-
-    def find(self, elem, updated=None):
-        """Finds an item in the list. Allows the optional `updated`
-        flag to be passed in, which represents an updated
-        copy to search from instead."""
-
-        # If updated is none, updated the list and retry.
-        if updated is None:
-            updated = self.update_list(elem)
-        # Only try if the list is > 0
-        # Return None if not found, otherwise return the first index
-        # of the next pointer.
-        if len(updated) > 0:
-            candidate = updated[0].next[0]
-            if candidate is not None and candidate.elem is elem:
-                return candidate
+    __slots__ = ('item', 'key', 'next', 'span')
+
+    def __init__(self, height, item=None, key=None):
+        self.item = item
+        self.key = key
+        self.next = [None] * height
+        self.span = [0] * height
+
+    def __repr__(self):
+        return 'SkipNode({!r}, height={})'.format(self.item, len(self.next))
+
+
+class _Finger(object):
+    """The search path (update vector) of the last lookup. Searches for keys
+    at or after the finger can start from here instead of the head, making
+    nearby/sequential lookups O(log d), where d is the distance moved."""
+
+    __slots__ = ('version', 'key', 'update', 'rank')
+
+    def __init__(self, version, key, update, rank):
+        self.version = version
+        self.key = key
+        self.update = update
+        self.rank = rank
+
+
+class SkipList(object):
+    """A sorted container of arbitrary items, ordered by `key(item)`.
+
+    Tower heights are geometric (each level is promoted with probability
+    `p`), giving expected O(log n) search, insert and delete.
+    Duplicate keys are allowed and keep their insertion order."""
+
+    def __init__(self, items=None, key=None, p=0.5, max_level=MAX_LEVEL):
+        if not 0 < p < 1:
+            raise ValueError('Promotion probability must be between 0 and 1')
+        self.keyfunc = key if key is not None else _identity
+        self.p = p
+        self.max_level = max_level
+        self.head = SkipNode(max_level)
+        # Number of levels currently in use.
+        self.level = 1
+        self._size = 0
+        # Bumped on every mutation, so stale fingers are never trusted.
+        self._version = 0
+        self._finger = None
+        if items is not None:
+            for item in items:
+                self.insert(item)
+
+    @classmethod
+    def from_sorted(cls, items, key=None, p=0.5, max_level=MAX_LEVEL):
+        """Build a skip list from already sorted input in O(n), by linking
+        each new tower onto the rightmost tower of every level it reaches,
+        rather than searching from the head for every item."""
+        skiplist = cls(key=key, p=p, max_level=max_level)
+        keyfunc = skiplist.keyfunc
+        head = skiplist.head
+        last = [head] * max_level
+        last_pos = [0] * max_level
+        pos, prev_key = 0, None
+        for item in items:
+            item_key = keyfunc(item)
+            if pos > 0 and item_key < prev_key:
+                raise ValueError('Input is not sorted at position {}'.format(
+                    pos))
+            pos += 1
+            height = skiplist.random_level()
+            node = SkipNode(height, item=item, key=item_key)
+            for i in range(height):
+                last[i].next[i] = node
+                last[i].span[i] = pos - last_pos[i]
+                last[i], last_pos[i] = node, pos
+            skiplist.level = max(skiplist.level, height)
+            prev_key = item_key
+        # Pointers to the end span the remaining items, same as `insert`.
+        for i in range(skiplist.level):
+            last[i].span[i] = pos - last_pos[i]
+        skiplist._size = pos
+        return skiplist
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        node = self.head.next[0]
+        while node is not None:
+            yield node.item
+            node = node.next[0]
+
+    def __contains__(self, item):
+        return self.find(self.keyfunc(item)) is not None
+
+    def __getitem__(self, index):
+        return self.select(index)
+
+    def __str__(self):
+        rows = []
+        for i in reversed(range(self.level)):
+            row, node = [], self.head.next[i]
+            while node is not None:
+                row.append(str(node.key))
+                node = node.next[i]
+            rows.append('L{:<2} {}'.format(i, ' -> '.join(row)))
+        return '\n'.join(rows)
+
+    def random_level(self):
+        """Geometric tower height: 1 with probability (1 - p),
+        2 with probability p(1 - p), and so on."""
+        level = 1
+        while level < self.max_level and random() < self.p:
+            level += 1
+        return level
+
+    def _get_finger(self):
+        return self._finger
+
+    def _set_finger(self, finger):
+        self._finger = finger
+
+    def _search(self, key, inclusive=False, use_finger=False):
+        """Return the update vector for `key` -- the last node on each
+        level whose key is < `key` (or <= `key` if `inclusive`) -- along with
+        the rank (number of items before and including that node)."""
+        before = (lambda k: k <= key) if inclusive else (
+            lambda k: k < key)
+        level = self.level
+        finger = self._get_finger() if use_finger else None
+        if finger is not None and (
+                finger.version != self._version or key < finger.key):
+            finger = None
+        if finger is None:
+            update = [self.head] * level
+            rank = [0] * level
+            top = level
+            node, traversed = self.head, 0
+        else:
+            update = list(finger.update)
+            rank = list(finger.rank)
+            # Climb up from the finger until the next node on that level
+            # is already past the key; everything above is still valid.
+            top = 0
+            while top < level:
+                nxt = update[top].next[top]
+                if nxt is None or not before(nxt.key):
+                    break
+                top += 1
+            if top == 0:
+                return update, rank
+            node, traversed = update[top - 1], rank[top - 1]
+        for i in reversed(range(top)):
+            # The finger may already be further along on lower levels.
+            if rank[i] > traversed:
+                node, traversed = update[i], rank[i]
+            nxt = node.next[i]
+            while nxt is not None and before(nxt.key):
+                traversed += node.span[i]
+                node, nxt = nxt, nxt.next[i]
+            update[i], rank[i] = node, traversed
+        if use_finger and not inclusive:
+            self._set_finger(_Finger(self._version, key, update, rank))
+        return update, rank
+
+    def insert(self, item):
+        """Insert `item` after any items with an equal key."""
+        key = self.keyfunc(item)
+        update, rank = self._search(key, inclusive=True)
+        height = self.random_level()
+        if height > self.level:
+            for i in range(self.level, height):
+                update.append(self.head)
+                rank.append(0)
+                self.head.span[i] = self._size
+            self.level = height
+        node = SkipNode(height, item=item, key=key)
+        for i in range(height):
+            prev = update[i]
+            node.next[i] = prev.next[i]
+            prev.next[i] = node
+            # The hops skipped by `prev` get split between `prev` and `node`.
+            node.span[i] = prev.span[i] - (rank[0] - rank[i])
+            prev.span[i] = (rank[0] - rank[i]) + 1
+        # Taller pointers now skip over one more item.
+        for i in range(height, self.level):
+            update[i].span[i] += 1
+        self._size += 1
+        self._version += 1
+        return node
+
+    def remove(self, item):
+        """Remove the first occurrence of `item`.
+        Raises ValueError if it is not present, like `list.remove`."""
+        key = self.keyfunc(item)
+        update, _ = self._search(key)
+        node = update[0].next[0]
+        # Step past items that share the key but aren't the one requested.
+        while node is not None and node.key == key and node.item != item:
+            for i in range(len(node.next)):
+                update[i] = node
+            node = node.next[0]
+        if node is None or node.key != key:
+            raise ValueError('{!r} not in skip list'.format(item))
+        for i in range(self.level):
+            if update[i].next[i] is node:
+                update[i].span[i] += node.span[i] - 1
+                update[i].next[i] = node.next[i]
+            else:
+                update[i].span[i] -= 1
+        # Drop any levels that are now empty.
+        while self.level > 1 and self.head.next[self.level - 1] is None:
+            self.head.span[self.level - 1] = 0
+            self.level -= 1
+        self._size -= 1
+        self._version += 1
+        return node.item
+
+    def discard(self, item):
+        """Remove `item` if present, without raising."""
+        try:
+            self.remove(item)
+        except ValueError:
+            pass
+
+    def find(self, key):
+        """Return the first item with the given key, or None."""
+        update, _ = self._search(key, use_finger=True)
+        node = update[0].next[0]
+        if node is not None and node.key == key:
+            return node.item
         return None
 
-    def remove(self, elem):
-        updated = self.update_list(elem)
-        x = self.find(elem, updated=updated)
-        # Remove only if it's not None -- since None represents
-        # an empty element (since by default all spaces are fill with None)
-        if x is not None:
-            for i, _ in enumerate(x.next):
-                # Nullify the matching pointer
-                updated[i].next[i] = x.next[i]
-                # Left unchanged for now, but cleanup can be done
-                if self.head.next[i] is None:
-                    continue
-
-    def _balance_length(self, node):
-        # Keep adding None elements until the the length of
-        # each list is equal and thus the lists are balanced.
-        while len(self.head.next) < len(node.next):
-            self.head.next.append(None)
-
-    def insert(self, elem):
-        # Create a new node with random height
-        node = SkipNode(height=self.random_height(), elem=elem)
-        print('Adding {} node to the list:'.format(elem))
-
-        # Balance length before inserting to avoid issues with indices.
-        self._balance_length(node)
-        updated = self.update_list(elem)
-        # Add the new element if it doesn't already exist.
-        if self.find(elem, updated=updated) is None:
-            for i, _ in enumerate(node.next):
-                node.next[i] = updated[i].next[i]
-                updated[i].next[i] = node
+    def rank(self, key):
+        """Number of items with a key strictly less than `key`."""
+        _, rank = self._search(key, use_finger=True)
+        return rank[0]
 
+    def select(self, index):
+        """Return the item at sorted position `index` (0-based) by
+        following span counts down the levels."""
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('skip list index out of range')
+        target = index + 1
+        node, traversed = self.head, 0
+        for i in reversed(range(self.level)):
+            while node.next[i] is not None and \
+                    traversed + node.span[i] <= target:
+                traversed += node.span[i]
+                node = node.next[i]
+            if traversed == target:
+                break
+        return node.item
 
-if __name__ == '__main__':
+    def range(self, lo=None, hi=None):
+        """Yield items with lo <= key < hi, in order. Either bound may be
+        None to leave that side open."""
+        if lo is None:
+            node = self.head.next[0]
+        else:
+            update, _ = self._search(lo, use_finger=True)
+            node = update[0].next[0]
+        while node is not None and (hi is None or node.key < hi):
+            yield node.item
+            node = node.next[0]
+
+
+class ReadWriteLock(object):
+    """Allows any number of concurrent readers, or a single writer.
+    Writers are given preference once waiting, so a steady stream
+    of readers can't starve them."""
+
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class ConcurrentSkipList(SkipList):
+    """A thread-safe skip list. Lookups only take a shared (read) lock, so
+    readers never block each other; mutations take the exclusive lock.
+    Fingers are kept per thread, so readers don't trample each other's
+    search paths either."""
+
+    def __init__(self, *args, **kwargs):
+        self._lock = ReadWriteLock()
+        self._local = local()
+        super(ConcurrentSkipList, self).__init__(*args, **kwargs)
+
+    def _get_finger(self):
+        return getattr(self._local, 'finger', None)
+
+    def _set_finger(self, finger):
+        self._local.finger = finger
+
+    def _read(self, method, *args):
+        self._lock.acquire_read()
+        try:
+            return method(self, *args)
+        finally:
+            self._lock.release_read()
+
+    def _write(self, method, *args):
+        self._lock.acquire_write()
+        try:
+            return method(self, *args)
+        finally:
+            self._lock.release_write()
+
+    def insert(self, item):
+        return self._write(SkipList.insert, item)
+
+    def remove(self, item):
+        return self._write(SkipList.remove, item)
+
+    def find(self, key):
+        return self._read(SkipList.find, key)
+
+    def rank(self, key):
+        return self._read(SkipList.rank, key)
+
+    def select(self, index):
+        return self._read(SkipList.select, index)
+
+    def range(self, lo=None, hi=None):
+        """Returns a list snapshot rather than a generator, so the read
+        lock is never held across a yield."""
+        return self._read(lambda self, lo, hi: list(
+            SkipList.range(self, lo, hi)), lo, hi)
+
+    def __iter__(self):
+        return iter(self.range())
+
+
+if DEBUG:
     with Section('Skip Lists'):
-        gibs = [{
-            'name': gibberish(), 'value': rr(10, 1000)
-        } for _ in range(10)]
-        sl = SkipList()
-        for gib in gibs:
-            sl.insert(elem=gib)
+        gibs = [{'name': gibberish(), 'value': rr(10, 1000)}
+                for _ in range(10)]
+        sl = SkipList(gibs, key=lambda gib: gib['value'])
+        print(sl)
+        values = sorted(gib['value'] for gib in gibs)
+        assert [gib['value'] for gib in sl] == values
 
         for gib in gibs:
-            sl.find(gib)
+            assert sl.find(gib['value'])['value'] == gib['value']
+
+        print_h2('Rank and select')
+        nums = SkipList(rr(0, 1000) for _ in range(500))
+        expected = sorted(nums)
+        for k in range(len(expected)):
+            assert nums.select(k) == expected[k]
+            assert nums.rank(expected[k]) == expected.index(expected[k])
+        print_simple('Median', nums[len(nums) // 2])
+
+        print_h2('Range iteration')
+        print_simple('100 <= n < 150', list(nums.range(100, 150)))
+        assert list(nums.range(100, 150)) == [
+            n for n in expected if 100 <= n < 150]
+
+        print_h2('Removal shrinks levels')
+        for n in expected:
+            nums.remove(n)
+        assert len(nums) == 0 and nums.level == 1
+
+        print_h2('Bulk construction from sorted input')
+        bulk = SkipList.from_sorted(range(10000))
+        assert list(bulk.range(5000, 5010)) == list(range(5000, 5010))
+        assert bulk.select(1234) == 1234 and bulk.rank(1234) == 1234
+        bulk.insert(1234)
+        assert bulk.select(1235) == 1234 and bulk.select(1236) == 1235
+        print_simple('Levels used for 10,000 items', bulk.level)
+
+    with Section('Skip Lists - concurrent readers'):
+        from threading import Thread
+        shared = ConcurrentSkipList.from_sorted(range(0, 2000, 2))
+        errors = []
+
+        def reader():
+            for n in range(0, 2000, 2):
+                if shared.find(n) != n:
+                    errors.append(n)
+
+        def writer():
+            for n in range(1, 2000, 2):
+                shared.insert(n)
 
-        sl.view()
+        threads = [Thread(target=reader) for _ in range(4)]
+        threads.append(Thread(target=writer))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+        assert list(shared) == list(range(2000))
+        print_simple('Items after concurrent inserts', len(shared))
@@ -12,14 +12,418 @@ from MOAL.helpers.display import print_h2
 from MOAL.helpers.display import print_simple
 from MOAL.helpers.text import gibberish2
 from datetime import datetime as dt
+from time import time
 
 DEBUG = True if __name__ == '__main__' else False
 
 
-class MutableAccessException:
+class MutableAccessException(Exception):
     pass
 
 
+class MeldConflict(Exception):
+    """Both sides of a meld changed the same key in different ways."""
+
+    def __init__(self, key):
+        super(MeldConflict, self).__init__(
+            'Conflicting changes to key {!r}'.format(key))
+        self.key = key
+
+
+# Hash array mapped trie (HAMT) internals. See Bagwell, "Ideal Hash Trees"
+# (2001). Each level consumes 5 bits of the key's hash, so a node has up to
+# 32 slots, but only the occupied ones are stored: a 32 bit bitmap says which
+# slots are in use, and popcount(bitmap below the slot) is the index into the
+# compact `entries` tuple. A slot holds either a leaf, as a (hash, key, value)
+# tuple, or a child node.
+#
+# Nodes are never modified. An update copies the nodes along the path from
+# the root to the changed slot -- O(log32 n) of them -- and shares every
+# other subtree with the previous version.
+
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+_HASH_BITS = 64
+_HASH_MASK = (1 << _HASH_BITS) - 1
+_MISSING = object()
+
+
+def _hash(key):
+    return hash(key) & _HASH_MASK
+
+
+def _bitpos(keyhash, shift):
+    return 1 << ((keyhash >> shift) & _MASK)
+
+
+def _popcount(num):
+    return bin(num).count('1')
+
+
+def _is_leaf(entry):
+    return isinstance(entry, tuple)
+
+
+def _entry_size(entry):
+    return 1 if _is_leaf(entry) else entry.size
+
+
+def _entry_items(entry):
+    if _is_leaf(entry):
+        yield entry
+    else:
+        for leaf in entry.leaves():
+            yield leaf
+
+
+def _pair_leaves(shift, first, second):
+    """Smallest subtree holding two leaves whose hashes agree so far."""
+    if shift >= _HASH_BITS:
+        return _CollisionNode(first[0], (first, second))
+    bit1, bit2 = _bitpos(first[0], shift), _bitpos(second[0], shift)
+    if bit1 == bit2:
+        return _BitmapNode(bit1, (_pair_leaves(
+            shift + _BITS, first, second),), 2)
+    entries = (first, second) if bit1 < bit2 else (second, first)
+    return _BitmapNode(bit1 | bit2, entries, 2)
+
+
+def _canonical(shift, bitmap, entries):
+    """Below the root, a node left with a single leaf collapses into
+    that leaf, so the shape only ever depends on which keys are present.
+    That keeps unchanged subtrees identical between versions."""
+    if not entries:
+        return None
+    if shift > 0 and len(entries) == 1 and _is_leaf(entries[0]):
+        return entries[0]
+    return _BitmapNode(bitmap, entries, sum(map(_entry_size, entries)))
+
+
+def _build(shift, leaves):
+    """Build a (canonical) subtree from scratch."""
+    node = _CollisionNode(leaves[0][0], ()) if shift >= _HASH_BITS else \
+        _EMPTY_NODE
+    for keyhash, key, value in leaves:
+        node, _ = node.assoc(shift, keyhash, key, value)
+    if shift >= _HASH_BITS:
+        return node.entries[0] if len(node.entries) == 1 else node
+    return _canonical(shift, node.bitmap, node.entries)
+
+
+class _BitmapNode(object):
+
+    __slots__ = ('bitmap', 'entries', 'size')
+
+    def __init__(self, bitmap, entries, size):
+        self.bitmap = bitmap
+        self.entries = entries
+        self.size = size
+
+    def leaves(self):
+        for entry in self.entries:
+            for leaf in _entry_items(entry):
+                yield leaf
+
+    def find(self, shift, keyhash, key, default):
+        node = self
+        while True:
+            if isinstance(node, _CollisionNode):
+                return node.find(shift, keyhash, key, default)
+            bit = _bitpos(keyhash, shift)
+            if not node.bitmap & bit:
+                return default
+            entry = node.entries[_popcount(node.bitmap & (bit - 1))]
+            if _is_leaf(entry):
+                return entry[2] if entry[1] == key else default
+            node, shift = entry, shift + _BITS
+
+    def assoc(self, shift, keyhash, key, value):
+        """Return (new node, whether a key was added)."""
+        bit = _bitpos(keyhash, shift)
+        idx = _popcount(self.bitmap & (bit - 1))
+        entries = self.entries
+        if not self.bitmap & bit:
+            return _BitmapNode(
+                self.bitmap | bit,
+                entries[:idx] + ((keyhash, key, value),) + entries[idx:],
+                self.size + 1), True
+        entry = entries[idx]
+        if _is_leaf(entry):
+            if entry[1] == key:
+                if entry[2] is value:
+                    return self, False
+                new, added = (keyhash, key, value), False
+            else:
+                new, added = _pair_leaves(
+                    shift + _BITS, entry, (keyhash, key, value)), True
+        else:
+            new, added = entry.assoc(shift + _BITS, keyhash, key, value)
+            if new is entry:
+                return self, False
+        return _BitmapNode(
+            self.bitmap, entries[:idx] + (new,) + entries[idx + 1:],
+            self.size + added), added
+
+    def without(self, shift, keyhash, key):
+        """Return the node with `key` removed (possibly collapsed to a
+        leaf, or None if empty), or the same node if `key` is absent."""
+        bit = _bitpos(keyhash, shift)
+        if not self.bitmap & bit:
+            return self
+        idx = _popcount(self.bitmap & (bit - 1))
+        entry = self.entries[idx]
+        if _is_leaf(entry):
+            if entry[1] != key:
+                return self
+            return _canonical(shift, self.bitmap ^ bit,
+                              self.entries[:idx] + self.entries[idx + 1:])
+        new = entry.without(shift + _BITS, keyhash, key)
+        if new is entry:
+            return self
+        if new is None:
+            return _canonical(shift, self.bitmap ^ bit,
+                              self.entries[:idx] + self.entries[idx + 1:])
+        return _canonical(shift, self.bitmap,
+                          self.entries[:idx] + (new,) + self.entries[idx + 1:])
+
+
+class _CollisionNode(object):
+    """Keys whose whole 64 bit hash is equal, kept in a flat tuple."""
+
+    __slots__ = ('keyhash', 'entries')
+
+    def __init__(self, keyhash, entries):
+        self.keyhash = keyhash
+        self.entries = entries
+
+    @property
+    def size(self):
+        return len(self.entries)
+
+    def leaves(self):
+        return iter(self.entries)
+
+    def find(self, shift, keyhash, key, default):
+        for leaf in self.entries:
+            if leaf[1] == key:
+                return leaf[2]
+        return default
+
+    def assoc(self, shift, keyhash, key, value):
+        for k, leaf in enumerate(self.entries):
+            if leaf[1] == key:
+                if leaf[2] is value:
+                    return self, False
+                return _CollisionNode(keyhash, self.entries[:k] + (
+                    (keyhash, key, value),) + self.entries[k + 1:]), False
+        return _CollisionNode(
+            keyhash, self.entries + ((keyhash, key, value),)), True
+
+    def without(self, shift, keyhash, key):
+        entries = tuple(leaf for leaf in self.entries if leaf[1] != key)
+        if len(entries) == len(self.entries):
+            return self
+        return entries[0] if len(entries) == 1 else _CollisionNode(
+            self.keyhash, entries)
+
+
+_EMPTY_NODE = _BitmapNode(0, (), 0)
+
+
+def _meld_values(key, base, ours, theirs, resolve):
+    if ours is theirs or ours == theirs:
+        return ours
+    if ours is base or ours == base:
+        return theirs
+    if theirs is base or theirs == base:
+        return ours
+    if resolve is None:
+        raise MeldConflict(key)
+    return resolve(key, None if base is _MISSING else base,
+                   None if ours is _MISSING else ours,
+                   None if theirs is _MISSING else theirs)
+
+
+def _meld_slow(shift, base, ours, theirs, resolve):
+    """Key by key three-way merge of three (small) differing subtrees."""
+    sides = []
+    for entry in (base, ours, theirs):
+        sides.append({} if entry is None else {
+            leaf[1]: leaf for leaf in _entry_items(entry)})
+    base_leaves, our_leaves, their_leaves = sides
+    merged = []
+    for key in set(our_leaves) | set(their_leaves) | set(base_leaves):
+        values = [side[key][2] if key in side else _MISSING
+                  for side in sides]
+        value = _meld_values(key, values[0], values[1], values[2], resolve)
+        if value is not _MISSING:
+            leaf = (our_leaves.get(key) or their_leaves.get(key) or
+                    base_leaves.get(key))
+            merged.append((leaf[0], key, value))
+    if not merged:
+        return None
+    return _build(shift, merged)
+
+
+def _meld_entry(shift, base, ours, theirs, resolve):
+    """Three-way merge of one subtree. Whole subtrees that only one side
+    touched are taken by reference, so only changed paths are visited."""
+    if ours is theirs:
+        return ours
+    if ours is base:
+        return theirs
+    if theirs is base:
+        return ours
+    nodes = [entry for entry in (base, ours, theirs) if entry is not None]
+    if shift < _HASH_BITS and ours is not None and theirs is not None and \
+            all(isinstance(entry, _BitmapNode) for entry in nodes):
+        base = base if base is not None else _EMPTY_NODE
+        bitmap = ours.bitmap | theirs.bitmap | base.bitmap
+        entries, result_bitmap, bit = [], 0, 1
+        while bit <= bitmap:
+            if bitmap & bit:
+                slots = []
+                for node in (base, ours, theirs):
+                    slots.append(node.entries[_popcount(
+                        node.bitmap & (bit - 1))]
+                        if node.bitmap & bit else None)
+                entry = _meld_entry(
+                    shift + _BITS, slots[0], slots[1], slots[2], resolve)
+                if entry is not None:
+                    entries.append(entry)
+                    result_bitmap |= bit
+            bit <<= 1
+        return _canonical(shift, result_bitmap, tuple(entries))
+    return _meld_slow(shift, base, ours, theirs, resolve)
+
+
+class PersistentMap(object):
+    """An immutable mapping backed by a hash array mapped trie.
+
+    Every "modification" (`set`, `delete`, `update`) returns a new map that
+    shares all untouched subtrees with the original, so keeping each
+    version around costs O(log n) new nodes per change instead of a full
+    copy. Since nothing is ever mutated, taking a snapshot is just keeping
+    a reference -- O(1)."""
+
+    __slots__ = ('_root',)
+
+    def __init__(self, items=None):
+        root = _EMPTY_NODE
+        if items is not None:
+            if hasattr(items, 'items'):
+                items = items.items()
+            for key, value in items:
+                root, _ = root.assoc(0, _hash(key), key, value)
+        self._root = root
+
+    @classmethod
+    def _from_root(cls, root):
+        instance = cls.__new__(cls)
+        instance._root = root if root is not None else _EMPTY_NODE
+        return instance
+
+    def __len__(self):
+        return self._root.size
+
+    def __iter__(self):
+        for leaf in self._root.leaves():
+            yield leaf[1]
+
+    def __contains__(self, key):
+        return self._root.find(0, _hash(key), key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key):
+        value = self._root.find(0, _hash(key), key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __eq__(self, other):
+        if not isinstance(other, PersistentMap):
+            return NotImplemented
+        if self._root is other._root:
+            return True
+        return len(self) == len(other) and all(
+            other.get(key, _MISSING) == value for key, value in self.items())
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __str__(self):
+        return '{{{}}}'.format(', '.join(
+            '{!r}: {!r}'.format(key, value) for key, value in self.items()))
+
+    __repr__ = __str__
+
+    def get(self, key, default=None):
+        return self._root.find(0, _hash(key), key, default)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [leaf[2] for leaf in self._root.leaves()]
+
+    def items(self):
+        return [(leaf[1], leaf[2]) for leaf in self._root.leaves()]
+
+    def set(self, key, value):
+        root, _ = self._root.assoc(0, _hash(key), key, value)
+        return self if root is self._root else self._from_root(root)
+
+    def delete(self, key):
+        root = self._root.without(0, _hash(key), key)
+        if root is self._root:
+            raise KeyError(key)
+        return self._from_root(root)
+
+    def update(self, items=(), removed=()):
+        """Apply many changes at once, returning the new map."""
+        root = self._root
+        if hasattr(items, 'items'):
+            items = items.items()
+        for key, value in items:
+            root, _ = root.assoc(0, _hash(key), key, value)
+        for key in removed:
+            root = root.without(0, _hash(key), key)
+        return self._from_root(root)
+
+    def meld(self, other, base=None, resolve=None):
+        """Three-way merge of this map and `other`, relative to their common
+        ancestor `base`. Subtrees that are shared (identical) between the
+        versions are skipped entirely, so the cost is proportional to what
+        actually changed. Keys changed differently on both sides are handed
+        to `resolve(key, base, ours, theirs)`, or raise MeldConflict."""
+        base_root = base._root if base is not None else _EMPTY_NODE
+        root = _meld_entry(0, base_root, self._root, other._root, resolve)
+        return self._from_root(root)
+
+    def node_count(self):
+        """Number of trie nodes reachable from this version."""
+        return _count_nodes(self._root, set())
+
+
+def _walk(node):
+    yield node
+    if isinstance(node, _BitmapNode):
+        for entry in node.entries:
+            if not _is_leaf(entry):
+                for child in _walk(entry):
+                    yield child
+
+
+def _count_nodes(node, seen):
+    if id(node) in seen:
+        return 0
+    seen.add(id(node))
+    if isinstance(node, _CollisionNode):
+        return 1
+    return 1 + sum(_count_nodes(entry, seen)
+                   for entry in node.entries if not _is_leaf(entry))
+
+
 class PersistentDataStructure(object):
     pass
 
@@ -36,12 +440,15 @@ class PartiallyPersistentNode(PersistentDataStructure):
     A data structure is partially persistent if all versions can be accessed
     but only the newest version can be modified." """
 
+    # The only attributes that may ever be assigned.
+    _attributes = ('versions', 'data')
+
     def __init__(self):
         self.versions = {}
         self.data = None
 
     def __str__(self):
-        print('All data: {}').format(self.versions)
+        print('All data: {}'.format(self.versions))
         print('Current data: {}'.format(self.data))
         return ''
 
@@ -51,7 +458,7 @@ class PartiallyPersistentNode(PersistentDataStructure):
         raise MutableAccessException
 
     def __setattr__(self, name, value):
-        if name not in ['versions', 'data']:
+        if name not in self._attributes:
             raise MutableAccessException
         super(PartiallyPersistentNode, self).__setattr__(name, value)
 
@@ -140,7 +547,113 @@ class ConfluentlyPersistentFatNode(ConfluentlyPersistentNode):
 
 
 class ConfluentlyPersistentPathCopyingNode(ConfluentlyPersistentNode):
-    """TODO"""
+    """From Wikipedia:
+
+    "With the path copying method a copy of all nodes is made on the path to
+    any node which is about to be modified. These changes must then be
+    cascaded back through the data structure: all nodes that pointed to the
+    old node must be modified to point to the new node instead."
+
+    Each version is a `PersistentMap`, derived from its parent version, so
+    only the paths to changed keys are copied and everything else is shared.
+    Version keys act as handles, and parents are remembered so that `meld`
+    can do a proper three-way merge against the common ancestor."""
+
+    _attributes = ('versions', 'data', 'parents')
+
+    def __init__(self):
+        super(ConfluentlyPersistentPathCopyingNode, self).__init__()
+        self.parents = {}
+
+    def __setitem__(self, key, data):
+        """Store `data` (any mapping) as version `key`. It's diffed against
+        the current version, so unchanged keys keep sharing structure."""
+        parent = self.data
+        current = self.versions[parent] if parent is not None else \
+            PersistentMap()
+        if isinstance(data, PersistentMap):
+            version = data
+        else:
+            version = current.update(
+                ((k, v) for k, v in data.items()
+                 if current.get(k, _MISSING) != v),
+                removed=[k for k in current if k not in data])
+        self._add_version(
+            key, version, (parent,) if parent is not None else ())
+
+    def __getitem__(self, key):
+        return self.versions[key]
+
+    def _add_version(self, key, version, parents):
+        self.versions[key] = version
+        self.parents[key] = parents
+        self.data = key
+
+    def get_current(self):
+        return self.versions[self.data]
+
+    def snapshot(self, key=None):
+        """O(1): versions are immutable, so a reference is a snapshot."""
+        return self.versions[self.data if key is None else key]
+
+    def derive(self, key, changes=(), removed=(), parent=None):
+        """Create version `key` from `parent` (default: current) by applying
+        only `changes` and `removed`, rather than passing the full data."""
+        parent = self.data if parent is None else parent
+        base = self.versions[parent] if parent is not None else \
+            PersistentMap()
+        self._add_version(key, base.update(changes, removed),
+                          (parent,) if parent is not None else ())
+        return self.versions[key]
+
+    def _ancestors(self, key):
+        seen, stack = set(), [key]
+        while stack:
+            current = stack.pop()
+            if current not in seen:
+                seen.add(current)
+                stack.extend(self.parents.get(current, ()))
+        return seen
+
+    def common_ancestor(self, first, second):
+        """Nearest version both `first` and `second` descend from."""
+        shared = self._ancestors(first) & self._ancestors(second)
+        queue = [first]
+        while queue:
+            current = queue.pop(0)
+            if current in shared:
+                return current
+            queue.extend(self.parents.get(current, ()))
+        return None
+
+    def meld(self, key, versions=(), resolve=None):
+        """Three-way meld `versions` together under the new version `key`."""
+        if not versions:
+            raise ValueError('Need at least one version to meld')
+        merged_key = versions[0]
+        merged = self.versions[merged_key]
+        intermediates = []
+        try:
+            for version in versions[1:]:
+                ancestor = self.common_ancestor(merged_key, version)
+                base = self.versions[ancestor] if ancestor is not None \
+                    else None
+                merged = merged.meld(
+                    self.versions[version], base=base, resolve=resolve)
+                # Record the partial result, so the next meld can find
+                # common ancestors through it.
+                partial = (key, version)
+                self.versions[partial] = merged
+                self.parents[partial] = (merged_key, version)
+                intermediates.append(partial)
+                merged_key = partial
+        finally:
+            # Also on a MeldConflict part way through.
+            for partial in intermediates:
+                del self.versions[partial]
+                del self.parents[partial]
+        self._add_version(key, merged, tuple(versions))
+        return merged
 
 
 class ConfluentlyPersistentPathCopyingFatNode(
@@ -148,6 +661,44 @@ class ConfluentlyPersistentPathCopyingFatNode(
     """TODO"""
 
 
+def benchmark_versions(size=10000, versions=200):
+    """Memory per version when every version changes a single key of a
+    `size` key map: full dict copies vs. path copying."""
+    import tracemalloc
+    initial = {'key{}'.format(k): k for k in range(size)}
+    results = {}
+
+    tracemalloc.start()
+    full = FullyPersistentNode()
+    full[0] = dict(initial)
+    before = tracemalloc.get_traced_memory()[0]
+    start = time()
+    for version in range(1, versions + 1):
+        data = dict(full[version - 1]['data'])
+        data['key{}'.format(version % size)] = -version
+        full[version] = data
+    results['FullyPersistentNode'] = {
+        'time': time() - start,
+        'bytes_per_version': (
+            tracemalloc.get_traced_memory()[0] - before) // versions}
+    tracemalloc.stop()
+    del full
+
+    tracemalloc.start()
+    shared = ConfluentlyPersistentPathCopyingNode()
+    shared[0] = initial
+    before = tracemalloc.get_traced_memory()[0]
+    start = time()
+    for version in range(1, versions + 1):
+        shared.derive(version, {'key{}'.format(version % size): -version})
+    results['ConfluentlyPersistentPathCopyingNode'] = {
+        'time': time() - start,
+        'bytes_per_version': (
+            tracemalloc.get_traced_memory()[0] - before) // versions}
+    tracemalloc.stop()
+    return results
+
+
 if DEBUG:
     with Section('Persistent data structures'):
 
@@ -209,3 +760,47 @@ if DEBUG:
         assert ref[0]['data']['_version'] == 1
         assert ref[1]['data']['_version'] == 2
         assert ref[2]['data']['_version'] == 3
+
+    with Section('Persistent data structures - path copying (HAMT)'):
+        empty = PersistentMap()
+        first = empty.set('foo', 1).set('bar', 2)
+        second = first.set('foo', 10)
+        assert len(empty) == 0 and first['foo'] == 1 and second['foo'] == 10
+        print_simple('Versions', [empty, first, second])
+
+        big = PersistentMap((k, k * k) for k in range(10000))
+        changed = big.set(5000, -1)
+        print_simple('Nodes in a 10,000 key map', big.node_count())
+        print_simple('New nodes after changing one key', _count_nodes(
+            changed._root, set(id(node) for node in _walk(big._root))))
+        assert big[5000] == 25000000 and changed[5000] == -1
+        without = changed.delete(5000)
+        assert 5000 not in without and len(without) == 9999
+        assert without.set(5000, 25000000) == big
+
+        print_h2('Version handles and three-way meld')
+        pcnode = ConfluentlyPersistentPathCopyingNode()
+        pcnode['base'] = {'name': 'moal', 'stars': 1, 'forks': 0}
+        pcnode.derive('docs', {'docs': 'sphinx'}, parent='base')
+        pcnode.derive('stars', {'stars': 2}, removed=['forks'], parent='base')
+        merged = pcnode.meld('merged', versions=['docs', 'stars'])
+        print_simple('Melded version', merged)
+        assert dict(merged.items()) == {
+            'name': 'moal', 'stars': 2, 'docs': 'sphinx'}
+        assert pcnode.snapshot('base')['stars'] == 1
+
+        pcnode.derive('left', {'stars': 3}, parent='base')
+        pcnode.derive('right', {'stars': 4}, parent='base')
+        try:
+            pcnode.meld('conflict', versions=['left', 'right'])
+        except MeldConflict as exc:
+            print('- Detected conflict: {}'.format(exc))
+        resolved = pcnode.meld('resolved', versions=['left', 'right'],
+                               resolve=lambda key, base, ours, theirs: max(
+                                   ours, theirs))
+        assert resolved['stars'] == 4
+
+        print_h2('Memory per version')
+        for name, res in sorted(benchmark_versions().items()):
+            print_simple(name, '{:,} bytes/version ({:.3f}s)'.format(
+                res['bytes_per_version'], res['time']), newline=False)
@@ -7,7 +7,11 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
+from itertools import count
+from operator import add
+from random import random
 from MOAL.data_structures import persistent
+from MOAL.data_structures.linear.lists.skip_lists import SkipList
 from MOAL.helpers.display import Section
 from MOAL.helpers.display import print_h2
 from MOAL.helpers.display import print_simple
@@ -29,7 +33,7 @@ class RetroactiveNode(persistent.FullyPersistentNode):
         """Handle updating individual node values - throws in gibberish
         for each type, just for debugging/visualizing."""
         if isinstance(nodeval, dict):
-            for key, val in nodeval.iteritems():
+            for key, val in nodeval.items():
                 nodeval[key] = '_{}'.format(val)
         elif isinstance(nodeval, list):
             for k, val in enumerate(nodeval):
@@ -87,6 +91,416 @@ class FullyRetroactiveNode(
             print('- Retroactively updating item')
             version = self._handlenode(version['data'])
 
+
+class _TimelineNode(object):
+    """One operation on the timeline. `priority` is the treap heap key;
+    the remaining fields are filled in by each structure's `_pull`."""
+
+    __slots__ = ('key', 'op', 'value', 'priority', 'left', 'right',
+                 'weight', 'total', 'min_prefix', 'max_dead', 'min_live',
+                 'live')
+
+    def __init__(self, key, op, value):
+        self.key = key
+        self.op = op
+        self.value = value
+        self.priority = random()
+        self.left = None
+        self.right = None
+        self.live = False
+        self.weight = 0
+
+
+class Timeline(object):
+    """Operations ordered by time, in a treap (a randomized balanced binary
+    search tree), where every node also carries an aggregate of its
+    subtree. Changing an operation in the past only touches the O(log n)
+    nodes on its path, and "as of time t" answers come from combining
+    the aggregates along one root-to-leaf path -- nothing is replayed.
+
+    Ties in time are broken by arrival order, so each key is (time, seq)."""
+
+    def __init__(self):
+        self.root = None
+        self._seq = count()
+        # seq -> node, so operations can be referred to by handle.
+        self._ops = {}
+
+    def __len__(self):
+        return len(self._ops)
+
+    def __iter__(self):
+        """Yield (time, op, value) for every operation, in time order."""
+        stack, node = [], self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.key[0], node.op, node.value
+            node = node.right
+
+    def _pull(self, node):
+        """Recompute `node`'s aggregates from its children."""
+        raise NotImplementedError
+
+    def _split(self, node, key):
+        """Split into (keys < key, keys >= key)."""
+        if node is None:
+            return None, None
+        if node.key < key:
+            node.right, right = self._split(node.right, key)
+            self._pull(node)
+            return node, right
+        left, node.left = self._split(node.left, key)
+        self._pull(node)
+        return left, node
+
+    def _merge(self, left, right):
+        """Join two treaps where every key in `left` < every key in `right`."""
+        if left is None:
+            return right
+        if right is None:
+            return left
+        if left.priority > right.priority:
+            left.right = self._merge(left.right, right)
+            self._pull(left)
+            return left
+        right.left = self._merge(left, right.left)
+        self._pull(right)
+        return right
+
+    def _add(self, time, op, value):
+        node = _TimelineNode((time, next(self._seq)), op, value)
+        self._ops[node.key[1]] = node
+        return node
+
+    def _insert_node(self, node):
+        left, right = self._split(self.root, node.key)
+        self.root = self._merge(self._merge(left, node), right)
+
+    def _remove_node(self, node):
+        left, rest = self._split(self.root, node.key)
+        _, right = self._split(rest, _after(node.key))
+        del self._ops[node.key[1]]
+        self.root = self._merge(left, right)
+
+    def _modify(self, node, func):
+        """Change a node in place and re-aggregate its ancestors."""
+        left, rest = self._split(self.root, node.key)
+        node, right = self._split(rest, _after(node.key))
+        func(node)
+        node.left = node.right = None
+        self._pull(node)
+        self.root = self._merge(self._merge(left, node), right)
+
+    def _node(self, handle):
+        try:
+            return self._ops[handle[1]]
+        except (KeyError, TypeError, IndexError):
+            raise KeyError('Unknown operation {!r}'.format(handle))
+
+
+def _after(key):
+    """The smallest possible key that sorts after `key`."""
+    return key[0], key[1] + 1
+
+
+class RetroactiveAggregate(Timeline):
+    """A fully retroactive aggregate: values are added at points in time,
+    operations can be inserted or removed anywhere in the past, and
+    `query(t)` gives the aggregate of everything up to and including t.
+
+    `combine` must be associative (sum, max, min, products, tuples of
+    those...); it need not be commutative, since order is kept."""
+
+    def __init__(self, combine=add, identity=0):
+        super(RetroactiveAggregate, self).__init__()
+        self.combine = combine
+        self.identity = identity
+
+    def _pull(self, node):
+        total = node.value
+        if node.left is not None:
+            total = self.combine(node.left.total, total)
+        if node.right is not None:
+            total = self.combine(total, node.right.total)
+        node.total = total
+
+    def insert(self, time, value):
+        """Retroactively apply `value` at `time`. Returns a handle."""
+        node = self._add(time, 'update', value)
+        self._pull(node)
+        self._insert_node(node)
+        return node.key
+
+    def delete(self, handle):
+        """Retroactively remove the operation identified by `handle`."""
+        self._remove_node(self._node(handle))
+
+    def update(self, handle, value):
+        """Retroactively change the value applied by an operation."""
+        def change(node):
+            node.value = value
+        self._modify(self._node(handle), change)
+
+    def query(self, time=None):
+        """Aggregate of all values applied at or before `time`
+        (or of everything, if no time is given)."""
+        if time is None:
+            return self.root.total if self.root is not None \
+                else self.identity
+        result, node = self.identity, self.root
+        while node is not None:
+            if node.key[0] <= time:
+                if node.left is not None:
+                    result = self.combine(result, node.left.total)
+                result = self.combine(result, node.value)
+                node = node.right
+            else:
+                node = node.left
+        return result
+
+    def query_range(self, start, end):
+        """Aggregate of values applied at times in [start, end]."""
+        left, rest = self._split(self.root, (start, -1))
+        middle, right = self._split(rest, (end, float('inf')))
+        result = middle.total if middle is not None else self.identity
+        self.root = self._merge(self._merge(left, middle), right)
+        return result
+
+
+INSERT = 'insert'
+DELETE_MIN = 'delete_min'
+
+
+def _max_item(*items):
+    items = [item for item in items if item is not None]
+    return max(items) if items else None
+
+
+def _min_item(*items):
+    items = [item for item in items if item is not None]
+    return min(items) if items else None
+
+
+class PartiallyRetroactivePriorityQueue(Timeline):
+    """A min priority queue where `insert` and `delete_min` operations can
+    be added to (or removed from) any point in the past, and the present
+    state is updated in O(log n), without replaying the history.
+
+    Follows Demaine, Iacono & Langerman, "Retroactive Data Structures",
+    section 5. The key idea is a "bridge": a time t where every element in
+    the queue at t is still in the queue now. A change in the past can only
+    ripple forward until the next bridge, and what it ripples into is
+    determined by a single max or min over the elements in between:
+
+    - inserting `insert(k)` at t adds max(k, largest element deleted after
+      the last bridge before t) to the present queue.
+    - inserting `delete_min` at t removes the smallest present element that
+      was inserted before the first bridge after t.
+    - removing an operation is handled as the mirror image of those.
+
+    Bridges are found by giving each operation a weight -- +1 for inserts
+    of elements that are gone now, 0 for inserts of present elements, -1
+    for delete_mins -- so the prefix sum at t counts elements present at t
+    but gone now, and bridges are exactly where it is zero. Each treap node
+    keeps its subtree's weight sum and minimum prefix sum (to find bridges),
+    plus the largest deleted and smallest present element it contains."""
+
+    def __init__(self):
+        super(PartiallyRetroactivePriorityQueue, self).__init__()
+        # The queue as it stands now, as (key, seq) so duplicates are fine.
+        self.present = SkipList()
+
+    def __len__(self):
+        return len(self.present)
+
+    def __iter__(self):
+        for key, _ in self.present:
+            yield key
+
+    def _pull(self, node):
+        left, right = node.left, node.right
+        left_total = left.total if left is not None else 0
+        here = left_total + node.weight
+        node.total = here + (right.total if right is not None else 0)
+        candidates = [here]
+        if left is not None:
+            candidates.append(left.min_prefix)
+        if right is not None:
+            candidates.append(here + right.min_prefix)
+        node.min_prefix = min(candidates)
+        item = (node.value, node.key[1]) if node.op == INSERT else None
+        node.max_dead = _max_item(
+            None if node.live else item,
+            left.max_dead if left is not None else None,
+            right.max_dead if right is not None else None)
+        node.min_live = _min_item(
+            item if node.live else None,
+            left.min_live if left is not None else None,
+            right.min_live if right is not None else None)
+
+    def _set_live(self, node, live):
+        node.live = live
+        node.weight = 0 if live else 1
+
+    def _last_bridge(self, node, offset=0):
+        """Key of the last operation in `node` after which the prefix sum
+        is zero, or None if that's only true before all of them."""
+        while node is not None:
+            left, right = node.left, node.right
+            here = offset + (left.total if left is not None else 0) + \
+                node.weight
+            if right is not None and here + right.min_prefix == 0:
+                node, offset = right, here
+            elif here == 0:
+                return node.key
+            elif left is not None and offset + left.min_prefix == 0:
+                node = left
+            else:
+                return None
+        return None
+
+    def _first_bridge(self, node, offset):
+        """Key of the first operation in `node` after which the prefix sum
+        is zero. The present is always a bridge, so None means "now"."""
+        while node is not None:
+            left, right = node.left, node.right
+            here = offset + (left.total if left is not None else 0) + \
+                node.weight
+            if left is not None and offset + left.min_prefix == 0:
+                node = left
+            elif here == 0:
+                return node.key
+            elif right is not None and here + right.min_prefix == 0:
+                node, offset = right, here
+            else:
+                return None
+        return None
+
+    def _largest_deleted_after_bridge(self, key):
+        """Largest deleted element inserted after the last bridge before
+        `key`; removing operations before `key` can only bring back those."""
+        before, after = self._split(self.root, key)
+        bridge = self._last_bridge(before)
+        if bridge is None:
+            found = _max_item(before.max_dead if before else None,
+                              after.max_dead if after else None)
+        else:
+            head, tail = self._split(before, _after(bridge))
+            found = _max_item(tail.max_dead if tail else None,
+                              after.max_dead if after else None)
+            before = self._merge(head, tail)
+        self.root = self._merge(before, after)
+        return found
+
+    def _smallest_present_before_bridge(self, key):
+        """Smallest present element inserted before the first bridge at or
+        after `key`; a delete_min at `key` can only ever reach those."""
+        before, after = self._split(self.root, key)
+        offset = before.total if before is not None else 0
+        if offset == 0:
+            # `key` itself is a bridge.
+            found = before.min_live if before is not None else None
+        else:
+            bridge = self._first_bridge(after, offset)
+            if bridge is None:
+                found = _min_item(before.min_live if before else None,
+                                  after.min_live if after else None)
+            else:
+                head, tail = self._split(after, _after(bridge))
+                found = _min_item(before.min_live if before else None,
+                                  head.min_live if head else None)
+                after = self._merge(head, tail)
+        self.root = self._merge(before, after)
+        return found
+
+    def _bridge_after(self, key):
+        """Key of the first bridge after `key`: for a deleted element's
+        insert, the delete_min that took the queue back to empty."""
+        before, after = self._split(self.root, _after(key))
+        bridge = self._first_bridge(
+            after, before.total if before is not None else 0)
+        self.root = self._merge(before, after)
+        return bridge
+
+    def _revive(self, item):
+        """Bring a deleted element back into the present queue."""
+        self._modify(self._ops[item[1]], lambda node: self._set_live(
+            node, True))
+        self.present.insert(item)
+
+    def _kill(self, item, time):
+        """Remove a present element from the present queue."""
+        if item is None:
+            raise IndexError('delete_min at {!r} would run on an empty '
+                             'queue'.format(time))
+        self._modify(self._ops[item[1]], lambda node: self._set_live(
+            node, False))
+        self.present.remove(item)
+
+    def insert(self, time, key):
+        """Retroactively insert `key` at `time`. Returns a handle."""
+        node = self._add(time, INSERT, key)
+        item = (key, node.key[1])
+        deleted = self._largest_deleted_after_bridge(node.key)
+        if deleted is None or item > deleted:
+            self._set_live(node, True)
+            self.present.insert(item)
+        else:
+            # The new key takes the place of `deleted` in some later
+            # delete_min, so `deleted` survives to the present instead.
+            self._set_live(node, False)
+            self._revive(deleted)
+        self._pull(node)
+        self._insert_node(node)
+        return node.key
+
+    def delete_min(self, time):
+        """Retroactively run a delete_min at `time`. Returns a handle."""
+        node = self._add(time, DELETE_MIN, None)
+        try:
+            self._kill(self._smallest_present_before_bridge(node.key), time)
+        except IndexError:
+            del self._ops[node.key[1]]
+            raise
+        node.weight = -1
+        self._pull(node)
+        self._insert_node(node)
+        return node.key
+
+    def delete(self, handle):
+        """Retroactively remove the operation identified by `handle`."""
+        node = self._node(handle)
+        if node.op == DELETE_MIN:
+            self._remove_node(node)
+            # Whatever it deleted (or what that in turn displaced) is back.
+            self._revive(self._largest_deleted_after_bridge(node.key))
+        elif node.live:
+            self._remove_node(node)
+            self.present.remove((node.value, node.key[1]))
+        else:
+            # The delete_min that removed it now removes something else.
+            # There's no bridge between its insert and that delete_min
+            # (it was in the queue then, and isn't now), so search from
+            # just after the insert, before taking it out.
+            victim = self._smallest_present_before_bridge(_after(node.key))
+            if victim is None:
+                # Check before changing anything, as `delete_min` does.
+                time = self._bridge_after(node.key)[0]
+                raise IndexError('delete_min at {!r} would run on an empty '
+                                 'queue'.format(time))
+            self._remove_node(node)
+            self._kill(victim, node.key[0])
+
+    def find_min(self):
+        """Smallest element in the queue now."""
+        if not len(self.present):
+            raise IndexError('find_min on an empty queue')
+        return self.present.select(0)[0]
+
+
 if DEBUG:
     with Section('Retroactive data structures'):
         print_h2('Partially retroactive node')
@@ -97,7 +511,7 @@ if DEBUG:
         # Do some updates to test.
         for x in range(4):
             partial['foo'] = {
-                '{}{}'.format(x, k): v for k, v in _example.iteritems()}
+                '{}{}'.format(x, k): v for k, v in _example.items()}
         # Test plain values
         partial['foo'] = 133332
         print_simple('Partially retroactive data:', partial.versions)
@@ -115,3 +529,44 @@ if DEBUG:
         full['name'] = {'first': 'Christobot', 'last': 'Taborium'}
         full['name'] = {'first': 'Christobonicus', 'last': 'Taboriot'}
         print_simple('Fully retroactive data:', full.versions)
+
+    with Section('Retroactive data structures - timeline based'):
+        print_h2('Fully retroactive sum')
+        balance = RetroactiveAggregate()
+        balance.insert(1, 100)
+        withdrawal = balance.insert(5, -30)
+        balance.insert(9, 45)
+        assert balance.query(4) == 100 and balance.query() == 115
+        # A late-arriving deposit from day 3, and a withdrawal
+        # that turns out never to have happened.
+        balance.insert(3, 20)
+        balance.delete(withdrawal)
+        print_simple('Balance as of day 6', balance.query(6))
+        assert balance.query(6) == 120 and balance.query() == 165
+        assert balance.query_range(3, 9) == 65
+
+        print_h2('Retroactive max (any associative operation works)')
+        peak = RetroactiveAggregate(combine=max, identity=float('-inf'))
+        for day, reading in enumerate([3, 9, 4, 1]):
+            peak.insert(day, reading)
+        assert peak.query(0) == 3 and peak.query() == 9
+
+        print_h2('Partially retroactive priority queue')
+        pq = PartiallyRetroactivePriorityQueue()
+        pq.insert(1, 5)
+        pq.insert(2, 3)
+        first_pop = pq.delete_min(3)
+        pq.insert(4, 8)
+        print_simple('Now', list(pq))
+        assert list(pq) == [5, 8]
+        # A 1 actually arrived before the pop; the pop took it instead.
+        pq.insert(2.5, 1)
+        print_simple('After inserting 1 at t=2.5', list(pq))
+        assert list(pq) == [3, 5, 8]
+        # The pop never happened.
+        pq.delete(first_pop)
+        assert list(pq) == [1, 3, 5, 8] and pq.find_min() == 1
+        try:
+            pq.delete_min(0.5)
+        except IndexError:
+            print('- Prevented a delete_min on an empty queue at t=0.5')
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+__author__ = """Chris Tabor (dxdstudio@gmail.com)"""
+
+if __name__ == '__main__':
+    from os import getcwd
+    from os import sys
+    sys.path.append(getcwd())
+
+from heapq import heappush
+from heapq import heappushpop
+from random import randrange
+from statistics import median
+from time import perf_counter
+from MOAL.algorithms.geometry.manhattan_distance import rand_coords
+from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
+
+DEBUG = True if __name__ == '__main__' else False
+
+# Points in each leaf bucket; below this a linear scan beats more splits.
+LEAF_SIZE = 16
+
+
+def l1(p1, p2):
+    return sum(abs(a - b) for a, b in zip(p1, p2))
+
+
+def as_point(point):
+    """Accept the {'x': .., 'y': ..} dicts from `rand_coords` as well as
+    plain sequences."""
+    if isinstance(point, dict):
+        return (point['x'], point['y'])
+    return tuple(point)
+
+
+class _KDNode(object):
+
+    __slots__ = ('axis', 'split', 'left', 'right', 'bucket')
+
+    def __init__(self, axis=None, split=None, left=None, right=None,
+                 bucket=None):
+        self.axis = axis
+        self.split = split
+        self.left = left
+        self.right = right
+        # Indexes of the points, for leaves only.
+        self.bucket = bucket
+
+
+class KDTree(object):
+    """A k-d tree for nearest neighbour search under the Manhattan (L1)
+    distance: https://en.wikipedia.org/wiki/K-d_tree
+
+    The tree is bulk built by splitting on the median of the widest axis,
+    so it's balanced, with small buckets of points at the leaves. Searches
+    go down the near side first, and only cross a split if the box on the
+    other side could still hold something close enough. The distance to
+    that box is kept incrementally, one axis offset at a time (Arya and
+    Mount), which for L1 is just the sum of the offsets."""
+
+    def __init__(self, points, leaf_size=LEAF_SIZE):
+        self.points = [as_point(point) for point in points]
+        self.dims = len(self.points[0]) if self.points else 0
+        self.leaf_size = leaf_size
+        self.root = self._build(list(range(len(self.points)))) \
+            if self.points else None
+
+    def __len__(self):
+        return len(self.points)
+
+    def _build(self, indexes):
+        if len(indexes) <= self.leaf_size:
+            return _KDNode(bucket=indexes)
+        points = self.points
+        spreads = [max(points[i][axis] for i in indexes) -
+                   min(points[i][axis] for i in indexes)
+                   for axis in range(self.dims)]
+        axis = spreads.index(max(spreads))
+        if spreads[axis] == 0:
+            # All the same point; no split can separate them.
+            return _KDNode(bucket=indexes)
+        indexes.sort(key=lambda i: points[i][axis])
+        mid = len(indexes) // 2
+        return _KDNode(axis=axis, split=points[indexes[mid]][axis],
+                       left=self._build(indexes[:mid]),
+                       right=self._build(indexes[mid:]))
+
+    def _search(self, query, visit, bound):
+        """Walk the tree, calling `visit(index, dist)` for every point in
+        a leaf that might qualify; `bound()` gives the current pruning
+        distance. The depth is O(log n), so plain recursion is fine."""
+        points = self.points
+        # Per-axis distance from the query to the current node's box.
+        offsets = [0] * self.dims
+
+        def search(node, box_dist):
+            if node.bucket is not None:
+                for index in node.bucket:
+                    visit(index, l1(query, points[index]))
+                return
+            axis = node.axis
+            diff = query[axis] - node.split
+            near, far = (node.left, node.right) if diff < 0 else (
+                node.right, node.left)
+            search(near, box_dist)
+            old = offsets[axis]
+            far_dist = box_dist - old + abs(diff)
+            if far_dist <= bound():
+                offsets[axis] = abs(diff)
+                search(far, far_dist)
+                offsets[axis] = old
+
+        if self.root is not None:
+            search(self.root, 0)
+
+    def knn(self, query, k=1):
+        """The k closest points, as (distance, index) pairs, closest first."""
+        if k <= 0:
+            return []
+        query = as_point(query)
+        heap = []  # Max heap of the best k so far, via negated distances.
+
+        def visit(index, dist):
+            if len(heap) < k:
+                heappush(heap, (-dist, -index))
+            elif dist < -heap[0][0]:
+                heappushpop(heap, (-dist, -index))
+
+        def bound():
+            return -heap[0][0] if len(heap) == k else float('inf')
+
+        self._search(query, visit, bound)
+        return sorted((-dist, -index) for dist, index in heap)
+
+    def radius(self, query, r):
+        """All points within distance r, as (distance, index) pairs."""
+        query = as_point(query)
+        found = []
+
+        def visit(index, dist):
+            if dist <= r:
+                found.append((dist, index))
+
+        self._search(query, visit, lambda: r)
+        return sorted(found)
+
+    def knn_many(self, queries, k=1):
+        """`knn` for each query; a list of empty lists if `k` <= 0."""
+        return [self.knn(query, k) for query in queries]
+
+    def radius_many(self, queries, r):
+        return [self.radius(query, r) for query in queries]
+
+
+def brute_knn(points, query, k=1):
+    query = as_point(query)
+    return sorted((l1(query, as_point(point)), index)
+                  for index, point in enumerate(points))[:k]
+
+
+def benchmark(count=100000, queries=200, k=5, dims=2):
+    """Median per-query time (ms) for the tree vs a linear scan."""
+    points = [tuple(randrange(0, 10000) for _ in range(dims))
+              for _ in range(count)]
+    lookups = [tuple(randrange(0, 10000) for _ in range(dims))
+               for _ in range(queries)]
+    start = perf_counter()
+    tree = KDTree(points)
+    build = perf_counter() - start
+    results = {'build_s': build}
+    for name, search in [('kd-tree', tree.knn),
+                         ('brute force', lambda q, k: brute_knn(
+                             points, q, k))]:
+        times = []
+        for lookup in lookups:
+            start = perf_counter()
+            search(lookup, k)
+            times.append((perf_counter() - start) * 1000)
+        results[name] = median(times)
+    return results
+
+
+if DEBUG:
+    with Section('K-d tree - Manhattan nearest neighbours'):
+        coords = [rand_coords(max_width=1000, max_height=1000)
+                  for _ in range(5000)]
+        tree = KDTree(coords)
+        origin = {'x': 500, 'y': 500}
+        nearest = tree.knn(origin, k=5)
+        print_simple('5 nearest to (500, 500)', [
+            (dist, tree.points[index]) for dist, index in nearest])
+        assert [dist for dist, _ in nearest] == [
+            dist for dist, _ in brute_knn(coords, origin, 5)]
+        within = tree.radius(origin, 20)
+        assert len(within) == sum(
+            1 for point in tree.points if l1(point, (500, 500)) <= 20)
+        print_simple('Points within 20', len(within))
+
+        print_h2('Batch queries')
+        queries = [rand_coords(1000, 1000) for _ in range(100)]
+        for query, found in zip(queries, tree.knn_many(queries, k=3)):
+            assert [d for d, _ in found] == [
+                d for d, _ in brute_knn(coords, query, 3)]
+        print('- 100 batch queries match brute force.')
+
+    with Section('K-d tree - benchmark'):
+        for dims in [2, 4, 8]:
+            res = benchmark(count=50000, queries=50, dims=dims)
+            print_simple('{} dimensions'.format(dims),
+                         'build {:.2f}s, kd-tree {:.3f}ms, brute {:.3f}ms per '
+                         'query'.format(res['build_s'], res['kd-tree'],
+                                        res['brute force']), newline=False)
@@ -6,11 +6,13 @@ from functools import wraps
 from string import punctuation
 
 
+_STRIP_PUNCTUATION = str.maketrans('', '', punctuation)
+
+
 def strip_punctuation(string):
     """Credit: http://stackoverflow.com/questions/265960/
         best-way-to-strip-punctuation-from-a-string-in-python"""
-    exclude = set(punctuation)
-    return ''.join(ch for ch in string if ch not in exclude)
+    return string.translate(_STRIP_PUNCTUATION)
 
 
 def verbose(func, *args, **kwargs):
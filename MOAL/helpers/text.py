@@ -61,7 +61,7 @@ def words_unix_dict(min_length=8):
         for word in words:
             if len(word) >= min_length:
                 yield word.strip()
-        raise StopIteration
+        return
 
 
 def random_binary(bits):
@@ -1,4 +1,9 @@
+import gc
+import json
+import platform
+import statistics
 import time
+import tracemalloc
 from random import randrange as rr
 from functools import wraps
 
@@ -13,28 +18,142 @@ def run_trials(func, trials=3):
         print('------------------------\n')
 
 
+# Input distributions for the sorting trials. Each takes a size and
+# returns a fresh list.
+DISTRIBUTIONS = {
+    'random': lambda size: [rr(0, 2 ** 31) for _ in range(size)],
+    'presorted': lambda size: list(range(size)),
+    'reversed': lambda size: list(range(size, 0, -1)),
+    'few_unique': lambda size: [rr(0, 8) for _ in range(size)],
+    'sawtooth': lambda size: [num % max(1, size // 8) for num in range(size)],
+}
+
+
+# Cheaper settings for demos: one distribution, a few repeats, no
+# warmup run (the correctness check warms things up) and no tracing.
+QUICK_TRIALS = {
+    'distributions': ('random',),
+    'repeats': 3,
+    'warmup': 0,
+    'track_memory': False,
+}
+
+
+def _time_ns(sorting_func, items):
+    """Time one sort of a fresh copy of `items`, with the garbage
+    collector paused so a collection doesn't land in the middle."""
+    data = list(items)
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter_ns()
+        sorting_func(data)
+        return time.perf_counter_ns() - start
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def _peak_memory(sorting_func, items):
+    """Peak bytes allocated by the sort itself (the input copy is made
+    before tracing starts). Tracing is slow, so this is a separate run."""
+    data = list(items)
+    tracemalloc.start()
+    try:
+        sorting_func(data)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _summarize(samples):
+    quartiles = statistics.quantiles(samples, n=4) if len(
+        samples) > 1 else [samples[0]] * 3
+    return {
+        'median_ns': int(statistics.median(samples)),
+        'iqr_ns': int(quartiles[2] - quartiles[0]),
+        'min_ns': min(samples),
+        'max_ns': max(samples),
+    }
+
+
 def run_sorting_trials(
-        sorting_func, magnitudes=[10, 100, 1000], test_output=True):
-    """Runs a bunch of trials of various magnitudes with a given
-    func, using randomly generated numbers.
-    Returns a dict of results for later inspection.
-    Tailored specifically for sorting functions, by
-    generating randomly mixed sequences of numbers."""
+        sorting_func, magnitudes=[10, 100, 1000], test_output=True,
+        generator=None, distributions=None, repeats=5, warmup=1,
+        track_memory=True):
+    """Runs a bunch of trials of various magnitudes and input
+    distributions with a given sorting func.
+    Returns a dict of results for later inspection (or `to_json`).
+
+    Each case is sorted `warmup` times untimed, then `repeats` times
+    with `perf_counter_ns`, every run on a fresh copy of the same input,
+    and summarised by median and interquartile range. The output is
+    checked against `sorted` outside of the timed runs, and
+    `track_memory` adds a traced run for peak memory.
+    `distributions` picks names from DISTRIBUTIONS (default: all), or pass
+    a `generator` that takes the magnitude and returns a list to try any
+    other kind of input.
+
+    The defaults are meant for benchmarks to compare against a baseline;
+    demos can pass `**QUICK_TRIALS` to just get a rough idea."""
+    if generator is not None:
+        cases = {getattr(generator, '__name__', 'custom'): generator}
+    else:
+        cases = {name: DISTRIBUTIONS[name]
+                 for name in (distributions or sorted(DISTRIBUTIONS))}
     results = {
-        'function': sorting_func.func_name if hasattr(
-            sorting_func, 'func_name') else 'builtin'
+        'function': getattr(sorting_func, '__name__', 'builtin'),
+        'python': platform.python_version(),
+        'repeats': repeats,
+        'warmup': warmup,
+        'trials': {},
     }
-    for magnitude in magnitudes:
-        start = time.time()
-        items = [rr(0, 999) for _ in range(magnitude)]
-        sorted_res = sorting_func(items)
-        end = time.time()
-        results[magnitude] = {'time': end - start}
-        if test_output:
-            results[magnitude]['correct'] = sorted(items) == sorted_res
+    for name, make_items in cases.items():
+        trials = results['trials'][name] = {}
+        for magnitude in magnitudes:
+            items = make_items(magnitude)
+            trial = {}
+            if test_output:
+                trial['correct'] = sorting_func(list(items)) == sorted(items)
+            for _ in range(warmup):
+                _time_ns(sorting_func, items)
+            trial.update(_summarize([
+                _time_ns(sorting_func, items) for _ in range(repeats)]))
+            if track_memory:
+                trial['peak_bytes'] = _peak_memory(sorting_func, items)
+            # String keys, so results survive a round trip through JSON.
+            trials[str(magnitude)] = trial
     return results
 
 
+def to_json(results, path=None):
+    """Serialise trial results; written to `path` if given."""
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if path is not None:
+        with open(path, 'w') as outfile:
+            outfile.write(output)
+    return output
+
+
+def find_regressions(baseline, current, tolerance=0.1):
+    """Compare two sets of `run_sorting_trials` results (e.g. one loaded
+    from a stored JSON baseline). A case counts as a regression when its
+    median got slower by more than `tolerance` (as a fraction) on top of
+    the baseline's own interquartile range, so ordinary noise is ignored.
+    Returns a list of (distribution, magnitude, baseline, current) medians."""
+    regressions = []
+    for name, trials in current['trials'].items():
+        for magnitude, trial in trials.items():
+            before = baseline['trials'].get(name, {}).get(magnitude)
+            if before is None:
+                continue
+            limit = before['median_ns'] * (1 + tolerance) + before['iqr_ns']
+            if trial['median_ns'] > limit:
+                regressions.append((name, magnitude, before['median_ns'],
+                                    trial['median_ns']))
+    return regressions
+
+
 def test_speed(func, *args, **kwargs):
     """Decorator that wraps a function and provides a timer
     + results output for execution profiling."""
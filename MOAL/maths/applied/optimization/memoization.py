@@ -8,54 +8,253 @@ if __name__ == '__main__':
     sys.path.append(getcwd())
 
 from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
 from MOAL.helpers.trials import test_speed
+from collections import OrderedDict
+from collections import defaultdict
+from collections import namedtuple
 from functools import wraps
+from threading import RLock
+from threading import Thread
+from time import monotonic
 
 DEBUG = True if __name__ == '__main__' else False
 
-memoized = {}
+# Memoization trades memory for time, so the memory has to be bounded:
+# every cache here holds at most `maxsize` results and evicts one when
+# it's full. Which one depends on the policy:
+#
+# - LRU: the least recently used. Good when recent calls predict the next.
+# - LFU: the least frequently used (oldest first among ties). Better when
+#   a few arguments are hot for a long time.
+# - TTL: LRU, but results also go stale after `ttl` seconds, for functions
+#   whose answers change (lookups against a database, say).
+#
+# All operations are O(1).
 
+CacheInfo = namedtuple('CacheInfo', 'hits misses evictions maxsize currsize')
 
-def memoize(func, *args, **kwargs):
-    """A decorator that memoizes the results of a decorated function."""
-    funcname = func.__name__
+DEFAULT_MAXSIZE = 1024
 
-    @wraps(func)
-    def _inner(*args, **kwargs):
-        key = (funcname, args)
-        print(key)
-
-        if key in memoized.keys():
-            print('Getting memoized version!')
-            key = (funcname, args)
-            return memoized[key]
-        else:
-            print('Calling normal function')
-            res = func(*args, **kwargs)
-            memoized[key] = res
-            return res
-    return _inner
+# Returned by `get` on a miss, since None can be a real result.
+_MISSING = object()
+# Separates the positional args from the kwargs in a key.
+_KWARGS_MARK = (object(),)
+
+# namespace -> the cache of each memoized function, so related caches can
+# be inspected or cleared together.
+caches = defaultdict(list)
+
+
+class LRUCache(object):
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        value = self.data.get(key, _MISSING)
+        if value is not _MISSING:
+            self.data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if self.maxsize is not None and len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.data.clear()
+
+
+class LFUCache(object):
+    """Keys are bucketed by how often they've been used, and each bucket
+    is ordered oldest first, so the victim is the first key of the lowest
+    bucket and every operation stays O(1)."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.data = {}
+        self.counts = {}
+        self.buckets = defaultdict(OrderedDict)
+        self.lowest = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def _touch(self, key):
+        count = self.counts[key]
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            if self.lowest == count:
+                self.lowest = count + 1
+        self.counts[key] = count + 1
+        self.buckets[count + 1][key] = None
+
+    def get(self, key):
+        value = self.data.get(key, _MISSING)
+        if value is not _MISSING:
+            self._touch(key)
+        return value
+
+    def set(self, key, value):
+        if self.maxsize == 0:
+            # Nothing is ever kept, as with `functools.lru_cache(0)`.
+            return
+        if key in self.data:
+            self.data[key] = value
+            self._touch(key)
+            return
+        if self.maxsize is not None and len(self.data) >= self.maxsize:
+            bucket = self.buckets[self.lowest]
+            victim, _ = bucket.popitem(last=False)
+            if not bucket:
+                del self.buckets[self.lowest]
+            del self.data[victim]
+            del self.counts[victim]
+            self.evictions += 1
+        self.data[key] = value
+        self.counts[key] = 1
+        self.buckets[1][key] = None
+        self.lowest = 1
+
+    def clear(self):
+        self.data.clear()
+        self.counts.clear()
+        self.buckets.clear()
+        self.lowest = 0
+
+
+class TTLCache(LRUCache):
+    """An LRU cache whose entries expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=60, timer=monotonic):
+        super(TTLCache, self).__init__(maxsize)
+        self.ttl = ttl
+        self.timer = timer
+
+    def get(self, key):
+        entry = super(TTLCache, self).get(key)
+        if entry is _MISSING:
+            return _MISSING
+        expires, value = entry
+        if expires <= self.timer():
+            del self.data[key]
+            return _MISSING
+        return value
 
+    def set(self, key, value):
+        super(TTLCache, self).set(key, (self.timer() + self.ttl, value))
 
-def memoize_lookuptable(func, *args, **kwargs):
+
+POLICIES = {'lru': LRUCache, 'lfu': LFUCache, 'ttl': TTLCache}
+
+
+def make_key(args, kwargs, typed=False):
+    """A hashable key for a call. Keyword arguments are sorted, so the
+    order they're passed in doesn't matter. With `typed`, 3 and 3.0 get
+    different keys."""
+    key = args
+    if kwargs:
+        key += _KWARGS_MARK + tuple(sorted(kwargs.items()))
+    if typed:
+        key += tuple(type(arg) for arg in args)
+        if kwargs:
+            key += tuple(type(value) for _, value in sorted(kwargs.items()))
+    return key
+
+
+def memoize(func=None, maxsize=DEFAULT_MAXSIZE, policy='lru', ttl=None,
+            typed=False, namespace=None, store=None):
     """A decorator that memoizes the results of a decorated function.
-    Instead of checking if key is in keys, it attempts to access the
-    property directly, like a typical lookup table."""
-    funcname = func.__name__
+
+    Use it bare (`@memoize`) or with options (`@memoize(maxsize=100,
+    policy='lfu')`). Passing a `ttl` implies the 'ttl' policy. Each
+    function gets its own cache, registered in `caches` under `namespace`
+    (the function's module by default). The decorated function gains
+    `cache_info()` and `cache_clear()`.
+
+    `store` is an optional second level, checked on a miss and written to
+    after every call, that outlives the process: see
+    `persistent_memoization.SqliteStore`. Stored results don't expire, so
+    it can't be combined with the 'ttl' policy.
+
+    The lock is only held to look up and store results, not while the
+    function runs, so two threads missing on the same key at once will
+    both call it."""
+    if func is None:
+        return lambda func: memoize(func, maxsize=maxsize, policy=policy,
+                                    ttl=ttl, typed=typed, namespace=namespace,
+                                    store=store)
+    if ttl is not None:
+        policy = 'ttl'
+    if policy == 'ttl' and store is not None:
+        raise ValueError('A store would keep serving results after their '
+                         'ttl; use one or the other')
+    if policy == 'ttl':
+        cache = TTLCache(maxsize, ttl if ttl is not None else 60)
+    else:
+        cache = POLICIES[policy](maxsize)
+    caches[namespace or func.__module__].append(cache)
+    lock = RLock()
+    stats = {'hits': 0, 'misses': 0}
+    if store is not None:
+        store_name = '{}.{}'.format(func.__module__, func.__qualname__)
+        version = store.register(store_name, func)
 
     @wraps(func)
     def _inner(*args, **kwargs):
-        key = (funcname, args)
-        try:
-            key = (funcname, args)
-            return memoized[key]
-        except KeyError:
-            res = func(*args, **kwargs)
-            memoized[key] = res
-            return res
+        key = make_key(args, kwargs, typed)
+        with lock:
+            res = cache.get(key)
+            if res is not _MISSING:
+                stats['hits'] += 1
+                return res
+            stats['misses'] += 1
+        if store is not None:
+            store_key = store.make_key(args, kwargs)
+            res = store.get(store_name, store_key, version)
+            if res is not _MISSING:
+                with lock:
+                    cache.set(key, res)
+                return res
+        res = func(*args, **kwargs)
+        with lock:
+            cache.set(key, res)
+        if store is not None:
+            store.set(store_name, store_key, version, res)
+        return res
+
+    def cache_info():
+        with lock:
+            return CacheInfo(stats['hits'], stats['misses'], cache.evictions,
+                             cache.maxsize, len(cache))
+
+    def cache_clear():
+        with lock:
+            cache.clear()
+            stats['hits'] = stats['misses'] = 0
+
+    _inner.cache = cache
+    _inner.cache_info = cache_info
+    _inner.cache_clear = cache_clear
     return _inner
 
 
+# Kept for compatibility: `memoize` already looks results up directly.
+memoize_lookuptable = memoize
+
+
 @test_speed
 @memoize
 def dolongthing(max_x, max_y):
@@ -98,3 +297,59 @@ if DEBUG:
         args = (500, 500)
         res1 = dolongthing(*args)
         res2 = dolongthing2(*args)
+        print_simple('dolongthing', dolongthing.cache_info())
+
+        print_h2('Bounded caches and eviction policies')
+        calls = []
+
+        @memoize(maxsize=2)
+        def square(num, power=2):
+            calls.append(num)
+            return num ** power
+
+        square(1), square(2), square(1), square(3)
+        # 2 was the least recently used, so it's the one evicted.
+        square(1), square(2)
+        assert calls == [1, 2, 3, 2]
+        assert square(4, power=3) == square(4, **{'power': 3}) == 64
+        print_simple('LRU', square.cache_info())
+
+        @memoize(maxsize=2, policy='lfu')
+        def cube(num):
+            calls.append(num)
+            return num ** 3
+
+        del calls[:]
+        cube(1), cube(1), cube(2), cube(3), cube(1)
+        # 1 is used most often, so 2 is evicted instead, though it's newer.
+        cube(2)
+        assert calls == [1, 2, 3, 2]
+        print_simple('LFU', cube.cache_info())
+
+        now = [0]
+
+        @memoize(ttl=10)
+        def lookup(name):
+            calls.append(name)
+            return name.upper()
+
+        lookup.cache.timer = lambda: now[0]
+        del calls[:]
+        lookup('a'), lookup('a')
+        now[0] = 11
+        lookup('a')
+        assert calls == ['a', 'a']
+        print_simple('TTL', lookup.cache_info())
+
+        print_h2('Thread safety')
+        counter = memoize(maxsize=64)(lambda num: num * 2)
+        threads = [Thread(target=lambda: [counter(num % 50)
+                                          for num in range(10000)])
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        info = counter.cache_info()
+        assert info.hits + info.misses == 80000 and info.currsize <= 64
+        print_simple('8 threads x 10000 calls', info)
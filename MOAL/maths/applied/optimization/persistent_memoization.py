@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+
+__author__ = """Chris Tabor (dxdstudio@gmail.com)"""
+
+if __name__ == '__main__':
+    from os import getcwd
+    from os import sys
+    sys.path.append(getcwd())
+
+import atexit
+import hashlib
+import inspect
+import os
+import pickle
+import sqlite3
+import struct
+from tempfile import TemporaryDirectory
+from threading import Event
+from threading import RLock
+from threading import Thread
+from time import perf_counter
+from time import time
+from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
+from MOAL.maths.applied.optimization.memoization import _MISSING
+from MOAL.maths.applied.optimization.memoization import memoize
+
+DEBUG = True if __name__ == '__main__' else False
+
+# A second level for `memoize` that survives restarts: results are
+# pickled into a sqlite table, keyed by the function's name and a hash of
+# its arguments. The in-memory cache in front of it still answers the
+# hot calls; the store only sees the misses.
+#
+# - Keys: a SHA-256 of the arguments, so they're stable from one run to
+#   the next (unlike `hash()`, which is salted per process). Sets and
+#   dicts are sorted first, since their order can depend on that salt.
+# - Versions: each row records a hash of the function's source (and its
+#   default arguments). When those change, the old rows are dropped rather
+#   than served. Rows are found by the function's qualified name, so
+#   lambdas and closures, where one name can mean different functions,
+#   can't be stored.
+# - Size: past `max_bytes` of pickled values, the least recently used rows
+#   are evicted, down to `low_water` of the limit.
+# - Writes: either straight through on every call, or, with
+#   `write_behind`, queued and written in batches by a background thread
+#   (reads check the queue first, so nothing is missed in between).
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memo (
+    namespace TEXT NOT NULL,
+    key BLOB NOT NULL,
+    version TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS memo_used ON memo (used);
+"""
+
+
+def source_hash(func):
+    """A hash of the function's source, or failing that its bytecode,
+    and its default arguments."""
+    try:
+        source = inspect.getsource(func).encode('utf-8')
+    except (OSError, TypeError):
+        code = func.__code__
+        source = code.co_code + repr(code.co_consts).encode('utf-8')
+    defaults = (func.__defaults__, func.__kwdefaults__)
+    try:
+        source += pickle.dumps(defaults, protocol=4)
+    except Exception:
+        source += repr(defaults).encode('utf-8')
+    return hashlib.sha256(source).hexdigest()[:16]
+
+
+def check_storable(func):
+    """Raise ValueError unless `func`'s name identifies it: a lambda's
+    doesn't, and a closure's results also depend on the variables it
+    closed over. (A method's `__class__` cell, for `super()`, is fine.)"""
+    if func.__name__ == '<lambda>':
+        raise ValueError('Lambdas have no name to store results under')
+    free = set(func.__code__.co_freevars) - {'__class__'}
+    if free:
+        raise ValueError('{} is a closure over {}; its results depend on '
+                         'more than its arguments'.format(
+                             func.__qualname__, ', '.join(sorted(free))))
+
+
+def _encode(value):
+    """Bytes for `value` that don't depend on the process: the contents
+    of sets and dicts are sorted (by their own encoding), lists and tuples
+    are encoded item by item, and anything else is pickled."""
+    kind = type(value)
+    if kind in (set, frozenset):
+        tag, parts = b'S', sorted(_encode(item) for item in value)
+    elif kind is dict:
+        tag, parts = b'D', sorted(
+            _encode(key) + _encode(item) for key, item in value.items())
+    elif kind in (list, tuple):
+        tag, parts = b'L' if kind is list else b'T', map(_encode, value)
+    else:
+        return b'P' + pickle.dumps(value, protocol=4)
+    return tag + b''.join(
+        struct.pack('<Q', len(part)) + part for part in parts)
+
+
+class SqliteStore(object):
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, low_water=0.9,
+                 write_behind=False, flush_interval=1.0, batch_size=512):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.batch_size = batch_size
+        self.lock = RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.size = self.conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM memo').fetchone()[0]
+        # (namespace, key) -> (version, pickled value), waiting to be written.
+        self.pending = {}
+        # (namespace, key) -> last read time, written with the next batch.
+        self.touched = {}
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+        self._stop = Event()
+        self._writer = None
+        if write_behind:
+            self._writer = Thread(target=self._write_behind,
+                                  args=(flush_interval,), daemon=True)
+            self._writer.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def make_key(args, kwargs):
+        """Stable across processes, unlike the in-memory keys."""
+        return hashlib.sha256(_encode((args, kwargs))).digest()
+
+    def register(self, namespace, func):
+        """Drop the rows a different version of `func` left behind, and
+        return the current version."""
+        check_storable(func)
+        version = source_hash(func)
+        with self.lock:
+            self.flush()
+            stale = self.conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM memo '
+                'WHERE namespace = ? AND version != ?',
+                (namespace, version)).fetchone()[0]
+            if stale:
+                self.conn.execute(
+                    'DELETE FROM memo WHERE namespace = ? AND version != ?',
+                    (namespace, version))
+                self.size -= stale
+        return version
+
+    def get(self, namespace, key, version):
+        with self.lock:
+            waiting = self.pending.get((namespace, key))
+            if waiting is not None and waiting[0] == version:
+                self.stats['hits'] += 1
+                return pickle.loads(waiting[1])
+            row = self.conn.execute(
+                'SELECT value FROM memo '
+                'WHERE namespace = ? AND key = ? AND version = ?',
+                (namespace, key, version)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return _MISSING
+            self.stats['hits'] += 1
+            self.touched[(namespace, key)] = time()
+        return pickle.loads(row[0])
+
+    def set(self, namespace, key, version, value):
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.pending[(namespace, key)] = (version, blob)
+            if self._writer is None or len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Write out the queued results and read times, in one
+        transaction, then evict if over the size limit."""
+        with self.lock:
+            if not self.pending and not self.touched:
+                return
+            now = time()
+            rows = [(namespace, key, version, blob, len(blob), now)
+                    for (namespace, key), (version, blob)
+                    in self.pending.items()]
+            conn = self.conn
+            conn.execute('BEGIN')
+            for namespace, key, _, _, _, _ in rows:
+                old = conn.execute(
+                    'SELECT size FROM memo WHERE namespace = ? AND key = ?',
+                    (namespace, key)).fetchone()
+                if old is not None:
+                    self.size -= old[0]
+            conn.executemany(
+                'INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?, ?, ?)', rows)
+            conn.executemany(
+                'UPDATE memo SET used = ? WHERE namespace = ? AND key = ?',
+                [(used, namespace, key) for (namespace, key), used
+                 in self.touched.items()])
+            conn.execute('COMMIT')
+            self.size += sum(row[4] for row in rows)
+            self.stats['writes'] += len(rows)
+            self.pending.clear()
+            self.touched.clear()
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        target = self.max_bytes * self.low_water
+        victims = []
+        cursor = self.conn.execute(
+            'SELECT namespace, key, size FROM memo ORDER BY used')
+        for namespace, key, size in cursor:
+            if self.size <= target:
+                break
+            victims.append((namespace, key))
+            self.size -= size
+        cursor.close()
+        self.conn.execute('BEGIN')
+        self.conn.executemany(
+            'DELETE FROM memo WHERE namespace = ? AND key = ?', victims)
+        self.conn.execute('COMMIT')
+        self.stats['evictions'] += len(victims)
+
+    def _write_behind(self, interval):
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def __len__(self):
+        with self.lock:
+            self.flush()
+            return self.conn.execute('SELECT COUNT(*) FROM memo').fetchone()[0]
+
+    def close(self):
+        if self.conn is None:
+            return
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join()
+        with self.lock:
+            self.flush()
+            self.conn.close()
+            self.conn = None
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _slow_sum(max_x, max_y):
+    res = 0
+    for x in range(max_x):
+        for y in range(max_y):
+            res += x ** y
+    return res
+
+
+if DEBUG:
+    with Section('Optimization - persistent memoization'):
+        with TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'memo.sqlite')
+            timings = []
+            # Each "run" is a fresh decorator and store, as after a restart.
+            for run in ['cold', 'warm']:
+                with SqliteStore(path) as store:
+                    slow_sum = memoize(store=store)(_slow_sum)
+                    start = perf_counter()
+                    results = [slow_sum(num, num)
+                               for num in range(100, 400, 50)]
+                    timings.append(perf_counter() - start)
+                    print_simple('{} start'.format(run), '{:.3f}s, {}'.format(
+                        timings[-1], store.stats), newline=False)
+            assert timings[1] < timings[0]
+
+            print_h2('Versioning by source')
+
+            def versioned(num):
+                return num + 1
+
+            with SqliteStore(path) as store:
+                memoize(store=store)(versioned)(1)
+                assert len(store) == 7
+
+            # A "new release" of the same function.
+            def versioned(num):
+                return num + 2
+
+            with SqliteStore(path) as store:
+                assert memoize(store=store)(versioned)(1) == 3
+                print_simple('After changing the source', store.stats)
+
+                def make_adder(amount):
+                    def add(num):
+                        return num + amount
+                    return add
+
+                # make_adder(1) and make_adder(100) would share rows.
+                try:
+                    memoize(store=store)(make_adder(100))
+                except ValueError as exc:
+                    print_simple('Closures are refused', exc)
+
+            print_h2('Write-behind, bounded size')
+            path = os.path.join(tmpdir, 'bounded.sqlite')
+            with SqliteStore(path, max_bytes=20000, write_behind=True,
+                             flush_interval=0.05) as store:
+                @memoize(maxsize=1, store=store)
+                def blob(num):
+                    return 'x' * 1000
+
+                for num in range(100):
+                    blob(num)
+                # Found in the queue or the table, whether flushed or not.
+                assert blob(98) == 'x' * 1000
+                store.flush()
+                assert store.size <= 20000 and len(store) < 100
+                print_simple('100 results of ~1KB, 20KB limit', '{} kept, {}'
+                             .format(len(store), store.stats), newline=False)
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+
+__author__ = """Chris Tabor (dxdstudio@gmail.com)"""
+
+if __name__ == '__main__':
+    from os import getcwd
+    from os import sys
+    sys.path.append(getcwd())
+
+import csv
+import io
+import os
+import sqlite3
+import tracemalloc
+from contextlib import contextmanager
+from itertools import islice
+from queue import Empty
+from queue import LifoQueue
+from random import choice
+from random import randrange as rr
+from tempfile import TemporaryDirectory
+from threading import Lock
+from time import perf_counter
+from uuid import uuid4
+from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+DEBUG = True if __name__ == '__main__' else False
+
+# A small data access layer, so the examples stop opening a connection per
+# run, reading whole tables with `fetchall()` and inserting a row per
+# statement:
+#
+# - A pool hands out connections and takes them back, committing (or
+#   rolling back on an error) in between.
+# - Reads stream in batches with `fetchmany`. On PostgreSQL the cursor is
+#   a named, server-side one, so the rows stay on the server until they're
+#   fetched, rather than all being sent at once.
+# - Writes go in batches: many rows per INSERT ... VALUES statement, or
+#   COPY on PostgreSQL, which skips per-statement parsing altogether.
+#
+# The same code runs against sqlite (a file, or :memory:), so all of it
+# can be tried and benchmarked without a database server.
+
+DEFAULT_BATCH_SIZE = 1000
+# sqlite builds before 3.32 allow at most 999 bound parameters a statement.
+SQLITE_MAX_PARAMS = 999
+POSTGRES_MAX_PARAMS = 32767
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    """Up to `maxsize` connections made by `factory`, opened as needed and
+    reused most recently returned first (so idle ones can time out on the
+    server without being handed out). `get` blocks for up to `timeout`
+    seconds when they're all in use."""
+
+    def __init__(self, factory, maxsize=10, timeout=30):
+        self.factory = factory
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.idle = LifoQueue()
+        self.opened = 0
+        self.lock = Lock()
+
+    def get(self):
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            pass
+        with self.lock:
+            if self.opened < self.maxsize:
+                self.opened += 1
+                try:
+                    return self.factory()
+                except Exception:
+                    self.opened -= 1
+                    raise
+        try:
+            return self.idle.get(timeout=self.timeout)
+        except Empty:
+            raise PoolTimeout('No connection free after {}s'.format(
+                self.timeout))
+
+    def put(self, conn):
+        self.idle.put(conn)
+
+    def discard(self, conn):
+        """Drop a broken connection rather than returning it."""
+        with self.lock:
+            self.opened -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """A connection for one transaction: committed if the block
+        succeeds, rolled back if it raises."""
+        conn = self.get()
+        try:
+            yield conn
+            conn.commit()
+        # Including GeneratorExit, for a `stream` that's abandoned early.
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception:
+                self.discard(conn)
+                raise
+            self.put(conn)
+            raise
+        else:
+            self.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except Empty:
+                return
+            conn.close()
+            with self.lock:
+                self.opened -= 1
+
+
+class DataAccess(object):
+    """Queries over a pool. `dialect` is 'sqlite' or 'postgres'; SQL
+    passed in uses that driver's placeholders (? or %s)."""
+
+    def __init__(self, pool, dialect='sqlite'):
+        self.pool = pool
+        self.dialect = dialect
+        self.placeholder = '?' if dialect == 'sqlite' else '%s'
+        self.max_params = (SQLITE_MAX_PARAMS if dialect == 'sqlite'
+                           else POSTGRES_MAX_PARAMS)
+
+    def execute(self, sql, params=()):
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            rowcount = cur.rowcount
+            cur.close()
+        return rowcount
+
+    def fetchall(self, sql, params=()):
+        """Every row at once; fine for small results only."""
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            cur.close()
+        return rows
+
+    def stream(self, sql, params=(), batch_size=DEFAULT_BATCH_SIZE):
+        """Yield the rows of a query, fetching `batch_size` at a time. The
+        connection is held until the generator is exhausted or closed."""
+        with self.pool.connection() as conn:
+            if self.dialect == 'postgres':
+                cur = conn.cursor(name='stream_{}'.format(uuid4().hex))
+                cur.itersize = batch_size
+            else:
+                cur = conn.cursor()
+            try:
+                cur.execute(sql, params)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        return
+                    for row in rows:
+                        yield row
+            finally:
+                cur.close()
+
+    def _values_sql(self, table, columns, count):
+        row = '({})'.format(', '.join([self.placeholder] * len(columns)))
+        return 'INSERT INTO {} ({}) VALUES {}'.format(
+            table, ', '.join(columns), ', '.join([row] * count))
+
+    def insert_many(self, table, columns, rows, batch_size=DEFAULT_BATCH_SIZE):
+        """Insert an iterable of row tuples, many to a statement, all in
+        one transaction. Returns how many were inserted."""
+        per_statement = max(1, min(batch_size,
+                                   self.max_params // len(columns)))
+        rows = iter(rows)
+        total = 0
+        full_sql = self._values_sql(table, columns, per_statement)
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            while True:
+                batch = list(islice(rows, per_statement))
+                if not batch:
+                    break
+                sql = full_sql if len(batch) == per_statement else \
+                    self._values_sql(table, columns, len(batch))
+                cur.execute(sql, [value for row in batch for value in row])
+                total += len(batch)
+            cur.close()
+        return total
+
+    def copy_rows(self, table, columns, rows, batch_size=50000):
+        """PostgreSQL's COPY, fed with CSV a batch at a time. Falls back
+        to `insert_many` on other databases."""
+        if self.dialect != 'postgres':
+            return self.insert_many(table, columns, rows)
+        sql = 'COPY {} ({}) FROM STDIN WITH CSV'.format(
+            table, ', '.join(columns))
+        rows = iter(rows)
+        total = 0
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                buf = io.StringIO()
+                csv.writer(buf).writerows(batch)
+                buf.seek(0)
+                cur.copy_expert(sql, buf)
+                total += len(batch)
+            cur.close()
+        return total
+
+    def insert_each(self, table, columns, rows):
+        """The baseline: one statement per row (via `executemany`)."""
+        rows = list(rows)
+        sql = self._values_sql(table, columns, 1)
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.executemany(sql, rows)
+            cur.close()
+        return len(rows)
+
+
+def sqlite_access(path=':memory:', maxsize=4, timeout=30):
+    """A `DataAccess` over sqlite. An in-memory database exists per
+    connection, so it gets a pool of one."""
+    if path == ':memory:':
+        maxsize = 1
+
+    def connect():
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    return DataAccess(ConnectionPool(connect, maxsize, timeout), 'sqlite')
+
+
+def postgres_access(maxsize=10, timeout=30, **connect_args):
+    """A `DataAccess` over PostgreSQL; `connect_args` go to
+    `psycopg2.connect`."""
+    if psycopg2 is None:
+        raise ImportError('psycopg2 is needed for PostgreSQL')
+    return DataAccess(ConnectionPool(
+        lambda: psycopg2.connect(**connect_args), maxsize, timeout),
+        'postgres')
+
+
+def _people(count):
+    """Rows for the benchmark, without needing faker."""
+    names = ['ada', 'grace', 'alan', 'edsger', 'barbara', 'donald', 'ken']
+    for num in range(count):
+        name = choice(names)
+        yield (name, '{}{}@example.com'.format(name, num),
+               '{} Main St'.format(rr(1, 9999)))
+
+
+def benchmark(access, count=100000):
+    """Seconds to insert `count` rows each way, and the time and peak
+    memory to read them back all at once vs streamed."""
+    columns = ('name', 'email', 'address')
+    results = {}
+    inserts = [('executemany', access.insert_each),
+               ('multi-row VALUES', access.insert_many)]
+    if access.dialect == 'postgres':
+        inserts.append(('COPY', access.copy_rows))
+    for name, insert in inserts:
+        access.execute('DROP TABLE IF EXISTS people')
+        access.execute('CREATE TABLE people (id INTEGER PRIMARY KEY, '
+                       'name VARCHAR, email VARCHAR, address VARCHAR)')
+        rows = list(_people(count))
+        start = perf_counter()
+        assert insert('people', columns, rows) == count
+        results['insert: ' + name] = perf_counter() - start
+    for name, read in [
+            ('fetchall', lambda: access.fetchall('SELECT * FROM people')),
+            ('stream', lambda: access.stream('SELECT * FROM people'))]:
+        tracemalloc.start()
+        start = perf_counter()
+        total = 0
+        for row in read():
+            total += 1
+        elapsed = perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert total == count
+        results['read: ' + name] = elapsed
+        results['read: {} peak MB'.format(name)] = peak / 1024.0 / 1024.0
+    return results
+
+
+if DEBUG:
+    with Section('Data access layer - sqlite local mode'):
+        with TemporaryDirectory() as tmpdir:
+            access = sqlite_access(os.path.join(tmpdir, 'people.db'))
+            access.execute('CREATE TABLE people (id INTEGER PRIMARY KEY, '
+                           'name VARCHAR, email VARCHAR, address VARCHAR)')
+            inserted = access.insert_many(
+                'people', ('name', 'email', 'address'), _people(2500))
+            print_simple('Inserted', inserted)
+            streamed = access.stream(
+                'SELECT name, COUNT(*) FROM people GROUP BY name', batch_size=2)
+            print_simple('Streamed in batches of 2', sorted(streamed))
+
+            print_h2('Transactions roll back on errors')
+            try:
+                with access.pool.connection() as conn:
+                    conn.execute("DELETE FROM people")
+                    raise ValueError('Changed my mind')
+            except ValueError:
+                pass
+            assert access.fetchall('SELECT COUNT(*) FROM people') == [(2500,)]
+            print_simple('Rows after a failed delete', 2500)
+            access.pool.close()
+
+    with Section('Data access layer - benchmark'):
+        with TemporaryDirectory() as tmpdir:
+            access = sqlite_access(os.path.join(tmpdir, 'bench.db'))
+            for name, value in sorted(benchmark(access, 100000).items()):
+                print_simple(name, '{:.3f}'.format(value), newline=False)
+            access.pool.close()
@@ -14,8 +14,8 @@ from MOAL.helpers.display import print_h2
 from MOAL.helpers.display import prnt
 from MOAL.helpers.trials import run_trials
 from MOAL.helpers.trials import test_speed
+from MOAL.storage.databases.relational.data_access import postgres_access
 from faker import Factory
-import psycopg2
 
 DEBUG = True if __name__ == '__main__' else False
 
@@ -23,46 +23,42 @@ faker = Factory.create()
 
 
 def make_person():
-    return {
-        'name': faker.name(),
-        'email': faker.email(),
-        'address': faker.address()}
+    return (faker.name(), faker.email(), faker.address())
 
 
 @test_speed
 def insert_all(max_records):
     peeps = [make_person() for n in range(max_records)]
     prnt('Records to create', peeps)
-    cur.executemany("""INSERT INTO people(name, email, address)
-            VALUES (%(name)s, %(email)s, %(address)s)""", peeps)
+    # COPY, rather than an INSERT per row.
+    db.copy_rows('people', ('name', 'email', 'address'), peeps)
 
 
 if DEBUG:
     with Section('PostgreSQL (via psycopg2)'):
         # Starting postgresql on mac:
         # `postgres -D /usr/local/var/postgres/data`
+        # Connections come from a pool, opened on first use.
+        db = postgres_access(
+            dbname='ctabor', user='ctabor', host='localhost', password='')
         try:
-            conn = psycopg2.connect(
-                dbname='ctabor', user='ctabor', host='localhost', password='')
+            db.execute('SELECT 1')
             print_success('Successfully connected!')
-        except:
+        except Exception:
             print_error('Could not connect to PostgreSql :(')
-            raise Exception
+            raise
 
-        cur = conn.cursor()
         # Always clean up DB for this demo.
-        cur.execute("""DROP TABLE people""")
-        cur.execute("""CREATE TABLE people(id serial PRIMARY KEY,
+        db.execute("""DROP TABLE IF EXISTS people""")
+        db.execute("""CREATE TABLE people(id serial PRIMARY KEY,
             name varchar, email varchar, address varchar)""")
 
         print_h2('Adding a bunch of records...')
         run_trials(insert_all, trials=10)
-        conn.commit()
 
         print_h2('Reading all records...')
-
-        cur.execute('SELECT * FROM people;')
-        records = cur.fetchall()
-        prnt('SQL Records', records)
+        # Streamed from a server-side cursor, a batch at a time.
+        for record in db.stream('SELECT * FROM people;'):
+            prnt('SQL Record', record)
         # Close up shop to prevent zombie processes, etc.
-        cur.close()
+        db.pool.close()
@@ -7,13 +7,54 @@ if __name__ == '__main__':
     from os import sys
     sys.path.append(getcwd())
 
+import json
+import mmap
+import os
+import re
+import struct
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from glob import glob
+from heapq import merge
+from heapq import nlargest
+from math import log
+from tempfile import TemporaryDirectory
+from time import time
+from MOAL.algorithms.texts.word_processing.pipeline import Analyzer
 from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
 from MOAL.helpers.generic import strip_punctuation
-import requests
-from collections import defaultdict
 
 DEBUG = True if __name__ == '__main__' else False
 
+# An on-disk positional inverted index, built the way Lucene does it:
+#
+# - Documents are buffered in memory, then flushed as an immutable segment
+#   file. Segments are merged in the background of later flushes (here:
+#   whenever `merge_factor` segments of the same size class pile up), so
+#   there are only ever O(log n) of them to search.
+# - A term's postings are its doc ids (ascending), the number of times it
+#   occurs in each, then every position, all as deltas from the previous
+#   value packed into variable length integers: 7 bits a byte, with the
+#   high bit set on all but the last byte. Small gaps take a single byte.
+#     [count] [doc id deltas...] [freqs...] [position deltas, per doc...]
+#   Doc ids and freqs come first so boolean and ranked queries never have
+#   to decode positions; only phrase queries do.
+# - Readers memory map the segment files, so postings are paged in by the
+#   OS as queries touch them, and the index can be far bigger than RAM.
+#   The term dictionary and document lengths are kept in memory.
+#
+# Doc ids are assigned in order and segments cover consecutive ranges of
+# them, so the postings of a term across segments are just concatenated.
+
+MAGIC = b'MOALIDX1'
+# Offsets of the doc lengths and dictionary, base doc id and doc count.
+FOOTER = struct.Struct('<QQQQ')
+MANIFEST = 'segments.json'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
 
 def make_inverted_index(documents):
     """Make an inverted index of the words in a set of documents.
@@ -25,27 +66,578 @@ def make_inverted_index(documents):
         dict: The inverted index.
     """
     idx = defaultdict(set)
-    for name, document in documents.iteritems():
+    for name, document in documents.items():
         document = strip_punctuation(document)
-        words = document.split()
-        for word in words:
+        for word in document.split():
             idx[word].add(name)
-    for word, docs in idx.iteritems():
-        idx[word] = set(docs)
     return idx
 
 
+def tokenize(text):
+    """Lower cased runs of word characters."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def encode_varint(num, out):
+    """Append `num` (>= 0) to the bytearray `out` as a varint."""
+    while num >= 0x80:
+        out.append((num & 0x7F) | 0x80)
+        num >>= 7
+    out.append(num)
+
+
+def decode_varint(buf, pos):
+    """Read a varint from `buf` at `pos`; returns (value, next position)."""
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_postings(postings):
+    """Encode a list of (doc id, positions) pairs, sorted by doc id."""
+    out = bytearray()
+    encode_varint(len(postings), out)
+    last = 0
+    for doc_id, _ in postings:
+        encode_varint(doc_id - last, out)
+        last = doc_id
+    for _, positions in postings:
+        encode_varint(len(positions), out)
+    for _, positions in postings:
+        last = 0
+        for position in positions:
+            encode_varint(position - last, out)
+            last = position
+    return out
+
+
+def _decode_docs(buf, pos, base=0):
+    """Decode the doc ids and freqs of the postings at `pos`. Returns them
+    with the offset of the positions that follow."""
+    count, pos = decode_varint(buf, pos)
+    doc_ids, freqs = array('q'), array('q')
+    doc_id = base
+    for _ in range(count):
+        delta, pos = decode_varint(buf, pos)
+        doc_id += delta
+        doc_ids.append(doc_id)
+    for _ in range(count):
+        freq, pos = decode_varint(buf, pos)
+        freqs.append(freq)
+    return doc_ids, freqs, pos
+
+
+def _decode_positions(buf, pos, freqs):
+    positions = []
+    for freq in freqs:
+        doc_positions, last = [], 0
+        for _ in range(freq):
+            delta, pos = decode_varint(buf, pos)
+            last += delta
+            doc_positions.append(last)
+        positions.append(doc_positions)
+    return positions
+
+
+class PostingList(object):
+    """The decoded doc ids and freqs of a term. Positions stay encoded
+    until `positions` is first asked for."""
+
+    __slots__ = ('doc_ids', 'freqs', '_sources', '_positions')
+
+    def __init__(self, doc_ids=None, freqs=None, sources=None):
+        self.doc_ids = doc_ids if doc_ids is not None else array('q')
+        self.freqs = freqs if freqs is not None else array('q')
+        # (buffer, offset, freqs) for each segment's encoded positions.
+        self._sources = sources or []
+        self._positions = None
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def positions(self, index):
+        """Positions of the term in the `index`-th doc of the list."""
+        if self._positions is None:
+            self._positions = []
+            for buf, offset, freqs in self._sources:
+                self._positions.extend(_decode_positions(buf, offset, freqs))
+        return self._positions[index]
+
+    def index(self, doc_id):
+        """Where `doc_id` is in the list (it must be there)."""
+        return bisect_left(self.doc_ids, doc_id)
+
+
+def gallop(arr, target, lo=0):
+    """Index of the first item >= `target` in the sorted `arr`, starting
+    from `lo`: doubling steps to overshoot it, then a binary search of the
+    last step. O(log d) where d is how far it had to go, which is what
+    makes intersecting a short list with a long one cheap."""
+    size = len(arr)
+    if lo >= size or arr[lo] >= target:
+        return lo
+    step = 1
+    while lo + step < size and arr[lo + step] < target:
+        lo += step
+        step <<= 1
+    return bisect_left(arr, target, lo + 1, min(size, lo + step + 1))
+
+
+def intersect(lists):
+    """Doc ids in every one of the sorted `lists`. The shortest list
+    drives, and the others are galloped through."""
+    if not lists:
+        return []
+    lists = sorted(lists, key=len)
+    cursors = [0] * len(lists)
+    found = []
+    for doc_id in lists[0]:
+        for num in range(1, len(lists)):
+            cursor = cursors[num] = gallop(lists[num], doc_id, cursors[num])
+            if cursor == len(lists[num]):
+                return found
+            if lists[num][cursor] != doc_id:
+                break
+        else:
+            found.append(doc_id)
+    return found
+
+
+def union(lists):
+    """Doc ids in any of the sorted `lists`."""
+    found = []
+    for doc_id in merge(*lists):
+        if not found or found[-1] != doc_id:
+            found.append(doc_id)
+    return found
+
+
+def _write_segment(path, base, terms, lengths):
+    """Write a segment: `terms` yields (term, encoded postings) in sorted
+    term order, `lengths` is the token count of each doc."""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as out:
+        out.write(MAGIC)
+        offset = len(MAGIC)
+        dictionary = bytearray()
+        for term, encoded in terms:
+            raw = term.encode('utf-8')
+            encode_varint(len(raw), dictionary)
+            dictionary.extend(raw)
+            encode_varint(offset, dictionary)
+            encode_varint(len(encoded), dictionary)
+            out.write(encoded)
+            offset += len(encoded)
+        lengths_offset = offset
+        out.write(array('I', lengths).tobytes())
+        dictionary_offset = lengths_offset + 4 * len(lengths)
+        out.write(dictionary)
+        out.write(FOOTER.pack(lengths_offset, dictionary_offset, base,
+                              len(lengths)))
+    os.replace(tmp, path)
+
+
+class Segment(object):
+    """A memory mapped, read only segment file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self.buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buf[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not an index segment'.format(path))
+        lengths_offset, dictionary_offset, self.base, self.count = \
+            FOOTER.unpack(self.buf[-FOOTER.size:])
+        self.lengths = array('I')
+        self.lengths.frombytes(self.buf[lengths_offset:dictionary_offset])
+        # term -> (offset, size) of its postings.
+        self.terms = {}
+        pos, end = dictionary_offset, len(self.buf) - FOOTER.size
+        while pos < end:
+            size, pos = decode_varint(self.buf, pos)
+            term = self.buf[pos:pos + size].decode('utf-8')
+            offset, pos = decode_varint(self.buf, pos + size)
+            size, pos = decode_varint(self.buf, pos)
+            self.terms[term] = (offset, size)
+
+    def postings(self, term):
+        """(doc ids, freqs, positions offset), or None without the term."""
+        found = self.terms.get(term)
+        if found is None:
+            return None
+        return _decode_docs(self.buf, found[0], self.base)
+
+    def raw_positions(self, term, start):
+        """The encoded positions of a term, from the offset returned by
+        `postings`, as bytes."""
+        offset, size = self.terms[term]
+        return self.buf[start:offset + size]
+
+    def close(self):
+        self.buf.close()
+        self._file.close()
+
+
+class IndexWriter(object):
+    """Adds documents to the index in the directory `path`.
+
+    Documents are buffered until `max_buffered_docs` of them, then
+    flushed as a new segment. Whenever the last `merge_factor` segments
+    are of the same level they're merged into one of the next level up,
+    so a segment at level L holds about max_buffered_docs * merge_factor^L
+    docs. Call `commit` to flush what's buffered."""
+
+    def __init__(self, path, max_buffered_docs=1000, merge_factor=10,
+                 tokenizer=tokenize):
+        self.path = path
+        self.max_buffered_docs = max_buffered_docs
+        self.merge_factor = merge_factor
+        self.tokenizer = tokenizer
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        manifest = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest) as infile:
+                state = json.load(infile)
+        else:
+            state = {'segments': [], 'next_doc': 0, 'generation': 0}
+        self.segments = state['segments']
+        self.next_doc = state['next_doc']
+        self.generation = state['generation']
+        self._reset_buffer()
+
+    def _reset_buffer(self):
+        # term -> list of (doc id, positions), in doc id order.
+        self._buffer = defaultdict(list)
+        self._names = []
+        self._lengths = []
+        self._base = self.next_doc
+
+    def add(self, name, text):
+        """Index a document: `text` is a string, or an iterable of tokens
+        (which is consumed lazily). Returns the new doc id."""
+        tokens = self.tokenizer(text) if isinstance(text, str) else text
+        doc_id = self.next_doc
+        self.next_doc += 1
+        positions = defaultdict(list)
+        length = 0
+        for position, token in enumerate(tokens):
+            positions[token].append(position)
+            length = position + 1
+        for token, where in positions.items():
+            self._buffer[token].append((doc_id, where))
+        self._names.append(name)
+        self._lengths.append(length)
+        if len(self._names) >= self.max_buffered_docs:
+            self.flush()
+        return doc_id
+
+    def _segment_path(self, name):
+        return os.path.join(self.path, name + '.seg')
+
+    def _new_name(self):
+        self.generation += 1
+        return 'segment_{:06d}'.format(self.generation)
+
+    def flush(self):
+        if not self._names:
+            return
+        name = self._new_name()
+        base = self._base
+        _write_segment(
+            self._segment_path(name), base,
+            ((term, encode_postings([(doc_id - base, where)
+                                     for doc_id, where in postings]))
+             for term, postings in sorted(self._buffer.items())),
+            self._lengths)
+        with open(os.path.join(self.path, name + '.names'), 'w') as out:
+            json.dump(self._names, out)
+        self.segments.append({'name': name, 'base': base,
+                              'count': len(self._names), 'level': 0})
+        self._reset_buffer()
+        self._maybe_merge()
+        self._save_manifest()
+
+    def _maybe_merge(self):
+        factor = self.merge_factor
+        while len(self.segments) >= factor:
+            tail = self.segments[-factor:]
+            level = tail[0]['level']
+            if any(seg['level'] != level for seg in tail):
+                break
+            self.segments[-factor:] = [self._merge(tail, level + 1)]
+
+    def force_merge(self):
+        """Merge every segment into one."""
+        self.flush()
+        if len(self.segments) > 1:
+            level = max(seg['level'] for seg in self.segments) + 1
+            self.segments = [self._merge(self.segments, level)]
+            self._save_manifest()
+
+    def _merge(self, entries, level):
+        """Merge adjacent segments. Only the doc id deltas and freqs are
+        re-encoded; the positions are copied across as they are. One term
+        is held in memory at a time."""
+        segments = [Segment(self._segment_path(entry['name']))
+                    for entry in entries]
+        base = entries[0]['base']
+        name = self._new_name()
+
+        def terms():
+            for term in sorted(set().union(*(seg.terms for seg in segments))):
+                doc_ids, freqs, positions = [], [], bytearray()
+                for seg in segments:
+                    if term not in seg.terms:
+                        continue
+                    seg_docs, seg_freqs, start = seg.postings(term)
+                    doc_ids.extend(seg_docs)
+                    freqs.extend(seg_freqs)
+                    positions.extend(seg.raw_positions(term, start))
+                out = bytearray()
+                encode_varint(len(doc_ids), out)
+                last = base
+                for doc_id in doc_ids:
+                    encode_varint(doc_id - last, out)
+                    last = doc_id
+                for freq in freqs:
+                    encode_varint(freq, out)
+                out.extend(positions)
+                yield term, out
+
+        lengths = array('I')
+        names = []
+        for seg, entry in zip(segments, entries):
+            lengths.extend(seg.lengths)
+            with open(os.path.join(self.path,
+                                   entry['name'] + '.names')) as infile:
+                names.extend(json.load(infile))
+        _write_segment(self._segment_path(name), base, terms(), lengths)
+        with open(os.path.join(self.path, name + '.names'), 'w') as out:
+            json.dump(names, out)
+        for seg, entry in zip(segments, entries):
+            seg.close()
+            # Open readers keep their own mapping, so this is safe on POSIX.
+            os.remove(self._segment_path(entry['name']))
+            os.remove(os.path.join(self.path, entry['name'] + '.names'))
+        return {'name': name, 'base': base, 'count': len(names),
+                'level': level}
+
+    def _save_manifest(self):
+        manifest = os.path.join(self.path, MANIFEST)
+        with open(manifest + '.tmp', 'w') as out:
+            json.dump({'segments': self.segments, 'next_doc': self.next_doc,
+                       'generation': self.generation}, out)
+        os.replace(manifest + '.tmp', manifest)
+
+    def commit(self):
+        self.flush()
+        self._save_manifest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.commit()
+
+
+class IndexReader(object):
+    """Searches a committed index: boolean AND and OR over terms, exact
+    phrases, and BM25 ranked retrieval."""
+
+    def __init__(self, path, tokenizer=tokenize):
+        self.path = path
+        self.tokenizer = tokenizer
+        with open(os.path.join(path, MANIFEST)) as infile:
+            entries = json.load(infile)['segments']
+        self.segments = [Segment(os.path.join(path, entry['name'] + '.seg'))
+                         for entry in entries]
+        self._names = [os.path.join(path, entry['name'] + '.names')
+                       for entry in entries]
+        self.lengths = array('I')
+        for seg in self.segments:
+            self.lengths.extend(seg.lengths)
+        self.first_doc = self.segments[0].base if self.segments else 0
+        self.doc_count = len(self.lengths)
+        self.avg_length = (sum(self.lengths) / float(self.doc_count)
+                           if self.doc_count else 0.0)
+        self._doc_names = None
+
+    def _terms(self, query):
+        return self.tokenizer(query) if isinstance(query, str) else query
+
+    def postings(self, term):
+        result = PostingList()
+        for seg in self.segments:
+            found = seg.postings(term)
+            if found is None:
+                continue
+            doc_ids, freqs, offset = found
+            result.doc_ids.extend(doc_ids)
+            result.freqs.extend(freqs)
+            result._sources.append((seg.buf, offset, freqs))
+        return result
+
+    def doc_freq(self, term):
+        return len(self.postings(term))
+
+    def name(self, doc_id):
+        if self._doc_names is None:
+            self._doc_names = []
+            for path in self._names:
+                with open(path) as infile:
+                    self._doc_names.extend(json.load(infile))
+        return self._doc_names[doc_id - self.first_doc]
+
+    def search_and(self, query):
+        """Doc ids containing every term."""
+        return intersect([self.postings(term).doc_ids
+                          for term in set(self._terms(query))])
+
+    def search_or(self, query):
+        """Doc ids containing any of the terms."""
+        return union([self.postings(term).doc_ids
+                      for term in set(self._terms(query))])
+
+    def search_phrase(self, query):
+        """Doc ids containing the terms next to each other, in order."""
+        terms = list(self._terms(query))
+        if not terms:
+            return []
+        lists = [self.postings(term) for term in terms]
+        found = []
+        for doc_id in intersect([plist.doc_ids for plist in lists]):
+            starts = set(lists[0].positions(lists[0].index(doc_id)))
+            for offset, plist in enumerate(lists[1:], 1):
+                here = plist.positions(plist.index(doc_id))
+                starts.intersection_update(pos - offset for pos in here)
+                if not starts:
+                    break
+            if starts:
+                found.append(doc_id)
+        return found
+
+    def bm25(self, query, k=10, k1=1.2, b=0.75):
+        """The top `k` (score, doc id) pairs by Okapi BM25, best first:
+        https://en.wikipedia.org/wiki/Okapi_BM25"""
+        scores = defaultdict(float)
+        lengths, first = self.lengths, self.first_doc
+        norm = k1 / (self.avg_length or 1.0)
+        for term in set(self._terms(query)):
+            plist = self.postings(term)
+            if not plist:
+                continue
+            df = len(plist)
+            idf = log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+            for doc_id, freq in zip(plist.doc_ids, plist.freqs):
+                length = lengths[doc_id - first]
+                scores[doc_id] += idf * freq * (k1 + 1) / (
+                    freq + k1 * (1 - b) + norm * b * length)
+        return nlargest(k, ((score, doc_id)
+                            for doc_id, score in scores.items()))
+
+    def close(self):
+        for seg in self.segments:
+            seg.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _source_files():
+    """This repo's own modules make a handy offline corpus."""
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__)))))
+    return sorted(glob(os.path.join(root, '**', '*.py'), recursive=True))
+
+
 if DEBUG:
     with Section('Inverted index'):
-        docs = {}
-        pages = [
-            'https://en.wikipedia.org/wiki/Inverted_index',
-            'https://en.wikipedia.org/wiki/Table_(database)',
-            'https://en.wikipedia.org/wiki/Database_index',
-            'https://en.wikipedia.org/wiki/Data_structure',
-        ]
-        for page in pages:
-            docs[page] = requests.get(page).content
+        docs = {
+            'doc1': 'The quick brown fox jumps over the lazy dog.',
+            'doc2': 'A quick brown dog outpaces a quick fox!',
+            'doc3': 'Lazy afternoons; the dog sleeps.',
+        }
         idx = make_inverted_index(docs)
-        for word, indices in idx.iteritems():
-            print('"{}" in {}\n'.format(word, indices))
+        print_simple('In-memory index, "quick"', sorted(idx['quick']))
+
+        print_h2('Postings compression')
+        postings = [(3, [1, 5, 9]), (70, [2]), (1000, [0, 400])]
+        encoded = encode_postings(postings)
+        doc_ids, freqs, offset = _decode_docs(encoded, 0)
+        assert list(doc_ids) == [3, 70, 1000]
+        assert _decode_positions(encoded, offset, freqs) == [
+            positions for _, positions in postings]
+        print_simple('Encoded bytes', len(encoded))
+        print_simple('Galloping intersection', intersect(
+            [list(range(0, 1000, 3)), list(range(0, 1000, 7)), [21, 42, 50]]))
+
+    with Section('Inverted index - segments, boolean and ranked queries'):
+        files = _source_files()
+        with TemporaryDirectory() as tmpdir:
+            start = time()
+            texts = {}
+            with IndexWriter(tmpdir, max_buffered_docs=50,
+                             merge_factor=4) as writer:
+                for path in files:
+                    with open(path) as infile:
+                        texts[path] = infile.read()
+                    writer.add(os.path.relpath(path), texts[path])
+            print_simple('Indexed {} files'.format(len(files)),
+                         '{:.2f}s, {} segments, {} bytes on disk'.format(
+                             time() - start, len(writer.segments),
+                             sum(os.path.getsize(path) for path in glob(
+                                 os.path.join(tmpdir, '*.seg')))),
+                         newline=False)
+            paths = sorted(texts)
+            with IndexReader(tmpdir) as reader:
+                assert reader.doc_count == len(files)
+                found = reader.search_and('binary search tree')
+                expected = [doc_id for doc_id, path in enumerate(paths)
+                            if {'binary', 'search', 'tree'}.issubset(
+                                tokenize(texts[path]))]
+                assert found == expected
+                print_simple('"binary" AND "search" AND "tree"', len(found))
+                found = reader.search_phrase('binary search tree')
+                phrase = ['binary', 'search', 'tree']
+                assert found == [doc_id for doc_id in expected if any(
+                    words[pos:pos + 3] == phrase
+                    for words in [tokenize(texts[paths[doc_id]])]
+                    for pos in range(len(words)))]
+                print_simple('Phrase "binary search tree"', [
+                    reader.name(doc_id) for doc_id in found])
+                print_simple('"heap" OR "queue"', len(
+                    reader.search_or('heap queue')))
+                print_simple('BM25 top 5 for "levenshtein distance"', [
+                    (round(score, 2), reader.name(doc_id)) for score, doc_id
+                    in reader.bm25('levenshtein distance', k=5)])
+
+            writer = IndexWriter(tmpdir)
+            writer.force_merge()
+            with IndexReader(tmpdir) as reader:
+                assert len(reader.segments) == 1
+                assert reader.search_phrase('binary search tree') == found
+                print('- Results are the same after merging to one segment.')
+
+    with Section('Inverted index - streaming analysis'):
+        # Files go through the analyzer a chunk at a time, and the writer
+        # takes the tokens as they come; queries get stemmed the same way.
+        analyzer = Analyzer()
+        with TemporaryDirectory() as tmpdir:
+            with IndexWriter(tmpdir, max_buffered_docs=100) as writer:
+                for path in files:
+                    writer.add(os.path.relpath(path), analyzer.file(path))
+            with IndexReader(tmpdir, tokenizer=analyzer) as reader:
+                print_simple('BM25 top 3 for "sorted merging"', [
+                    (round(score, 2), reader.name(doc_id)) for score, doc_id
+                    in reader.bm25('sorted merging', k=3)])
+                assert reader.search_and('sorts') == reader.search_and(
+                    'sorting')
@@ -13,77 +13,92 @@ from MOAL.helpers.display import print_info
 from MOAL.helpers.display import print_warning
 from MOAL.helpers.display import print_h2
 from MOAL.helpers.trials import test_speed
+from MOAL.storage.databases.relational.data_access import postgres_access
+from MOAL.storage.databases.relational.data_access import sqlite_access
+from MOAL.systems_engineering.performance.caching.tiered_cache import \
+    InMemoryRemote
+from MOAL.systems_engineering.performance.caching.tiered_cache import \
+    MemcachedRemote
+from MOAL.systems_engineering.performance.caching.tiered_cache import \
+    TieredCache
 from uuid import uuid1
 from faker import Factory
-import psycopg2
-import pylibmc
+
+try:
+    import psycopg2
+    import pylibmc
+except ImportError:
+    psycopg2 = pylibmc = None
 
 DEBUG = True if __name__ == '__main__' else False
 CACHE_KEY = 'people_key_{}'.format(uuid1())
 CLIENTS = ['127.0.0.1']
+# Without PostgreSQL and memcached (or their drivers), run against sqlite
+# and an in-process stand-in for memcached instead.
+LOCAL = psycopg2 is None or pylibmc is None
 
 faker = Factory.create()
-mclient = pylibmc.Client(CLIENTS, binary=True, behaviors={'tcp_nodelay': True})
+if LOCAL:
+    remote = InMemoryRemote()
+else:
+    remote = MemcachedRemote(pylibmc.Client(
+        CLIENTS, binary=True, behaviors={'tcp_nodelay': True}))
+# A local LRU in front of memcached, with expiry and stampede protection.
+cache = TieredCache(remote=remote, default_ttl=60)
 
 
 def make_person():
-    return {
-        'name': faker.name(),
-        'email': faker.email(),
-        'address': faker.address()}
+    return (faker.name(), faker.email(), faker.address())
+
+
+def create_records(db, max_records):
+    db.insert_many('cache_table', ('name', 'email', 'address'),
+                   (make_person() for n in range(max_records)))
 
 
-def create_records(max_records):
-    peeps = [make_person() for n in range(max_records)]
-    cur.executemany("""INSERT INTO cache_table(name, email, address)
-            VALUES (%(name)s, %(email)s, %(address)s)""", peeps)
-    conn.commit()
+def load_records(db):
+    print_warning('Looking up SQL Records')
+    return list(db.stream('SELECT * FROM cache_table'))
 
 
 @test_speed
-def get_records(cur):
-    cached = mclient.get(CACHE_KEY)
-    if cached:
+def get_records(db):
+    misses = cache.metrics.counts['misses']
+    records = cache.get_or_load(CACHE_KEY, lambda: load_records(db))
+    if cache.metrics.counts['misses'] == misses:
         print_success('Found the cached version instead')
-        return cached
-    else:
-        print_warning('Looking up SQL Records')
-        cur.execute('SELECT * FROM cache_table;')
-        records = cur.fetchall()
-        conn.commit()
-        # Setup caching once loaded
-        mclient.set(CACHE_KEY, records)
-        return records
-
-
-def cleanup(cur, conn):
+    return records
+
+
+def cleanup(db):
     print_info('Cleaning up...')
     # Always clean up DB for this demo.
-    try:
-        cur.execute("""DROP TABLE cache_table;""")
-    except psycopg2.ProgrammingError:
-        conn.commit()
+    db.execute('DROP TABLE IF EXISTS cache_table')
     # Clean up cache as well.
-    mclient.delete(CACHE_KEY)
+    cache.invalidate(CACHE_KEY)
 
 
 if DEBUG:
     with Section('Memcached'):
-        try:
-            conn = psycopg2.connect(
+        if LOCAL:
+            print_info('Using sqlite and an in-memory cache server.')
+            db = sqlite_access(':memory:')
+            primary_key = 'id INTEGER PRIMARY KEY'
+        else:
+            db = postgres_access(
                 dbname='ctabor', user='ctabor', host='localhost', password='')
-        except:
-            raise Exception('Could not connect to PostgreSql')
-        cur = conn.cursor()
+            primary_key = 'id serial PRIMARY KEY'
         print_h2('Adding a bunch of records...')
-        cleanup(cur, conn)
-        cur.execute("""CREATE TABLE cache_table(id serial PRIMARY KEY,
-            name varchar, email varchar, address varchar)""")
+        cleanup(db)
+        db.execute("""CREATE TABLE cache_table({},
+            name varchar, email varchar, address varchar)""".format(
+            primary_key))
         # Create a bunch of initial records
-        create_records(5000)
+        create_records(db, 5000)
         # Query the database for the newly created records.
-        get_records(cur)
-        # Read the database again, which will hit memcached first.
-        get_records(cur)
+        get_records(db)
+        # Read the database again, which will hit the cache first.
+        get_records(db)
+        print_info('Cache metrics: {}'.format(cache.metrics.summary()))
         # Close up shop to prevent zombie processes, etc.
-        cur.close()
+        db.pool.close()
@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+
+__author__ = """Chris Tabor (dxdstudio@gmail.com)"""
+
+if __name__ == '__main__':
+    from os import getcwd
+    from os import sys
+    sys.path.append(getcwd())
+
+import hashlib
+import pickle
+from collections import deque
+from concurrent.futures import Future
+from functools import wraps
+from math import log
+from random import paretovariate
+from random import random
+from statistics import median
+from threading import Lock
+from threading import Thread
+from time import perf_counter
+from time import sleep
+from time import time
+from MOAL.helpers.display import Section
+from MOAL.helpers.display import print_h2
+from MOAL.helpers.display import print_simple
+from MOAL.maths.applied.optimization.memoization import LRUCache
+from MOAL.maths.applied.optimization.memoization import _MISSING
+
+DEBUG = True if __name__ == '__main__' else False
+
+# A read-through cache in two tiers, in front of something slow:
+#
+#   local LRU (per process)  ->  remote (memcached, shared)  ->  loader
+#
+# Every entry carries its own expiry time, and how long it took to load.
+# Three things stop a popular key from hammering the backend:
+#
+# - Single-flight: concurrent misses on the same key wait for the one
+#   load already in flight, instead of all running the loader.
+# - Probabilistic early expiration ("XFetch", Vattani et al., "Optimal
+#   Probabilistic Cache Stampede Prevention", 2015): as an entry nears
+#   its expiry, each read has a growing chance of refreshing it early,
+#   with a head start proportional to how slow it is to load. So one
+#   reader refreshes it while everyone else still gets a hit, rather than
+#   everyone missing at the same instant.
+# - The local tier absorbs repeated reads of hot keys without a network
+#   round trip. Its entries expire with the remote ones, so they're
+#   at most one TTL stale.
+
+DEFAULT_TTL = 300
+# How many recent latencies to keep for the percentiles.
+LATENCY_WINDOW = 10000
+
+
+class _Entry(object):
+
+    __slots__ = ('value', 'expires', 'delta')
+
+    def __init__(self, value, expires, delta):
+        self.value = value
+        self.expires = expires
+        # Seconds the loader took, for XFetch.
+        self.delta = delta
+
+
+class InMemoryRemote(object):
+    """A stand-in for a memcached server, for tests and demos: a dict
+    with expiry, and optionally a simulated network round trip."""
+
+    def __init__(self, latency=0.0, timer=time):
+        self.data = {}
+        self.latency = latency
+        self.timer = timer
+        self.lock = Lock()
+        self.calls = 0
+
+    def _round_trip(self):
+        self.calls += 1
+        if self.latency:
+            sleep(self.latency)
+
+    def get(self, key):
+        self._round_trip()
+        with self.lock:
+            found = self.data.get(key)
+            if found is None:
+                return None
+            expires, blob = found
+            if expires is not None and expires <= self.timer():
+                del self.data[key]
+                return None
+        return pickle.loads(blob)
+
+    def get_multi(self, keys):
+        self._round_trip()
+        found = {}
+        now = self.timer()
+        with self.lock:
+            for key in keys:
+                entry = self.data.get(key)
+                if entry is not None and (entry[0] is None or entry[0] > now):
+                    found[key] = pickle.loads(entry[1])
+        return found
+
+    def set(self, key, value, time=0):
+        """Like memcached, `time` is the TTL in seconds, and 0 is never."""
+        self._round_trip()
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.data[key] = (self.timer() + time if time else None, blob)
+        return True
+
+    def delete(self, key):
+        self._round_trip()
+        with self.lock:
+            return self.data.pop(key, None) is not None
+
+
+class MemcachedRemote(object):
+    """Adapts a memcached client (pylibmc or pymemcache, which both have
+    get/set/delete/get_multi) to the remote tier. Memcached keys can't
+    have spaces or be over 250 bytes, so those are hashed."""
+
+    def __init__(self, client, prefix=''):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key):
+        key = self.prefix + key
+        if len(key) > 200 or any(char.isspace() for char in key):
+            return self.prefix + hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return key
+
+    def get(self, key):
+        return self.client.get(self._key(key))
+
+    def get_multi(self, keys):
+        mapped = {self._key(key): key for key in keys}
+        return {mapped[key]: value for key, value in
+                self.client.get_multi(list(mapped)).items()}
+
+    def set(self, key, value, time=0):
+        return self.client.set(self._key(key), value, time=time)
+
+    def delete(self, key):
+        return self.client.delete(self._key(key))
+
+
+class CacheMetrics(object):
+
+    def __init__(self):
+        self.lock = Lock()
+        self.counts = dict.fromkeys([
+            'local_hits', 'remote_hits', 'misses', 'loads', 'coalesced',
+            'early_refreshes', 'load_errors'], 0)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def observe(self, seconds):
+        self.latencies.append(seconds)
+
+    def hit_ratio(self):
+        counts = self.counts
+        hits = counts['local_hits'] + counts['remote_hits']
+        total = hits + counts['misses']
+        return hits / float(total) if total else 0.0
+
+    def percentile(self, pct):
+        """Latency in ms of recent reads at the given percentile."""
+        samples = sorted(self.latencies)
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(len(samples) * pct / 100.0))
+        return samples[index] * 1000
+
+    def summary(self):
+        summary = dict(self.counts)
+        summary['hit_ratio'] = round(self.hit_ratio(), 4)
+        for pct in (50, 99):
+            summary['p{}_ms'.format(pct)] = round(self.percentile(pct), 3)
+        return summary
+
+
+class TieredCache(object):
+    """Cache-aside and read-through caching over a local LRU tier and an
+    optional remote tier (anything with the `InMemoryRemote` methods).
+
+    `beta` tunes early expiration: 0 turns it off, and above 1 favours
+    refreshing earlier."""
+
+    def __init__(self, remote=None, local_size=1024, default_ttl=DEFAULT_TTL,
+                 beta=1.0, timer=time):
+        self.remote = remote
+        self.local = LRUCache(local_size) if local_size else None
+        self.local_lock = Lock()
+        self.default_ttl = default_ttl
+        self.beta = beta
+        self.timer = timer
+        self.metrics = CacheMetrics()
+        # key -> Future of the load in flight.
+        self._inflight = {}
+        self._inflight_lock = Lock()
+
+    def _lookup(self, key):
+        """The entry from the nearest tier that has a live one."""
+        now = self.timer()
+        if self.local is not None:
+            with self.local_lock:
+                entry = self.local.get(key)
+            if entry is not _MISSING and entry.expires > now:
+                self.metrics.incr('local_hits')
+                return entry
+        if self.remote is not None:
+            entry = self.remote.get(key)
+            if entry is not None and entry.expires > now:
+                self.metrics.incr('remote_hits')
+                self._set_local(key, entry)
+                return entry
+        return None
+
+    def _set_local(self, key, entry):
+        if self.local is not None:
+            with self.local_lock:
+                self.local.set(key, entry)
+
+    def _store(self, key, value, ttl, delta=0.0):
+        ttl = self.default_ttl if ttl is None else ttl
+        entry = _Entry(value, self.timer() + ttl, delta)
+        self._set_local(key, entry)
+        if self.remote is not None:
+            # A little longer remotely, so an entry due for an early
+            # refresh can still be served while it happens.
+            self.remote.set(key, entry, time=int(ttl) + 1)
+        return entry
+
+    def _should_refresh(self, entry):
+        if not self.beta or not entry.delta:
+            return False
+        # log(random()) is negative, so this looks some random way into
+        # the future, further the slower the load.
+        return (self.timer() - entry.delta * self.beta * log(random()) >=
+                entry.expires)
+
+    def get(self, key, default=None):
+        start = perf_counter()
+        entry = self._lookup(key)
+        self.metrics.observe(perf_counter() - start)
+        if entry is None:
+            self.metrics.incr('misses')
+            return default
+        return entry.value
+
+    def get_many(self, keys):
+        """Values of the keys that are cached, using one round trip for
+        the ones the local tier doesn't have."""
+        found, remaining = {}, []
+        now = self.timer()
+        for key in keys:
+            entry = _MISSING
+            if self.local is not None:
+                with self.local_lock:
+                    entry = self.local.get(key)
+            if entry is not _MISSING and entry.expires > now:
+                self.metrics.incr('local_hits')
+                found[key] = entry.value
+            else:
+                remaining.append(key)
+        if remaining and self.remote is not None:
+            for key, entry in self.remote.get_multi(remaining).items():
+                if entry.expires > now:
+                    self.metrics.incr('remote_hits')
+                    self._set_local(key, entry)
+                    found[key] = entry.value
+        self.metrics.incr('misses', len(keys) - len(found))
+        return found
+
+    def set(self, key, value, ttl=None):
+        self._store(key, value, ttl)
+
+    def invalidate(self, key):
+        if self.local is not None:
+            with self.local_lock:
+                self.local.data.pop(key, None)
+        if self.remote is not None:
+            self.remote.delete(key)
+
+    def get_or_load(self, key, loader, ttl=None):
+        """The cached value, or `loader()`'s (which is then cached). Only
+        one load per key runs at a time; other callers wait for it."""
+        start = perf_counter()
+        entry = self._lookup(key)
+        if entry is not None:
+            if self._should_refresh(entry):
+                self.metrics.incr('early_refreshes')
+                # Whoever doesn't get to refresh just gets the old value.
+                self._load(key, loader, ttl, wait=False)
+            self.metrics.observe(perf_counter() - start)
+            return entry.value
+        self.metrics.incr('misses')
+        value = self._load(key, loader, ttl)
+        self.metrics.observe(perf_counter() - start)
+        return value
+
+    def _load(self, key, loader, ttl, wait=True):
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            if not wait:
+                return None
+            self.metrics.incr('coalesced')
+            return future.result()
+        try:
+            # A load that finished between our miss and taking the lead
+            # has already cached the value; don't load it a second time.
+            entry = self._lookup(key) if wait else None
+            if entry is not None:
+                future.set_result(entry.value)
+                return entry.value
+            began = self.timer()
+            value = loader()
+            self.metrics.incr('loads')
+            self._store(key, value, ttl, delta=self.timer() - began)
+            future.set_result(value)
+        except Exception as exc:
+            self.metrics.incr('load_errors')
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+        return value
+
+    def cached(self, ttl=None, key=None):
+        """Decorator: read-through caching of a function's results. `key`
+        builds the cache key from the arguments; by default it's the
+        function's name and the repr of its arguments."""
+        def decorator(func):
+            prefix = '{}.{}:'.format(func.__module__, func.__qualname__)
+
+            @wraps(func)
+            def _inner(*args, **kwargs):
+                if key is not None:
+                    cache_key = key(*args, **kwargs)
+                else:
+                    cache_key = prefix + repr((args, sorted(kwargs.items())))
+                return self.get_or_load(
+                    cache_key, lambda: func(*args, **kwargs), ttl)
+            return _inner
+        return decorator
+
+
+def _zipf_keys(count, keys=1000, alpha=1.2):
+    """Skewed key popularity, like most real caches see."""
+    return ['key{}'.format(int(paretovariate(alpha)) % keys)
+            for _ in range(count)]
+
+
+if DEBUG:
+    with Section('Tiered cache - read-through with a local and remote tier'):
+        loads = []
+
+        def slow_query(key):
+            loads.append(key)
+            sleep(0.005)
+            return key.upper()
+
+        remote = InMemoryRemote(latency=0.0005)
+        cache = TieredCache(remote=remote, local_size=100, default_ttl=60)
+        keys = _zipf_keys(3000)
+        for key in keys:
+            assert cache.get_or_load(key, lambda: slow_query(key)) == \
+                key.upper()
+        print_simple('Zipfian workload, 3000 reads', cache.metrics.summary())
+        assert len(loads) == len(set(keys))
+
+        print_h2('A second process sharing the remote tier')
+        other = TieredCache(remote=remote, local_size=100)
+        found = other.get_many(list(set(keys))[:50])
+        assert len(found) == 50
+        print_simple('get_many over 50 keys', other.metrics.summary())
+
+    with Section('Tiered cache - stampede protection'):
+        del loads[:]
+        cache = TieredCache(remote=InMemoryRemote(latency=0.0005))
+        results = []
+
+        def reader():
+            results.append(cache.get_or_load(
+                'hot', lambda: slow_query('hot')))
+
+        threads = [Thread(target=reader) for _ in range(32)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == ['HOT'] * 32 and loads == ['hot']
+        print_simple('32 concurrent misses, loads', len(loads))
+        print_simple('Metrics', cache.metrics.summary())
+
+        print_h2('Expiry and probabilistic early refresh')
+        now = [0.0]
+        cache = TieredCache(remote=InMemoryRemote(timer=lambda: now[0]),
+                            default_ttl=10, timer=lambda: now[0])
+        refresh_times = []
+
+        def report():
+            # Takes a (simulated) second to run.
+            refresh_times.append(round(now[0], 1))
+            now[0] += 1
+            return 'report'
+
+        for _ in range(500):
+            now[0] += 0.1
+            cache.get_or_load('report', report)
+        # Each refresh starts a little before the 10s are up, so readers
+        # never see a miss after the first.
+        print_simple('Loads started at', refresh_times)
+        assert cache.metrics.counts['misses'] == 1
+        assert all(later - earlier < 11 for earlier, later in zip(
+            refresh_times, refresh_times[1:]))
+
+        print_h2('Decorator')
+
+        @cache.cached(ttl=5)
+        def lookup_user(user_id):
+            loads.append(user_id)
+            return {'id': user_id}
+
+        del loads[:]
+        lookup_user(1), lookup_user(2), lookup_user(1)
+        print_simple('Loads for 3 calls', loads)
+        assert loads == [1, 2]
+        print_simple('Median read (ms)', round(median(
+            cache.metrics.latencies) * 1000, 4))